@@ -2,6 +2,7 @@
 ASGI config for My_workout_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Served by uvicorn workers under gunicorn when SERVER_MODE=asgi, see gunicorn.conf.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -12,5 +13,5 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'My_workout_tracker.settings')
-
+# Static files are served by StaticFilesMiddleware (see app_workout_tracker/assets.py)
 application = get_asgi_application()
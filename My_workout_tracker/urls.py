@@ -18,8 +18,12 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from app_workout_tracker.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('app_workout_tracker.urls')),
-    path('users/', include('users.urls'))
+    path('users/', include('users.urls')),
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
 ]+ static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -10,7 +10,6 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
-from dj_static import Cling
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'My_workout_tracker.settings')
-application = Cling(get_wsgi_application())
+application = get_wsgi_application()
@@ -1,8 +1,10 @@
 from django.contrib import admin
 
-from .models import Goal, Progress, Mistake, Topic
+from .models import Goal, Job, Progress, Mistake, Topic, TopicStats
 # Register your models here.
 admin.site.register(Goal)
 admin.site.register(Progress)
 admin.site.register(Mistake)
-admin.site.register(Topic)
\ No newline at end of file
+admin.site.register(Topic)
+admin.site.register(TopicStats)
+admin.site.register(Job)
@@ -0,0 +1,222 @@
+'''JSON API mirroring the public and secure views, for the mobile client, read-only but for the
+delta sync through which it also saves what was written offline (see sync.py).
+
+Lists are keyset paginated like the HTML ones (see pagination.py) and answer
+{"results": [...], "next": cursor or null}. Every response carries an ETag computed from the
+id and date_added of the rows it is built from, and entry details a Last-Modified as well, so
+a client revalidating an unchanged resource gets a 304 before any JSON is encoded. Lists send
+no Last-Modified: a deleted row changes the rows of a page but not their newest date_added.'''
+
+import calendar
+import functools
+import hashlib
+import json
+
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware, get_token
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+
+from . import sync
+from .caching import cached_public_topics
+from .kinds import KINDS as ENTRY_KINDS
+from .models import Job, Topic
+from .pagination import paginate_keyset
+from .routers import read_from_replica
+
+## Kind of entry in the api urls -> its model
+KINDS = {kind.api_name: kind.model for kind in ENTRY_KINDS.values()}
+
+## Entry fields sent in lists, details add the text (which lists do not load)
+LIST_FIELDS = ('id', 'topic_id', 'summary', 'date_added')
+
+
+def api_view(login=False, methods=('GET', 'HEAD')):
+    '''Make a view answer the given methods only (GET by default), with JSON errors instead of the
+    HTML error pages, login redirect and CSRF failure page'''
+    def decorator(view):
+        # The CSRF check is made below instead of by the middleware, to answer its failure in JSON
+        @csrf_exempt
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = JsonResponse({'error': 'method not allowed'}, status=405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            if login and not request.user.is_authenticated:
+                return JsonResponse({'error': 'authentication required'}, status=401)
+            if CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {}) is not None:
+                return JsonResponse({'error': 'CSRF token missing or incorrect'}, status=403)
+            try:
+                response = view(request, *args, **kwargs)
+            except Http404:
+                return JsonResponse({'error': 'not found'}, status=404)
+            if login:
+                # Owner only data must not be kept by shared caches
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def entry_model(kind):
+    try:
+        return KINDS[kind]
+    except KeyError:
+        raise Http404('Unknown kind of entry')
+
+
+def topic_json(topic):
+    return {
+        'id': topic.id,
+        'name': topic.topic_name,
+        'public': topic.view_option,
+        'date_added': topic.date_added,
+        'goals': topic.goal_count,
+        'progress': topic.progress_count,
+        'mistakes': topic.mistake_count,
+        'last_entry_at': topic.last_entry_at,
+    }
+
+
+def entry_json(entry, detail=False):
+    data = {field: getattr(entry, field) for field in LIST_FIELDS}
+    if detail:
+        data['text'] = entry.text
+    return data
+
+
+def job_json(job):
+    return {
+        'id': job.id,
+        'task': job.task,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+        'result': job.result,
+        'error': job.error or None,
+    }
+
+
+def etag_of(*values):
+    return quote_etag(hashlib.md5(repr(values).encode()).hexdigest())
+
+
+def conditional_json(request, etag, build, last_modified=None):
+    '''JsonResponse of build(), or a 304 without calling it when the client's copy is current'''
+    timestamp = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = JsonResponse(build(), json_dumps_params={'separators': (',', ':')})
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    # Always revalidate, a 304 is cheap
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def topics_response(request, page):
+    # The counts are part of the representation, so they are part of the validator too
+    etag = etag_of(page.next_cursor, [(topic.id, topic.date_added, topic.last_entry_at, topic.goal_count,
+                                       topic.progress_count, topic.mistake_count) for topic in page])
+    return conditional_json(request, etag, lambda: {
+        'results': [topic_json(topic) for topic in page], 'next': page.next_cursor})
+
+
+def entries_response(request, entries):
+    page = paginate_keyset(entries.defer('text'), request.GET.get('cursor'))
+    etag = etag_of(page.next_cursor, [(entry.id, entry.date_added) for entry in page])
+    return conditional_json(request, etag, lambda: {
+        'results': [entry_json(entry) for entry in page], 'next': page.next_cursor})
+
+
+def entry_response(request, entry):
+    return conditional_json(request, etag_of(entry.id, entry.date_added),
+                            lambda: entry_json(entry, detail=True), last_modified=entry.date_added)
+
+
+## Public API ###
+@api_view()
+@read_from_replica
+def public_topics(request):
+    '''Public topics with their entry counts, newest first'''
+    return topics_response(request, cached_public_topics(request.GET.get('cursor')))
+
+
+@api_view()
+@read_from_replica
+def public_entries(request, topic_id, kind):
+    model = entry_model(kind)
+    topic = get_object_or_404(Topic.objects.filter(view_option=True), id=topic_id)
+    return entries_response(request, model.objects.filter(topic=topic))
+
+
+@api_view()
+@read_from_replica
+def public_entry(request, kind, entry_id):
+    model = entry_model(kind)
+    return entry_response(request, get_object_or_404(model.objects.public(), id=entry_id))
+
+
+## Secure API ###
+@api_view(login=True)
+@read_from_replica
+def secure_topics(request):
+    '''Topics of the logged in user with their entry counts, newest first'''
+    topics = Topic.objects.filter(owner=request.user).with_stats()
+    return topics_response(request, paginate_keyset(topics, request.GET.get('cursor')))
+
+
+@api_view(login=True)
+@read_from_replica
+def secure_entries(request, topic_id, kind):
+    model = entry_model(kind)
+    topic = get_object_or_404(Topic.objects.filter(owner=request.user), id=topic_id)
+    return entries_response(request, model.objects.filter(topic=topic))
+
+
+@api_view(login=True)
+def secure_entry(request, kind, entry_id):
+    model = entry_model(kind)
+    return entry_response(request, get_object_or_404(model.objects.owned_by(request.user), id=entry_id))
+
+
+@api_view(login=True)
+def secure_job(request, job_id):
+    '''Status of a background job queued for the logged in user, for clients to poll'''
+    job = get_object_or_404(Job, id=job_id, owner=request.user)
+    etag = etag_of(job.id, job.status, job.attempts, job.finished_at)
+    return conditional_json(request, etag, lambda: job_json(job))
+
+
+@api_view(login=True, methods=('GET', 'HEAD', 'POST'))
+def secure_sync(request):
+    '''Delta sync of the logged in user's topics and entries (see sync.py).
+
+    GET: the changes after ?cursor=, {"changes": [...], "cursor": ..., "more": true or false}, to
+    ask again with the returned cursor. It also sets the csrftoken cookie. POST: a JSON list of
+    creates and edits, saved all together and answered with their ids, or with a 400 listing the
+    errors and nothing saved. A POST sends the csrftoken cookie's value in an X-CSRFToken header,
+    or gets a 403.'''
+    if request.method == 'POST':
+        try:
+            batch = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'the body must be JSON'}, status=400)
+        try:
+            results = sync.push(request.user, batch)
+        except sync.PushRejected as rejected:
+            return JsonResponse({'errors': rejected.errors}, status=400)
+        return JsonResponse({'results': results})
+    # The token the pushes must send back, the middleware sets it as the csrftoken cookie
+    get_token(request)
+    changes, cursor, more = sync.changes(request.user, request.GET.get('cursor'))
+    response = JsonResponse({'changes': changes, 'cursor': cursor, 'more': more},
+                            json_dumps_params={'separators': (',', ':')})
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class AppWorkoutTrackerConfig(AppConfig):
     name = 'app_workout_tracker'
+
+    def ready(self):
+        # Connecting the signal receivers
+        from . import signals
+        # Registering the background tasks (see jobs.py)
+        from . import deletion
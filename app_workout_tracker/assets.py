@@ -0,0 +1,39 @@
+'''Static files served by the application, the way a CDN would serve them.
+
+collectstatic (with the CompressedManifestStaticFilesStorage production uses, see settings.py)
+writes every file under a name holding a hash of its content, e.g.
+vendor/jquery-3.3.1/jquery.min.a09e13ee94d5.js, with .gz and .br copies next to it, and
+{% static %} links to those names. StaticFilesMiddleware serves them with the smallest encoding
+the browser accepts and Cache-Control: immutable for ten years, as a changed file gets a new name.
+A repeat visit then only downloads the page itself.
+
+It is WhiteNoise's middleware, which only runs sync: under ASGI, Django would run it, and so every
+request, in the one thread it shares between all sync code. This one also runs async.'''
+
+import asyncio
+
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    '''WhiteNoiseMiddleware, without a thread in between under ASGI. Listed first in MIDDLEWARE.'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django call this one without a thread in between
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # Only opens the file, which is then streamed from the page cache
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
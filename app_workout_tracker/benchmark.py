@@ -0,0 +1,275 @@
+'''Per-endpoint benchmark of every route in app_workout_tracker/urls.py and users/urls.py.
+
+Each Scenario knows how to build one request for its route from the seeded data. run_benchmark()
+times it with the Django test client and records latency percentiles, SQL query count, time
+spent in the database and response size, then checks the results against BUDGETS. It is driven
+by `manage.py bench_endpoints`.'''
+
+import contextlib
+import itertools
+import math
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import get_resolver, reverse
+from django.urls.resolvers import URLResolver
+from django.utils import timezone
+
+from . import sync
+from .management.commands.seed_workouts import seeded_users
+from .models import Job, Topic, Goal, Progress, Mistake
+from .pagination import encode_cursor
+
+# Most queries each route may run, whatever the size of the dataset. Logged in requests pay
+# two of them (session and user) before the view starts, entry writes one or two more for their
+# TopicStats update (see stats.py), and every write one for its change number, deletes one more
+# for their tombstone (see sync.py).
+BUDGETS = {
+    'awt:public_topics_list': {'queries': 1},
+    'awt:public_subtopic_list': {'queries': 2},
+    'awt:public_subtopic_detail': {'queries': 1},
+    'awt:public_search': {'queries': 1},
+    'awt:topic_chart': {'queries': 5},
+    'awt:public_topic_timeline': {'queries': 2},
+    'awt:secure_timeline': {'queries': 3},
+    'awt:secure_topic_timeline': {'queries': 4},
+    'awt:secure_topics_list': {'queries': 3},
+    'awt:secure_search': {'queries': 3},
+    'awt:secure_subtopic_list': {'queries': 4},
+    'awt:secure_subtopic_detail': {'queries': 3},
+    'awt:add_topic': {'queries': 5},
+    'awt:delete_topic': {'queries': 8},
+    'awt:add_subtopic': {'queries': 6},
+    'awt:edit_subtopic': {'queries': 7},
+    'awt:delete_subtopic': {'queries': 8},
+    'awt:import_entries': {'queries': 10},
+    'awt:export_history': {'queries': 6},
+    'awt:api_public_topics': {'queries': 1},
+    'awt:api_public_entries': {'queries': 2},
+    'awt:api_public_entry': {'queries': 1},
+    'awt:api_secure_topics': {'queries': 3},
+    'awt:api_secure_entries': {'queries': 4},
+    'awt:api_secure_entry': {'queries': 3},
+    'awt:api_secure_job': {'queries': 3},
+    'awt:api_secure_sync': {'queries': 7},
+    'users:login': {'queries': 5},
+    'users:logout': {'queries': 4},
+    'users:register': {'queries': 7},
+}
+
+NAMESPACES = ('awt', 'users')
+
+
+class Fixtures:
+    '''The rows of the seeded dataset that the scenarios request'''
+
+    def __init__(self, prefix):
+        self.user = seeded_users(prefix).order_by('id').first()
+        if self.user is None:
+            raise LookupError('No seeded users named %s*, run seed_workouts first' % prefix)
+        self.topic = Topic.objects.filter(owner=self.user).order_by('id').first()
+        self.public_topic = Topic.objects.filter(view_option=True).order_by('id').first()
+        self.progress = Progress.objects.filter(topic=self.topic).order_by('id').first()
+        self.public_progress = Progress.objects.public().order_by('id').first()
+        if None in (self.topic, self.public_topic, self.progress, self.public_progress):
+            raise LookupError('The seeded dataset is too small to benchmark every route, seed more rows')
+        # Done already, so that no worker ever runs it
+        self.job = Job.objects.filter(owner=self.user).order_by('id').first() or Job.objects.create(
+            task='purge_topic', args={'topic_id': 0}, owner=self.user, status=Job.DONE,
+            run_at=timezone.now(), finished_at=timezone.now())
+        self.counter = itertools.count()
+
+    def unique(self, stem):
+        return '%s%d_%d' % (stem, int(time.time()), next(self.counter))
+
+
+class Scenario:
+    '''One request against a route; prepare() runs untimed before every request and returns
+    (method, url, data)'''
+
+    def __init__(self, name, prepare, login=True):
+        self.name = name
+        self.prepare = prepare
+        self.login = login
+
+
+def _scenarios():
+    def entry(fx):
+        return Progress.objects.create(topic=fx.topic, summary='bench', text='bench')
+
+    return [
+        Scenario('awt:public_topics_list', lambda fx: ('get', reverse('awt:public_topics_list'), None), login=False),
+        Scenario('awt:public_subtopic_list', lambda fx: ('get', reverse('awt:public_subtopic_list', kwargs={
+            'topic_id': fx.public_topic.id, 'subtopic_name': 'progress_list'}), None), login=False),
+        Scenario('awt:public_subtopic_detail', lambda fx: ('get', reverse('awt:public_subtopic_detail', kwargs={
+            'subtopic_id': fx.public_progress.id, 'subtopic_name': 'progress_list'}), None), login=False),
+        Scenario('awt:public_search', lambda fx: ('get', reverse('awt:public_search'), {'q': 'knee pain'}), login=False),
+        Scenario('awt:public_topic_timeline', lambda fx: ('get', reverse('awt:public_topic_timeline', kwargs={
+            'topic_id': fx.public_topic.id}), None), login=False),
+        Scenario('awt:secure_timeline', lambda fx: ('get', reverse('awt:secure_timeline'), None)),
+        Scenario('awt:secure_topic_timeline', lambda fx: ('get', reverse('awt:secure_topic_timeline', kwargs={
+            'topic_id': fx.topic.id}), None)),
+        Scenario('awt:topic_chart', lambda fx: ('get', reverse('awt:topic_chart', kwargs={
+            'topic_id': fx.public_topic.id, 'chart': 'weekly', 'fmt': 'svg'}), None), login=False),
+        Scenario('awt:secure_search', lambda fx: ('get', reverse('awt:secure_search'), {'q': 'knee pain'})),
+        Scenario('awt:secure_topics_list', lambda fx: ('get', reverse('awt:secure_topics_list'), None)),
+        Scenario('awt:secure_subtopic_list', lambda fx: ('get', reverse('awt:secure_subtopic_list', kwargs={
+            'topic_id': fx.topic.id, 'topic_name': fx.topic.topic_name, 'subtopic_name': 'progress_list'}), None)),
+        Scenario('awt:secure_subtopic_detail', lambda fx: ('get', reverse('awt:secure_subtopic_detail', kwargs={
+            'topic_id': fx.topic.id, 'subtopic_id': fx.progress.id, 'subtopic_name': 'progress_list'}), None)),
+        Scenario('awt:add_topic', lambda fx: ('post', reverse('awt:add_topic'), {
+            'topic_name': fx.unique('bench'), 'view_option': True})),
+        Scenario('awt:delete_topic', lambda fx: ('get', reverse('awt:delete_topic', args=[
+            Topic.objects.create(topic_name=fx.unique('bench'), owner=fx.user).id]), None)),
+        Scenario('awt:add_subtopic', lambda fx: ('post', reverse('awt:add_subtopic', kwargs={
+            'topic_id': fx.topic.id, 'subtopic': 'progress_list'}), {'summary': 'bench', 'text': 'bench'})),
+        Scenario('awt:edit_subtopic', lambda fx: ('post', reverse('awt:edit_subtopic', kwargs={
+            'subtopic_id': fx.progress.id, 'subtopic_name': 'progress_list'}), {'summary': 'bench', 'text': 'bench'})),
+        Scenario('awt:delete_subtopic', lambda fx: ('get', reverse('awt:delete_subtopic', kwargs={
+            'subtopic_id': entry(fx).id, 'subtopic_name': 'progress_list'}), None)),
+        Scenario('awt:import_entries', lambda fx: ('post', reverse('awt:import_entries', kwargs={
+            'topic_id': fx.topic.id, 'subtopic': 'progress_list'}), {'file': SimpleUploadedFile(
+                'bench.csv', b'summary,text\n' + b'bench,bench\n' * 100, 'text/csv')})),
+        Scenario('awt:export_history', lambda fx: ('get', reverse('awt:export_history', args=['ndjson']), None)),
+        Scenario('awt:api_public_topics', lambda fx: ('get', reverse('awt:api_public_topics'), None), login=False),
+        Scenario('awt:api_public_entries', lambda fx: ('get', reverse('awt:api_public_entries', kwargs={
+            'topic_id': fx.public_topic.id, 'kind': 'progress'}), None), login=False),
+        Scenario('awt:api_public_entry', lambda fx: ('get', reverse('awt:api_public_entry', kwargs={
+            'kind': 'progress', 'entry_id': fx.public_progress.id}), None), login=False),
+        Scenario('awt:api_secure_topics', lambda fx: ('get', reverse('awt:api_secure_topics'), None)),
+        Scenario('awt:api_secure_entries', lambda fx: ('get', reverse('awt:api_secure_entries', kwargs={
+            'topic_id': fx.topic.id, 'kind': 'progress'}), None)),
+        Scenario('awt:api_secure_entry', lambda fx: ('get', reverse('awt:api_secure_entry', kwargs={
+            'kind': 'progress', 'entry_id': fx.progress.id}), None)),
+        # The changes since the entry written before, as a client syncing often gets them
+        Scenario('awt:api_secure_sync', lambda fx: ('get', reverse('awt:api_secure_sync'), {
+            'cursor': encode_cursor(entry(fx).change_seq - 1, len(sync.FORMS), 0)})),
+        Scenario('awt:api_secure_job', lambda fx: ('get', reverse('awt:api_secure_job', kwargs={
+            'job_id': fx.job.id}), None)),
+        Scenario('users:login', lambda fx: ('post', reverse('users:login'), {
+            'username': fx.user.username, 'password': '12345'}), login=False),
+        Scenario('users:logout', lambda fx: ('get', reverse('users:logout'), None)),
+        Scenario('users:register', lambda fx: ('post', reverse('users:register'), {
+            'username': fx.unique('bench'), 'password1': 'Bench-pass-123', 'password2': 'Bench-pass-123'}),
+            login=False),
+    ]
+
+
+def route_names(namespaces=NAMESPACES):
+    '''Names of every route in the given URL namespaces, as "namespace:name"'''
+    names = set()
+
+    def walk(patterns, namespace):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, pattern.namespace or namespace)
+            elif pattern.name and namespace in namespaces:
+                names.add('%s:%s' % (namespace, pattern.name))
+
+    walk(get_resolver().url_patterns, None)
+    return names
+
+
+def percentile(samples, percent):
+    '''Nearest-rank percentile of an already sorted list'''
+    rank = max(1, math.ceil(percent / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+# Statements left out of the query counts: savepoints only show up when already inside a transaction,
+# e.g. under the test suite, and SQLite begins its transactions with a statement of its own
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK', 'BEGIN', 'COMMIT')
+
+
+class QueryTimer:
+    '''Database execute wrapper counting the queries of a request and the time they took'''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            if not sql.startswith(TRANSACTION_CONTROL):
+                self.count += 1
+
+
+def measure(scenario, fixtures, iterations, warmup):
+    client = Client()
+    latencies, db_times, queries, sizes, statuses = [], [], [], [], set()
+    for n in range(warmup + iterations):
+        if scenario.login:
+            # Logging in again every time keeps logout and friends repeatable
+            client.force_login(fixtures.user)
+        else:
+            client.logout()
+        method, url, data = scenario.prepare(fixtures)
+        timer = QueryTimer()
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data) if data is not None else getattr(client, method)(url)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        if n < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        db_times.append(timer.seconds * 1000)
+        queries.append(timer.count)
+        sizes.append(len(body))
+        statuses.add(response.status_code)
+
+    latencies.sort()
+    return {
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries': max(queries),
+        'db_ms': round(sum(db_times) / len(db_times), 3),
+        'bytes': max(sizes),
+        'status': sorted(statuses),
+    }
+
+
+def check_budgets(results, budgets):
+    '''Return a message for every measured value above its budget, and for every error response'''
+    failures = ['%s: answered %s' % (name, result['status']) for name, result in sorted(results.items())
+                if max(result['status']) >= 400]
+    for name, budget in sorted(budgets.items()):
+        for key, limit in budget.items():
+            if name in results and results[name][key] > limit:
+                failures.append('%s: %s %s exceeds budget %s' % (name, key, results[name][key], limit))
+    return failures
+
+
+def run_benchmark(prefix='seed', iterations=20, warmup=2, budgets=None, only=None):
+    '''Benchmark every route and return the report dictionary'''
+    scenarios = _scenarios()
+    missing = route_names() - {scenario.name for scenario in scenarios}
+    if missing:
+        raise LookupError('No benchmark scenario for %s' % ', '.join(sorted(missing)))
+
+    fixtures = Fixtures(prefix)
+    results = {}
+    # The query counters wrap this thread's connections, the async views must query through them too
+    with override_settings(ASYNC_DB_THREAD_SENSITIVE=True):
+        for scenario in scenarios:
+            if only and scenario.name not in only:
+                continue
+            results[scenario.name] = measure(scenario, fixtures, iterations, warmup)
+
+    budgets = budgets if budgets is not None else BUDGETS
+    return {
+        'dataset': {model._meta.label: model.objects.count() for model in (User, Topic, Goal, Progress, Mistake)},
+        'iterations': iterations,
+        'endpoints': results,
+        'budget_failures': check_budgets(results, budgets),
+    }
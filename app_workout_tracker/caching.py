@@ -0,0 +1,79 @@
+'''Caching of the public topic list, the anonymous landing page.
+
+Cached pages live under a version key that is replaced whenever a public topic may have changed
+(see signals.py), so invalidating is one cache write however many pages are cached. When a page
+is missing, a single request rebuilds it: the others serve the previous copy if there is one,
+or wait for the rebuild instead of all hitting the database at once.'''
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Topic
+from .pagination import paginate_keyset
+from .routers import primary_reads
+
+PUBLIC_TOPICS_VERSION = 'awt:public_topics:version'
+
+
+def public_topics_version():
+    '''Current version of the public topic list, starting a new one if it was evicted'''
+    version = cache.get(PUBLIC_TOPICS_VERSION)
+    if version is None:
+        version = str(time.time_ns())
+        if not cache.add(PUBLIC_TOPICS_VERSION, version, None):
+            version = cache.get(PUBLIC_TOPICS_VERSION, version)
+    return version
+
+
+def invalidate_public_topics():
+    '''Make every cached page of the public topic list stale'''
+    # A fresh timestamp rather than an increment, so an evicted counter can never bring back old pages
+    cache.set(PUBLIC_TOPICS_VERSION, str(time.time_ns()), None)
+
+
+def get_or_build(key, stale_key, build, timeout):
+    '''Return the cached value of key, letting only one caller at a time run build() on a miss'''
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = key + ':lock'
+    deadline = time.monotonic() + settings.CACHE_REBUILD_WAIT
+    while not cache.add(lock_key, 1, settings.CACHE_REBUILD_WAIT):
+        # Somebody else is rebuilding: serve the previous copy, or wait a little for theirs
+        stale = cache.get(stale_key)
+        if stale is not None:
+            return stale
+        if time.monotonic() > deadline:
+            # The rebuild is taking too long, do not keep this request waiting any more
+            return build()
+        time.sleep(0.02)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    try:
+        value = build()
+        cache.set(key, value, timeout)
+        # The stale copy outlives the fresh one, it is only read while a rebuild is running
+        cache.set(stale_key, value, timeout * 10)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def build_public_topics(cursor):
+    # From the primary, a lagging replica would keep the change that invalidated the page out of its rebuild
+    with primary_reads():
+        return paginate_keyset(Topic.objects.filter(view_option=True).with_stats(), cursor)
+
+
+def cached_public_topics(cursor=None):
+    '''The KeysetPage of public topics after cursor, served from the cache when possible'''
+    page = hashlib.md5((cursor or '').encode()).hexdigest()
+    key = 'awt:public_topics:%s:%s' % (public_topics_version(), page)
+    return get_or_build(key, 'awt:public_topics:stale:%s' % page, lambda: build_public_topics(cursor),
+                        settings.PUBLIC_TOPICS_CACHE_TIMEOUT)
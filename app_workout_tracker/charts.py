@@ -0,0 +1,149 @@
+'''Per-topic progress charts drawn with pygal.
+
+Rendered charts are kept in the cache under a key made of the topic id, the date_added of its
+newest entry and its entry counts, all read from its TopicStats row. Any entry write changes
+that key, so a chart is drawn again only when its data has changed, and nothing has to be
+invalidated.
+
+PNG versions are rasterized by CairoSVG in a small process pool. A request for a PNG that is
+not cached yet only queues it and answers 202, it never waits for the conversion. A conversion
+that fails is logged and remembered in the cache in place of the PNG, so the chart is served as
+SVG until its data changes rather than queued again and again.'''
+
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import threading
+
+import pygal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncWeek
+
+from . import rasterize
+from .models import TopicStats, Goal, Progress, Mistake
+
+logger = logging.getLogger(__name__)
+
+KINDS = [(Goal, 'Goals'), (Progress, 'Progress'), (Mistake, 'Mistakes')]
+
+# Cached in place of a PNG that could not be made, a str where a PNG is bytes
+RASTERIZE_FAILED = 'rasterize-failed'
+
+_pool = None
+_pending = {}
+# Reentrant, a future that is already done runs its callback right away
+_lock = threading.RLock()
+
+
+def chart_key(topic, chart, fmt):
+    '''Cache key of a chart of topic, which changes with every change to its entries'''
+    stats = (TopicStats.objects.filter(topic=topic)
+             .values_list('last_entry_at', 'goal_count', 'progress_count', 'mistake_count').first())
+    stamp = '%s:%s:%s:%s' % stats if stats else 'empty'
+    return 'awt:chart:%s:%d:%s:%s' % (chart, topic.id, stamp.replace(' ', '_'), fmt)
+
+
+def weekly_counts(topic):
+    '''Sorted list of weeks, and for every kind its entry count in each of those weeks'''
+    counts = {}
+    for model, label in KINDS:
+        rows = (model.objects.filter(topic=topic).order_by().annotate(week=TruncWeek('date_added'))
+                .values('week').annotate(n=Count('id')).values_list('week', 'n'))
+        counts[label] = dict(rows)
+    weeks = sorted(set().union(*counts.values()))
+    return weeks, {label: [by_week.get(week, 0) for week in weeks] for label, by_week in counts.items()}
+
+
+def render_weekly(topic):
+    weeks, series = weekly_counts(topic)
+    chart = pygal.StackedBar(title='%s: entries per week' % topic, x_label_rotation=30, height=400)
+    chart.x_labels = [week.strftime('%Y-%m-%d') for week in weeks]
+    for label, values in series.items():
+        chart.add(label, values)
+    return chart.render()
+
+
+def render_cumulative(topic):
+    weeks, series = weekly_counts(topic)
+    chart = pygal.Line(title='%s: entries so far' % topic, x_label_rotation=30, height=400, fill=False)
+    chart.x_labels = [week.strftime('%Y-%m-%d') for week in weeks]
+    for label, values in series.items():
+        total, running = 0, []
+        for value in values:
+            total += value
+            running.append(total)
+        chart.add(label, running)
+    return chart.render()
+
+
+CHARTS = {
+    'weekly': render_weekly,
+    'cumulative': render_cumulative,
+}
+
+
+def chart_svg(topic, chart):
+    '''SVG bytes of chart for topic, drawn only if the cache has none for the current data'''
+    key = chart_key(topic, chart, 'svg')
+    svg = cache.get(key)
+    if svg is None:
+        svg = CHARTS[chart](topic)
+        cache.set(key, svg, settings.CHART_CACHE_TIMEOUT)
+    return svg
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked, a fork of a threaded server process can inherit held locks
+        _pool = concurrent.futures.ProcessPoolExecutor(settings.CHART_PNG_WORKERS,
+                                                       mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _store_png(key, future):
+    with _lock:
+        _pending.pop(key, None)
+    error = future.exception()
+    if error is None:
+        cache.set(key, future.result(), settings.CHART_CACHE_TIMEOUT)
+    else:
+        logger.error('Rasterizing chart %s failed', key, exc_info=error)
+        cache.set(key, RASTERIZE_FAILED, settings.CHART_CACHE_TIMEOUT)
+
+
+class RasterizeFailed(Exception):
+    '''The PNG of a chart could not be made from its SVG'''
+
+
+def chart_png(topic, chart):
+    '''PNG bytes of chart for topic if already rasterized, otherwise None once it is queued.
+
+    Raises OverflowError when CHART_PNG_QUEUE conversions are already waiting, and
+    RasterizeFailed when the conversion of the chart's current data failed.'''
+    key = chart_key(topic, chart, 'png')
+    png = cache.get(key)
+    if png == RASTERIZE_FAILED:
+        raise RasterizeFailed(key)
+    if png is not None:
+        return png
+    if key in _pending:
+        return None
+    svg = chart_svg(topic, chart)
+    with _lock:
+        if key not in _pending:
+            if len(_pending) >= settings.CHART_PNG_QUEUE:
+                raise OverflowError('Too many charts waiting to be rasterized')
+            future = _get_pool().submit(rasterize.svg_to_png, svg)
+            _pending[key] = future
+            future.add_done_callback(lambda done: _store_png(key, done))
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def png_available():
+    '''Whether PNG charts can be made here, CairoSVG needs the cairo library installed'''
+    return rasterize.available()
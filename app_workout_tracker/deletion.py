@@ -0,0 +1,89 @@
+'''Deleting topics in the background, a bounded batch of entries at a time.
+
+topic.delete() would have Django's cascade collector load every entry of the topic into memory
+and delete them all in one transaction, holding its locks for as long as that takes. Instead,
+delete_topic() only marks the topic pending_delete, which hides it at once: Topic.objects and
+every view skip it from then on, and queues a purge_topic job (see jobs.py). The job deletes its
+entries TOPIC_DELETE_BATCH_SIZE at a time, each batch in a short transaction of its own and without
+loading them, with a TOPIC_DELETE_PAUSE between batches for the other writers. The topic's
+TopicStats counts go down with every batch, so they tell how far along it is (the owner's topic
+list shows them), and the emptied topic row goes last.
+
+An interrupted job picks up where it stopped when it runs again, and
+`manage.py delete_pending_topics` finishes the topics whose job failed for good.'''
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from . import jobs
+from .kinds import KINDS
+from .models import Tombstone, Topic, TopicStats
+
+logger = logging.getLogger(__name__)
+
+## Entry model -> its count on TopicStats
+COUNTS = {kind.model: '%s_count' % kind.model._meta.model_name for kind in KINDS.values()}
+
+
+def delete_topic(topic):
+    '''Hide topic now and queue the job deleting it, returns the job'''
+    with transaction.atomic():
+        topic.pending_delete = True
+        # Saved rather than updated, so the signals drop it from the cached public list
+        topic.save(update_fields=['pending_delete'])
+        # Gone as far as the offline clients are concerned, with its entries (see sync.py)
+        Tombstone.objects.record(topic)
+        return jobs.enqueue('purge_topic', {'topic_id': topic.pk}, owner_id=topic.owner_id)
+
+
+def delete_batch(model, topic_id, batch_size):
+    '''Delete up to batch_size entries of the topic, returns how many went'''
+    table = model._meta.db_table
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            # By primary key, picked through the entry table's (topic, -date_added, -id) index
+            cursor.execute('DELETE FROM %s WHERE id IN (SELECT id FROM %s WHERE topic_id = %%s LIMIT %%s)'
+                           % (table, table), [topic_id, batch_size])
+            deleted = cursor.rowcount
+        if deleted:
+            field = COUNTS[model]
+            TopicStats.objects.filter(topic_id=topic_id).update(**{field: F(field) - deleted})
+    return deleted
+
+
+@jobs.task('purge_topic')
+def purge_topic(topic_id, batch_size=None, pause=None):
+    '''Delete the entries of a pending_delete topic batch by batch, then the topic. Returns the number
+    of entries deleted, and does nothing for a topic that is not pending deletion.'''
+    batch_size = batch_size or settings.TOPIC_DELETE_BATCH_SIZE
+    pause = settings.TOPIC_DELETE_PAUSE if pause is None else pause
+    if not Topic.all_objects.filter(pk=topic_id, pending_delete=True).exists():
+        return 0
+    total = 0
+    for model in COUNTS:
+        while True:
+            deleted = delete_batch(model, topic_id, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                break
+            logger.info('Deleting topic %s: %d entries deleted', topic_id, total)
+            time.sleep(pause)
+    # Nothing left for the cascade to collect but the stats row; not Topic.delete(), which would
+    # leave a second tombstone
+    Topic.all_objects.filter(pk=topic_id, pending_delete=True).delete()
+    logger.info('Deleted topic %s and its %d entries', topic_id, total)
+    return total
+
+
+def purge_pending(batch_size=None, pause=None):
+    '''Finish every topic left pending deletion, returns how many'''
+    topic_ids = list(Topic.all_objects.filter(pending_delete=True).order_by('pk').values_list('pk', flat=True))
+    for topic_id in topic_ids:
+        purge_topic(topic_id, batch_size, pause)
+    return len(topic_ids)
+
@@ -0,0 +1,78 @@
+'''Streaming export of everything a user owns, for the export_history view.
+
+Rows are read with .iterator(), which on PostgreSQL is a server-side cursor fetching
+EXPORT_CHUNK_SIZE rows at a time, and are encoded and sent as they arrive, so memory use
+does not grow with the size of the history.'''
+
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Topic, Goal, Progress, Mistake
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+COLUMNS = ['record', 'id', 'topic_id', 'topic_name', 'view_option', 'summary', 'text', 'date_added']
+
+## Characters collected before handing a piece of the response to the server
+WRITE_SIZE = 64 * 1024
+
+
+def history_rows(user):
+    '''Yield a tuple of COLUMNS for every topic of user and then every entry of those topics'''
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    topics = (Topic.objects.filter(owner=user).order_by('-date_added', '-id')
+              .values_list('id', 'topic_name', 'view_option', 'date_added'))
+    for pk, topic_name, view_option, date_added in topics.iterator(chunk_size=chunk_size):
+        yield ('topic', pk, pk, topic_name, view_option, '', '', date_added)
+
+    for model in (Goal, Progress, Mistake):
+        record = model._meta.model_name
+        # Newest first, in the order of the (owner, -date_added, -id) index
+        entries = (model.objects.owned_by(user).order_by('-date_added', '-id')
+                   .values_list('id', 'topic_id', 'topic__topic_name', 'is_public', 'summary', 'text',
+                                'date_added'))
+        for row in entries.iterator(chunk_size=chunk_size):
+            yield (record,) + row
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(lines, size=WRITE_SIZE):
+    '''Join lines into pieces of about size characters, one write per piece instead of per row'''
+    piece, length = [], 0
+    for line in lines:
+        piece.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(piece)
+            piece, length = [], 0
+    if piece:
+        yield ''.join(piece)
+
+
+def export_history(user, fmt):
+    '''Iterator over the encoded export of user in fmt, one of FORMATS'''
+    lines = _csv_lines if fmt == 'csv' else _ndjson_lines
+    return buffered(lines(history_rows(user)))
@@ -38,3 +38,6 @@ class MistakeForm(forms.ModelForm):
         labels = {'summary':'Summary:','text':'Details:'}
         widgets = {'text':forms.Textarea(attrs={'cols':80})}
 
+class ImportForm(forms.Form):
+    '''Upload of a CSV or NDJSON file of entries, with summary and text columns'''
+    file = forms.FileField(label='CSV or NDJSON file:')
@@ -0,0 +1,155 @@
+'''Bulk import of Goal, Progress and Mistake entries from an uploaded CSV or NDJSON file.
+
+The upload is parsed a line at a time and every row is checked against the fields of the
+GoalForm, ProgressForm or MistakeForm the single entry views use. Valid rows are inserted with
+bulk_create() IMPORT_BATCH_SIZE at a time inside one transaction, which is rolled back if any
+row failed, so an import either lands completely or not at all.'''
+
+import codecs
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .caching import invalidate_public_topics
+from .kinds import KINDS
+from .models import SyncCounter
+from .stats import rebuild_topic_stats
+
+## subtopic name, as used in the urls, and the export's record column -> form of that entry
+FORMS = {subtopic_name: kind.form for subtopic_name, kind in KINDS.items()}
+RECORDS = {form._meta.model._meta.model_name: form for form in FORMS.values()}
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+
+class ImportFailed(Exception):
+    '''Raised inside the import transaction to roll it back'''
+
+
+class ImportResult:
+    '''Rows imported per model, and (line, message) of every row that was rejected'''
+
+    def __init__(self):
+        self.created = {}
+        self.errors = []
+        self.error_count = 0
+
+    @property
+    def total(self):
+        return sum(self.created.values())
+
+    def reject(self, line, message):
+        self.error_count += 1
+        # Only the first few are shown, a wrong file would otherwise report every one of its rows
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def file_format(name):
+    '''csv or ndjson according to the extension of the file name, None if it is neither'''
+    for extension, fmt in EXTENSIONS.items():
+        if name.lower().endswith(extension):
+            return fmt
+    return None
+
+
+def parse_rows(upload, fmt):
+    '''Yield (line number, dict) for every row of the uploaded file, without reading it all in'''
+    lines = codecs.iterdecode(upload, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # line_num is where the row ended, quoted newlines make a row span several lines
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else 'not a JSON object'
+
+
+def clean_row(form_class, row):
+    '''Validate row with the fields of form_class, returning the cleaned values or raising ValidationError'''
+    cleaned, errors = {}, []
+    for name, field in form_class.base_fields.items():
+        try:
+            cleaned[name] = field.clean(row.get(name))
+        except ValidationError as error:
+            errors.append('%s: %s' % (name, ' '.join(error.messages)))
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+def import_entries(topic, upload, fmt, subtopic, batch_size=None):
+    '''Import the rows of upload into topic and return an ImportResult.
+
+    Rows are entries of the subtopic kind, unless the file has a record column (as the export
+    writes) naming the kind of each row; topic records are skipped.'''
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    result = ImportResult()
+    pending = {form._meta.model: [] for form in FORMS.values()}
+
+    def flush(model):
+        if pending[model]:
+            # Numbered for the delta sync by hand too, see sync.py
+            last = SyncCounter.objects.next_seq(topic.owner_id, count=len(pending[model]))
+            for seq, entry in enumerate(pending[model], last - len(pending[model]) + 1):
+                entry.change_seq = seq
+            model.objects.bulk_create(pending[model])
+            result.created[model] = result.created.get(model, 0) + len(pending[model])
+            pending[model] = []
+
+    try:
+        with transaction.atomic():
+            for line, row in parse_rows(upload, fmt):
+                if isinstance(row, str):
+                    result.reject(line, row)
+                    continue
+                record = row.get('record')
+                if record == 'topic':
+                    continue
+                form_class = RECORDS.get(record) if record else FORMS[subtopic]
+                if form_class is None:
+                    result.reject(line, 'record: unknown kind %r' % record)
+                    continue
+                try:
+                    cleaned = clean_row(form_class, row)
+                except ValidationError as error:
+                    result.reject(line, '; '.join(error.messages))
+                    continue
+                if result.error_count:
+                    # Nothing will be saved any more, only keep validating
+                    continue
+                model = form_class._meta.model
+                # With the copies of the topic's fields that save() would make, see AtomicEntry
+                pending[model].append(model(topic=topic, owner_id=topic.owner_id, is_public=topic.view_option,
+                                            **cleaned))
+                if len(pending[model]) >= batch_size:
+                    flush(model)
+            if result.error_count:
+                raise ImportFailed
+            for model in pending:
+                flush(model)
+            # bulk_create() sends no signals, bring the derived data up to date by hand
+            rebuild_topic_stats([topic.id])
+            if topic.view_option:
+                invalidate_public_topics()
+                transaction.on_commit(invalidate_public_topics)
+    except ImportFailed:
+        result.created = {}
+    except (UnicodeDecodeError, csv.Error) as error:
+        result.created = {}
+        result.reject(0, 'The file could not be read: %s' % error)
+    return result
@@ -0,0 +1,180 @@
+'''Background jobs kept in the database and run by `manage.py run_workers`, no broker needed.
+
+enqueue() stores a Job row naming a task registered with @task and its keyword arguments. As it
+is a row like any other, it is queued in the caller's transaction and only becomes visible to the
+workers if that commits. Each worker thread claims the oldest due job:
+
+* on PostgreSQL with SELECT ... FOR UPDATE SKIP LOCKED, so the workers never wait on each other
+  and no two of them get the same job;
+* on SQLite, which has no row locks but runs one write at a time, with an UPDATE that only
+  succeeds while the job is still queued.
+
+A job that raises is queued again JOB_RETRY_DELAY seconds later, twice as long after each failed
+attempt, until it has failed max_attempts times. A job still running after JOB_LOCK_TIMEOUT
+seconds is taken for the job of a dead worker and queued again as well, so tasks must cope with
+running again after an interruption. Clients poll a job through the api_secure_job endpoint.'''
+
+import datetime
+import logging
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+## Task name -> function called with the job's args, returning the job's result (JSON)
+TASKS = {}
+
+# SQLite locks the whole database to write, the worker threads of a process take turns instead
+_sqlite_writes = threading.Lock()
+
+
+def task(name):
+    '''Register the decorated function as the task name'''
+    def decorator(function):
+        TASKS[name] = function
+        return function
+    return decorator
+
+
+def enqueue(name, args=None, owner_id=None, delay=0, max_attempts=None):
+    '''Queue a Job running the task name with args, delay seconds from now'''
+    if name not in TASKS:
+        raise ValueError('Unknown task %r' % name)
+    return Job.objects.create(
+        task=name, args=args or {}, owner_id=owner_id,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay))
+
+
+def claim(worker):
+    '''The oldest due queued job, marked running for worker, or None when there is none'''
+    using = router.db_for_write(Job)
+    now = timezone.now()
+    due = Job.objects.using(using).filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    running = dict(status=Job.RUNNING, locked_by=worker, locked_at=now)
+    if connections[using].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=using):
+            job = due.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.using(using).filter(pk=job.pk).update(attempts=F('attempts') + 1, **running)
+    else:
+        # A job another worker claimed since it was read is no longer queued, and not updated
+        with _sqlite_writes:
+            for job in due[:10]:
+                if Job.objects.using(using).filter(pk=job.pk, status=Job.QUEUED).update(
+                        attempts=F('attempts') + 1, **running):
+                    break
+            else:
+                return None
+    job.attempts += 1
+    for field, value in running.items():
+        setattr(job, field, value)
+    return job
+
+
+def finish(job, result=None, error=None):
+    '''Record the outcome of a claimed job: done, queued for a retry, or failed for good'''
+    now = timezone.now()
+    if error is None:
+        update = dict(status=Job.DONE, result=result, error='', finished_at=now)
+    elif job.attempts < job.max_attempts:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        update = dict(status=Job.QUEUED, error=error, run_at=now + datetime.timedelta(seconds=delay))
+    else:
+        update = dict(status=Job.FAILED, error=error, finished_at=now)
+    update.update(locked_by='', locked_at=None)
+    # Unless requeued as stale meanwhile, and maybe claimed by another worker
+    jobs = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by)
+    if connections[jobs.db].features.has_select_for_update_skip_locked:
+        jobs.update(**update)
+    else:
+        with _sqlite_writes:
+            jobs.update(**update)
+    for field, value in update.items():
+        setattr(job, field, value)
+
+
+def run(job):
+    '''Run a claimed job and record how it went'''
+    try:
+        result = TASKS[job.task](**job.args)
+    except Exception as error:
+        logger.exception('Job %s (%s) failed, attempt %d of %d', job.pk, job.task, job.attempts, job.max_attempts)
+        finish(job, error='%s: %s' % (type(error).__name__, error))
+    else:
+        finish(job, result=result)
+
+
+def requeue_stale():
+    '''Queue again the jobs running for longer than JOB_LOCK_TIMEOUT, returns how many'''
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - datetime.timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    unlock = dict(locked_by='', locked_at=None, error='Worker lost')
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(status=Job.FAILED, finished_at=now, **unlock)
+    return failed + stale.update(status=Job.QUEUED, run_at=now, **unlock)
+
+
+def work(worker, stop, burst=False, poll=None):
+    '''Claim and run jobs until stop is set, or until none is due when burst. Returns the jobs run.'''
+    poll = settings.JOB_POLL_INTERVAL if poll is None else poll
+    done = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = claim(worker)
+            except DatabaseError:
+                # E.g. SQLite busy with another writer, which says nothing of the jobs left
+                logger.warning('Worker %s could not claim a job', worker)
+                stop.wait(poll)
+                continue
+            if job is not None:
+                run(job)
+                done += 1
+                continue
+            if burst:
+                break
+            requeue_stale()
+            stop.wait(poll)
+    finally:
+        connections.close_all()
+    return done
+
+
+def run_process(threads=None, burst=False, poll=None):
+    '''Run worker threads in this process until SIGTERM or SIGINT, or until none has anything
+    left to do when burst. Returns the jobs run.'''
+    threads = threads or settings.JOB_WORKER_THREADS
+    stop = threading.Event()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        # The job in progress is finished first
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            handlers[signum] = signal.signal(signum, lambda *args: stop.set())
+    name = '%s:%d' % (socket.gethostname(), os.getpid())
+    done = []
+    workers = [threading.Thread(target=lambda worker: done.append(work(worker, stop, burst, poll)),
+                                args=('%s:%d' % (name, number),), name='awt-job-worker-%d' % number)
+               for number in range(threads)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            # A timeout, so the signals are handled meanwhile
+            while worker.is_alive():
+                worker.join(1)
+    finally:
+        stop.set()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return sum(done)
@@ -0,0 +1,50 @@
+'''The kinds of entry a topic holds: goals, progress and mistakes.
+
+The views, the import, search, timeline and the API find the model and form of an entry kind
+here, by the subtopic name of their urls (goals_list...) or the kind of the API urls (goals...).
+All kinds share their templates, which get the subtopic name to tell them apart.
+
+get_entry() is the one way the views fetch an entry: the entry, its topic and the topic's owner in
+a single query, whose WHERE clause also holds the check that the user may see it, on the owner and
+visibility the entry row carries.'''
+
+import collections
+
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .forms import GoalForm, ProgressForm, MistakeForm
+from .models import Goal, Progress, Mistake
+
+
+class EntryKind(collections.namedtuple('EntryKind', 'subtopic_name api_name model form')):
+    __slots__ = ()
+
+    def entries(self, topic):
+        '''The entries of this kind of topic, through its related manager so they come with their topic'''
+        accessor = self.model._meta.get_field('topic').remote_field.get_accessor_name()
+        return getattr(topic, accessor).all()
+
+
+## Subtopic name -> entry kind, in the order the entry lists, search and timeline list them
+KINDS = {kind.subtopic_name: kind for kind in [
+    EntryKind('goals_list', 'goals', Goal, GoalForm),
+    EntryKind('progress_list', 'progress', Progress, ProgressForm),
+    EntryKind('mistakes_list', 'mistakes', Mistake, MistakeForm),
+]}
+
+
+def get_kind(subtopic_name):
+    '''The entry kind of a subtopic name from a url, unknown ones are a 404'''
+    try:
+        return KINDS[subtopic_name]
+    except KeyError:
+        raise Http404('No entry kind %r' % subtopic_name)
+
+
+def get_entry(subtopic_name, entry_id, owner=None):
+    '''The entry of an owner's topic, or of a public topic when owner is None, with its topic and
+    the topic's owner, in one query. Missing entries and those of other users' topics are a 404.'''
+    entries = get_kind(subtopic_name).model.objects.select_related('topic__owner')
+    entries = entries.public() if owner is None else entries.owned_by(owner)
+    return get_object_or_404(entries, id=entry_id)
@@ -0,0 +1,98 @@
+'''manage.py bench_endpoints: latency, query and size report for every route, checked against budgets'''
+
+import json
+import os
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from app_workout_tracker.benchmark import BUDGETS, run_benchmark
+from app_workout_tracker.management.commands.seed_workouts import seeded_users
+
+
+def parse_budget(value):
+    '''Parse a --budget override such as "awt:secure_topics_list=queries:2"'''
+    try:
+        name, limit = value.split('=')
+        key, number = limit.split(':')
+        return name, key, float(number)
+    except ValueError:
+        raise CommandError('--budget must look like awt:secure_topics_list=queries:3')
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database and benchmark every route of the awt and users apps, writing a JSON '
+            'report and failing when an endpoint exceeds its budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Seeded users')
+        parser.add_argument('--topics-per-user', type=int, default=20, help='Seeded topics per user')
+        parser.add_argument('--entries-per-topic', type=int, default=50, help='Seeded entries per topic')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated dataset')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint')
+        parser.add_argument('--endpoint', action='append', dest='only', help='Only benchmark this route, repeatable')
+        parser.add_argument('--budget', action='append', default=[], type=parse_budget,
+                            help='Override a budget, e.g. awt:secure_topics_list=queries:3, repeatable')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Earlier JSON report to print the differences against')
+        parser.add_argument('--in-place', action='store_true',
+                            help='Use the configured database as is instead of a seeded throwaway one')
+        parser.add_argument('--keepdb', action='store_true', help='Keep and reuse the throwaway database')
+
+    def handle(self, *args, **options):
+        budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+        for name, key, number in options['budget']:
+            budgets.setdefault(name, {})[key] = number
+
+        try:
+            setup_test_environment(debug=False)
+        except RuntimeError:
+            # Already set up, e.g. when called from the test suite
+            pass
+
+        old_name = None
+        if not options['in_place']:
+            name = str(connection.settings_dict['NAME'])
+            if connection.vendor == 'sqlite':
+                # A file path, the prefix goes on the file name
+                name = os.path.join(os.path.dirname(name), 'bench_' + os.path.basename(name))
+            else:
+                name = 'bench_' + name
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            prefix = 'bench%d_' % options['seed']
+            if not seeded_users(prefix).exists():
+                call_command('seed_workouts', users=options['users'], topics_per_user=options['topics_per_user'],
+                             entries_per_topic=options['entries_per_topic'], seed=options['seed'], prefix=prefix,
+                             stdout=self.stdout)
+            report = run_benchmark(prefix, options['iterations'], options['warmup'], budgets, options['only'])
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.print_report(report, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        if report['budget_failures']:
+            raise CommandError('Budgets exceeded:\n  ' + '\n  '.join(report['budget_failures']))
+
+    def print_report(self, report, compare):
+        baseline = {}
+        if compare:
+            with open(compare) as earlier:
+                baseline = json.load(earlier)['endpoints']
+        self.stdout.write('%-30s %9s %9s %9s %7s %9s %9s' % ('endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'queries',
+                                                             'db ms', 'bytes'))
+        for name, result in sorted(report['endpoints'].items()):
+            line = '%-30s %9.2f %9.2f %9.2f %7d %9.2f %9d' % (name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                                                            result['queries'], result['db_ms'], result['bytes'])
+            if name in baseline:
+                line += '   p95 %+.2f ms, queries %+d' % (result['p95_ms'] - baseline[name]['p95_ms'],
+                                                         result['queries'] - baseline[name]['queries'])
+            self.stdout.write(line)
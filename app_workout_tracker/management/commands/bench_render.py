@@ -0,0 +1,99 @@
+'''manage.py bench_render: render time and size per 1000 rows of the topic and entry list templates'''
+
+import datetime
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from app_workout_tracker.models import Topic, Goal
+from app_workout_tracker.pagination import KeysetPage
+
+## Template -> function(rows, user) building its context
+TEMPLATES = {
+    'workout_tracker/home.html': lambda topics, entries, user: {'public_topics': topics},
+    'workout_tracker/secure_home.html': lambda topics, entries, user: {'user_topics': topics},
+    'workout_tracker/entry_list.html': lambda topics, entries, user: {
+        'called_submodel': entries, 'subtopic_name': 'goals_list'},
+    'workout_tracker/secure_entry_list.html': lambda topics, entries, user: {
+        'called_submodel': ['goals_list', entries, 'bench', 1]},
+}
+
+
+def fake_rows(count):
+    '''Unsaved topics and goals looking like the results of the list views, no database needed'''
+    now = timezone.now()
+    topics, entries = [], []
+    for n in range(1, count + 1):
+        topic = Topic(id=n, topic_name='topic %d' % n, date_added=now, view_option=True)
+        topic.goal_count, topic.progress_count, topic.mistake_count = n % 7, n % 5, n % 3
+        topic.last_entry_at = now - datetime.timedelta(minutes=n)
+        topics.append(topic)
+        entries.append(Goal(id=n, topic_id=1, summary='goal summary %d' % n, text='', date_added=topic.last_entry_at))
+    return KeysetPage(topics), KeysetPage(entries)
+
+
+def template_backend(cached_loader):
+    '''A backend configured like TEMPLATES[0], with or without the cached loader'''
+    config = dict(settings.TEMPLATES[0], NAME='bench_cached' if cached_loader else 'bench_plain')
+    options = dict(config.get('OPTIONS', {}))
+    loaders = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+    options['loaders'] = [('django.template.loaders.cached.Loader', loaders)] if cached_loader else loaders
+    config.update(APP_DIRS=False, OPTIONS=options)
+    return import_string(config.pop('BACKEND'))(config)
+
+
+class Command(BaseCommand):
+    help = ('Render the topic and entry list templates from generated rows with the plain and the cached '
+            'template loader, with the row fragment cache empty and filled, and report milliseconds and '
+            'bytes per 1000 rows. Needs no database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per rendered list')
+        parser.add_argument('--iterations', type=int, default=5, help='Timed renders per measurement')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        rows, iterations = options['rows'], options['iterations']
+        topics, entries = fake_rows(rows)
+        user = User(id=1, username='bench')
+        request = RequestFactory().get('/')
+        request.user = user
+        report = {'rows': rows, 'templates': {}}
+
+        for name, make_context in TEMPLATES.items():
+            context = make_context(topics, entries, user)
+            results = report['templates'][name] = {}
+            for cached_loader in (False, True):
+                backend = template_backend(cached_loader)
+                for fragments in ('cold', 'warm'):
+                    timings = []
+                    for n in range(iterations + 1):
+                        if fragments == 'cold':
+                            caches['fragments'].clear()
+                        started = time.perf_counter()
+                        # get_template() inside the timing, finding and parsing it is what the loaders differ in
+                        html = backend.get_template(name).render(context, request)
+                        # The first render fills the caches
+                        if n:
+                            timings.append(time.perf_counter() - started)
+                    results['%s loader, %s fragments' % ('cached' if cached_loader else 'plain', fragments)] = {
+                        'ms_per_1000_rows': round(min(timings) * 1000 * 1000 / rows, 2),
+                        'bytes_per_row': round(len(html.encode()) / rows, 1),
+                    }
+        caches['fragments'].clear()
+
+        self.stdout.write('%-40s %-30s %18s %14s' % ('template', 'setup', 'ms per 1000 rows', 'bytes per row'))
+        for name, results in report['templates'].items():
+            for setup, result in results.items():
+                self.stdout.write('%-40s %-30s %18.2f %14.1f' % (name, setup, result['ms_per_1000_rows'],
+                                                              result['bytes_per_row']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
@@ -0,0 +1,233 @@
+'''manage.py bench_servers: requests per second and memory of the WSGI and ASGI serving modes under
+many concurrent connections'''
+
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from app_workout_tracker.models import Goal
+
+MODES = ('wsgi', 'asgi')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    '''Resident memory in bytes of pid and its children, i.e. the gunicorn master and its workers'''
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/%s/stat' % entry) as stat:
+                    # The parent pid is the second field after the parenthesized command name
+                    children.setdefault(int(stat.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except OSError:
+                continue
+    total, todo = 0, [pid]
+    while todo:
+        current = todo.pop()
+        todo += children.get(current, [])
+        try:
+            with open('/proc/%d/statm' % current) as statm:
+                total += int(statm.read().split()[1]) * resource.getpagesize()
+        except OSError:
+            continue
+    return total
+
+
+async def read_response(reader):
+    '''Read one HTTP/1.1 response, return whether the server keeps the connection open'''
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    if not lines[0].split()[1].startswith(('2', '3')):
+        raise ValueError(lines[0])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if line)
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return False
+    return headers.get('connection') != 'close' and lines[0].startswith('HTTP/1.1')
+
+
+async def client(port, paths, deadline, stats, trickle=0):
+    '''One connection requesting paths in turn until deadline, reconnecting whenever the server closes it.
+
+    With trickle, a slow client: it sends its requests one byte every trickle seconds.'''
+    reader = writer = None
+    n = 0
+    while time.monotonic() < deadline:
+        path = paths[n % len(paths)]
+        n += 1
+        started = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            request = ('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % path).encode()
+            if trickle:
+                for i in range(len(request)):
+                    writer.write(request[i:i + 1])
+                    await asyncio.sleep(min(trickle, max(deadline - time.monotonic(), 0)))
+            else:
+                writer.write(request)
+            keep_alive = await asyncio.wait_for(read_response(reader), max(deadline - time.monotonic(), 0.1))
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            if time.monotonic() < deadline:
+                stats['errors'] += 1
+            keep_alive = False
+            await asyncio.sleep(0.05)
+        else:
+            if not trickle:
+                stats['latencies'].append(time.monotonic() - started)
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def sample_rss(pid, deadline, samples):
+    while time.monotonic() < deadline:
+        samples.append(process_tree_rss(pid))
+        await asyncio.sleep(0.25)
+
+
+async def load(pid, port, paths, connections, duration, slow_clients, trickle):
+    stats = {'errors': 0, 'latencies': []}
+    samples = []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(sample_rss(pid, deadline, samples),
+                         *[client(port, paths, deadline, stats) for n in range(connections)],
+                         *[client(port, paths, deadline, stats, trickle) for n in range(slow_clients)])
+    return stats, samples
+
+
+def wait_until_serving(server, port, path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise CommandError('gunicorn exited with status %s' % server.returncode)
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+                sock.sendall(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n' % path).encode())
+                if sock.recv(12).startswith(b'HTTP/1.1 200'):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise CommandError('gunicorn did not answer %s within %d seconds' % (path, timeout))
+
+
+def start_gunicorn(mode, port, workers, backlog=2048):
+    '''gunicorn serving the configured database in mode on port (see gunicorn.conf.py)'''
+    environment = dict(os.environ, SERVER_MODE=mode)
+    return subprocess.Popen(
+        # gunicorn 20.0 has no __main__ module to run with -m
+        [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', 'My_workout_tracker.%s' % mode, '--bind', '127.0.0.1:%d' % port,
+         '--workers', str(workers), '--backlog', str(backlog)],
+        cwd=settings.BASE_DIR, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Serve the configured database with gunicorn in each serving mode (see gunicorn.conf.py) and load '
+            'the async public views over many concurrent keep-alive connections, reporting requests per second, '
+            'latency and the resident memory of all gunicorn processes per 1000 connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', action='append', choices=MODES, dest='modes',
+                            help='Serving mode to benchmark, repeatable (default: both)')
+        parser.add_argument('--connections', type=int, default=1000, help='Concurrent client connections')
+        parser.add_argument('--duration', type=float, default=15, help='Seconds of load per mode')
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='Extra connections sending their requests slowly, not counted in the results')
+        parser.add_argument('--trickle', type=float, default=0.1,
+                            help='Seconds between the bytes of a slow client\'s request')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, repeatable (default: the three async public views)')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def default_paths(self):
+        goal = Goal.objects.public().order_by('id').first()
+        if goal is None:
+            raise CommandError('No public entries to request, run seed_workouts first')
+        return [
+            reverse('awt:public_topics_list'),
+            reverse('awt:public_subtopic_list', kwargs={'topic_id': goal.topic_id, 'subtopic_name': 'goals_list'}),
+            reverse('awt:public_subtopic_detail', kwargs={'subtopic_id': goal.id, 'subtopic_name': 'goals_list'}),
+        ]
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        # Each connection is a file descriptor here and in the server
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        connections = options['connections'] + options['slow_clients']
+        if hard != resource.RLIM_INFINITY and hard < connections * 2 + 100:
+            raise CommandError('The open file limit (%d) is too low for %d connections' % (hard, connections))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+        report = {'connections': options['connections'], 'slow_clients': options['slow_clients'],
+                  'duration': options['duration'], 'workers': options['workers'], 'paths': paths, 'modes': {}}
+        for mode in options['modes'] or MODES:
+            report['modes'][mode] = self.run_mode(mode, paths, options)
+
+        self.stdout.write('%-5s %10s %9s %9s %7s %10s %14s' % ('mode', 'req/s', 'p50 ms', 'p99 ms', 'errors',
+                                                               'RSS MB', 'MB per 1k conn'))
+        for mode, result in report['modes'].items():
+            self.stdout.write('%-5s %10.1f %9.1f %9.1f %7d %10.1f %14.1f' % (
+                mode, result['requests_per_second'], result['p50_ms'], result['p99_ms'], result['errors'],
+                result['peak_rss_mb'], result['rss_mb_per_1k_connections']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+    def run_mode(self, mode, paths, options):
+        port = free_port()
+        server = start_gunicorn(mode, port, options['workers'], options['connections'] * 2)
+        try:
+            wait_until_serving(server, port, paths[0])
+            idle_rss = process_tree_rss(server.pid)
+            stats, samples = asyncio.run(load(server.pid, port, paths, options['connections'], options['duration'],
+                                              options['slow_clients'], options['trickle']))
+        finally:
+            server.terminate()
+            server.wait()
+
+        peak_rss = max(samples + [idle_rss])
+        return {
+            'requests': len(stats['latencies']),
+            'requests_per_second': round(len(stats['latencies']) / options['duration'], 1),
+            'p50_ms': round(percentile(stats['latencies'], 50) * 1000, 1),
+            'p99_ms': round(percentile(stats['latencies'], 99) * 1000, 1),
+            'errors': stats['errors'],
+            'idle_rss_mb': round(idle_rss / 2 ** 20, 1),
+            'peak_rss_mb': round(peak_rss / 2 ** 20, 1),
+            # What the load adds on top of the idle servers, scaled to 1000 connections
+            'rss_mb_per_1k_connections': round((peak_rss - idle_rss) / 2 ** 20 * 1000 / options['connections'], 1),
+        }
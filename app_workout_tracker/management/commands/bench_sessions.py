@@ -0,0 +1,410 @@
+'''manage.py bench_sessions: throughput, latency and error rate of every step of simulated user sessions,
+replayed by more and more concurrent users against a local server to find where throughput stops growing.
+
+Each simulated user registers, logs out and in again, adds a public topic and a few entries to it, edits
+one, browses the public lists and logs out, over one keep-alive connection with its own cookies, like a
+browser would. The users run as threads, or as asyncio tasks for concurrencies threads cannot reach.'''
+
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from app_workout_tracker.kinds import KINDS
+from app_workout_tracker.management.commands.bench_servers import (MODES, free_port, percentile, start_gunicorn,
+                                                                  wait_until_serving)
+from app_workout_tracker.management.commands.seed_workouts import seeded_users
+
+DRIVERS = ('threads', 'asyncio')
+
+## Seconds to wait for a response before counting the step as an error
+TIMEOUT = 30
+
+Response = collections.namedtuple('Response', 'status headers body')
+
+
+def session_steps(prefix, number, entries=3):
+    '''The requests of the session of simulated user number. A generator yielding
+    (step, method, path, form data or None, expected status) and sent the Response of each.'''
+    username = '%s%d' % (prefix, number)
+    password = 'Squat-%d-Deadlift!' % number
+    yield 'users:register', 'GET', reverse('users:register'), None, 200
+    yield 'users:register', 'POST', reverse('users:register'), {
+        'username': username, 'password1': password, 'password2': password}, 302
+    yield 'users:logout', 'GET', reverse('users:logout'), None, 302
+    yield 'users:login', 'GET', reverse('users:login'), None, 200
+    yield 'users:login', 'POST', reverse('users:login'), {'username': username, 'password': password}, 302
+    yield 'awt:secure_topics_list', 'GET', reverse('awt:secure_topics_list'), None, 200
+
+    yield 'awt:add_topic', 'GET', reverse('awt:add_topic'), None, 200
+    yield 'awt:add_topic', 'POST', reverse('awt:add_topic'), {'topic_name': 'load test %d' % number, 'view_option': 'on'}, 302
+    # The new topic is the newest of the user's ones
+    response = yield 'awt:api_secure_topics', 'GET', reverse('awt:api_secure_topics'), None, 200
+    topic_id = json.loads(response.body)['results'][0]['id']
+
+    kinds = list(KINDS.values())
+    for n in range(entries):
+        kind = kinds[n % len(kinds)]
+        path = reverse('awt:add_subtopic', kwargs={'topic_id': topic_id, 'subtopic': kind.subtopic_name})
+        yield 'awt:add_subtopic', 'GET', path, None, 200
+        yield 'awt:add_subtopic', 'POST', path, {'summary': 'entry %d' % n, 'text': 'sets and reps ' * 20}, 302
+    kind = kinds[0]
+    yield 'awt:secure_subtopic_list', 'GET', reverse('awt:secure_subtopic_list', kwargs={
+        'topic_id': topic_id, 'topic_name': 'load test %d' % number, 'subtopic_name': kind.subtopic_name}), None, 200
+    response = yield 'awt:api_secure_entries', 'GET', reverse('awt:api_secure_entries', kwargs={
+        'topic_id': topic_id, 'kind': kind.api_name}), None, 200
+    results = json.loads(response.body)['results']
+    if results:
+        path = reverse('awt:edit_subtopic', kwargs={'subtopic_id': results[0]['id'], 'subtopic_name': kind.subtopic_name})
+        yield 'awt:edit_subtopic', 'GET', path, None, 200
+        yield 'awt:edit_subtopic', 'POST', path, {'summary': 'edited', 'text': 'more sets and reps'}, 302
+
+    yield 'awt:public_topics_list', 'GET', reverse('awt:public_topics_list'), None, 200
+    yield 'awt:public_subtopic_list', 'GET', reverse('awt:public_subtopic_list', kwargs={
+        'topic_id': topic_id, 'subtopic_name': kind.subtopic_name}), None, 200
+    yield 'awt:public_topic_timeline', 'GET', reverse('awt:public_topic_timeline', kwargs={'topic_id': topic_id}), None, 200
+    yield 'users:logout', 'GET', reverse('users:logout'), None, 302
+
+
+def parse_response():
+    '''Parse one HTTP/1.1 response. A generator yielding how much to read next, None for a line or
+    -1 for everything up to the end of the connection, sent what was read, and returning
+    (Response, whether the connection stays open).'''
+    status = int((yield None).split()[1])
+    headers = []
+    while True:
+        line = (yield None).decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, value = line.split(':', 1)
+        headers.append((name.lower(), value.strip()))
+    fields = dict(headers)
+    keep_alive = fields.get('connection') != 'close'
+    if 'content-length' in fields:
+        body = yield int(fields['content-length'])
+    elif fields.get('transfer-encoding') == 'chunked':
+        body = b''
+        while True:
+            size = int((yield None).split(b';')[0], 16)
+            body += (yield size + 2)[:size]
+            if size == 0:
+                break
+    else:
+        body, keep_alive = (yield -1), False
+    return Response(status, headers, body), keep_alive
+
+
+class Browser:
+    '''The cookies of one simulated user, and the requests it sends with them'''
+
+    def __init__(self, host):
+        self.host = host
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % self.host]
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join('%s=%s' % cookie for cookie in self.cookies.items()))
+        body = b''
+        if data is not None:
+            body = urlencode(data).encode()
+            # The token of the csrftoken cookie, which the form pages set
+            headers += ['Content-Type: application/x-www-form-urlencoded', 'Content-Length: %d' % len(body),
+                        'X-CSRFToken: %s' % self.cookies.get('csrftoken', '')]
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+    def receive(self, response):
+        for name, value in response.headers:
+            if name == 'set-cookie':
+                cookie, value = value.split(';', 1)[0].split('=', 1)
+                # Deleted cookies are set empty, e.g. the session on logout
+                if value.strip('"'):
+                    self.cookies[cookie] = value
+                else:
+                    self.cookies.pop(cookie, None)
+
+
+class Stats:
+    '''Latencies and errors of every step, and the sessions completed, during one run'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = collections.defaultdict(lambda: {'latencies': [], 'errors': 0})
+        self.sessions = 0
+
+    def record(self, step, latency=None):
+        '''A request of step answered in latency seconds, or failed when latency is None'''
+        with self.lock:
+            if latency is None:
+                self.steps[step]['errors'] += 1
+            else:
+                self.steps[step]['latencies'].append(latency)
+
+
+class Connection:
+    '''Blocking keep-alive connection of a simulated user, for the threads driver'''
+
+    def __init__(self, address):
+        self.address = address
+        self.browser = Browser('%s:%d' % address)
+        self.sock = self.file = None
+
+    def send(self, method, path, data):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, timeout=TIMEOUT)
+            self.file = self.sock.makefile('rb')
+        self.sock.sendall(self.browser.request(method, path, data))
+        parser = parse_response()
+        want = next(parser)
+        try:
+            while True:
+                if want is None:
+                    read = self.file.readline()
+                    closed = not read
+                elif want < 0:
+                    read, closed = self.file.read(), False
+                else:
+                    read = self.file.read(want)
+                    closed = len(read) < want
+                if closed:
+                    raise ConnectionError('Connection closed in the middle of a response')
+                want = parser.send(read)
+        except StopIteration as stop:
+            response, keep_alive = stop.value
+        if not keep_alive:
+            self.close()
+        self.browser.receive(response)
+        return response
+
+    def close(self):
+        if self.sock is not None:
+            self.file.close()
+            self.sock.close()
+            self.sock = self.file = None
+
+
+class AsyncConnection(Connection):
+    '''The same over asyncio streams, for the asyncio driver'''
+
+    async def send(self, method, path, data):
+        if self.sock is None:
+            self.file, self.sock = await asyncio.open_connection(*self.address)
+        self.sock.write(self.browser.request(method, path, data))
+        parser = parse_response()
+        want = next(parser)
+        try:
+            while True:
+                if want is None:
+                    read = self.file.readuntil(b'\n')
+                elif want < 0:
+                    read = self.file.read()
+                else:
+                    read = self.file.readexactly(want)
+                want = parser.send(await asyncio.wait_for(read, TIMEOUT))
+        except StopIteration as stop:
+            response, keep_alive = stop.value
+        if not keep_alive:
+            self.close()
+        self.browser.receive(response)
+        return response
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = self.file = None
+
+
+ERRORS = (OSError, ValueError, EOFError, asyncio.LimitOverrunError, asyncio.TimeoutError)
+
+
+def run_user(address, sessions, deadline, stats, options):
+    '''One simulated user of the threads driver, replaying sessions until deadline'''
+    while time.monotonic() < deadline:
+        steps = session_steps(options['prefix'], next(sessions), options['entries'])
+        connection = Connection(address)
+        response = None
+        try:
+            while True:
+                step, method, path, data, expected = steps.send(response)
+                started = time.monotonic()
+                try:
+                    response = connection.send(method, path, data)
+                except ERRORS:
+                    response = None
+                if time.monotonic() >= deadline:
+                    # Cut short by the end of the run, not an error
+                    break
+                if response is None or response.status != expected:
+                    stats.record(step)
+                    break
+                stats.record(step, time.monotonic() - started)
+                if options['think']:
+                    time.sleep(random.uniform(0, 2 * options['think']))
+        except StopIteration:
+            with stats.lock:
+                stats.sessions += 1
+        finally:
+            connection.close()
+
+
+async def run_async_user(address, sessions, deadline, stats, options):
+    '''One simulated user of the asyncio driver, replaying sessions until deadline'''
+    while time.monotonic() < deadline:
+        steps = session_steps(options['prefix'], next(sessions), options['entries'])
+        connection = AsyncConnection(address)
+        response = None
+        try:
+            while True:
+                step, method, path, data, expected = steps.send(response)
+                started = time.monotonic()
+                try:
+                    response = await connection.send(method, path, data)
+                except ERRORS:
+                    response = None
+                if time.monotonic() >= deadline:
+                    break
+                if response is None or response.status != expected:
+                    stats.record(step)
+                    break
+                stats.record(step, time.monotonic() - started)
+                if options['think']:
+                    await asyncio.sleep(random.uniform(0, 2 * options['think']))
+        except StopIteration:
+            stats.sessions += 1
+        finally:
+            connection.close()
+
+
+async def run_async_users(address, users, sessions, deadline, stats, options):
+    await asyncio.gather(*[run_async_user(address, sessions, deadline, stats, options) for n in range(users)])
+
+
+def load(address, users, sessions, options):
+    '''Stats of users simulated users replaying sessions for the duration'''
+    stats = Stats()
+    deadline = time.monotonic() + options['duration']
+    if options['driver'] == 'asyncio':
+        asyncio.run(run_async_users(address, users, sessions, deadline, stats, options))
+    else:
+        threads = [threading.Thread(target=run_user, args=(address, sessions, deadline, stats, options))
+                   for n in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return stats
+
+
+def summarize(latencies, errors, duration):
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'errors': errors,
+        'error_rate': round(errors / max(len(latencies) + errors, 1), 4),
+    }
+
+
+def knee(runs):
+    '''The lowest concurrency reaching 95% of the best throughput: more users only wait longer'''
+    best = max(run['requests_per_second'] for run in runs)
+    return min(run['users'] for run in runs if run['requests_per_second'] >= best * 0.95)
+
+
+class Command(BaseCommand):
+    help = ('Replay simulated user sessions (register, log in, add a topic and entries, edit, browse the public '
+            'lists, log out) at each given concurrency against a local server, gunicorn serving the configured '
+            'database unless --url names a running one, reporting throughput, latency percentiles and error '
+            'rates per step and the concurrency past which throughput stops growing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', action='append', type=int, dest='levels',
+                            help='Concurrent simulated users, repeatable to sweep (default: 1, 2, 4, 8, 16, 32)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per concurrency')
+        parser.add_argument('--driver', choices=DRIVERS, default='threads',
+                            help='Run the simulated users as threads or as asyncio tasks')
+        parser.add_argument('--entries', type=int, default=3, help='Entries added per session')
+        parser.add_argument('--think', type=float, default=0,
+                            help='Mean seconds a user waits between steps (default: none, the most load)')
+        parser.add_argument('--url', help='Base URL of a running server to load instead of starting gunicorn')
+        parser.add_argument('--mode', choices=MODES, default='wsgi', help='Serving mode of the started gunicorn')
+        parser.add_argument('--workers', action='append', type=int, dest='worker_counts',
+                            help='gunicorn worker processes, repeatable to compare (default: 2)')
+        parser.add_argument('--prefix', default='load%d_' % os.getpid(), help='Username prefix of the simulated users')
+        parser.add_argument('--keep-users', action='store_true', help='Keep the registered users and their topics')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        levels = options['levels'] or [1, 2, 4, 8, 16, 32]
+        if min(levels) < 1:
+            raise CommandError('--users must be at least 1')
+        # Numbers the sessions of all the runs, so every one registers a new user
+        sessions = itertools.count()
+        report = {'driver': options['driver'], 'duration': options['duration'], 'entries': options['entries'],
+                  'think': options['think'], 'mode': options['mode'], 'servers': []}
+        try:
+            if options['url']:
+                url = urlsplit(options['url'])
+                if url.scheme != 'http' or not url.hostname:
+                    raise CommandError('--url must be an http:// URL')
+                address = (url.hostname, url.port or 80)
+                report['servers'].append(self.sweep(address, None, levels, sessions, options))
+            for workers in ([] if options['url'] else options['worker_counts'] or [2]):
+                port = free_port()
+                server = start_gunicorn(options['mode'], port, workers, max(levels) * 2)
+                try:
+                    wait_until_serving(server, port, reverse('awt:public_topics_list'))
+                    report['servers'].append(self.sweep(('127.0.0.1', port), workers, levels, sessions, options))
+                finally:
+                    server.terminate()
+                    server.wait()
+        finally:
+            if not options['keep_users']:
+                # Their topics and entries go with them
+                seeded_users(options['prefix']).delete()
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+    def sweep(self, address, workers, levels, sessions, options):
+        '''Load the server at address with each concurrency of levels in turn'''
+        runs = []
+        for users in levels:
+            stats = load(address, users, sessions, options)
+            duration = options['duration']
+            steps = {step: summarize(step_stats['latencies'], step_stats['errors'], duration)
+                     for step, step_stats in sorted(stats.steps.items())}
+            latencies = [latency for step_stats in stats.steps.values() for latency in step_stats['latencies']]
+            run = dict(summarize(latencies, sum(step['errors'] for step in steps.values()), duration),
+                       users=users, sessions=stats.sessions, sessions_per_second=round(stats.sessions / duration, 2),
+                       steps=steps)
+            runs.append(run)
+            self.print_run(workers, run)
+        result = {'workers': workers, 'runs': runs, 'knee_users': knee(runs)}
+        self.stdout.write('%s: throughput stops growing at %d concurrent users\n' % (
+            'Server' if workers is None else '%d workers' % workers, result['knee_users']))
+        return result
+
+    def print_run(self, workers, run):
+        self.stdout.write('%s, %d users: %.2f sessions/s, %.1f req/s, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, '
+                          '%.2f%% errors' % ('Server' if workers is None else '%d workers' % workers, run['users'],
+                                             run['sessions_per_second'], run['requests_per_second'], run['p50_ms'],
+                                             run['p95_ms'], run['p99_ms'], run['error_rate'] * 100))
+        self.stdout.write('  %-28s %9s %8s %8s %8s %7s %8s' % ('step', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                               'errors', 'error %'))
+        for step, result in run['steps'].items():
+            self.stdout.write('  %-28s %9.1f %8.1f %8.1f %8.1f %7d %8.2f' % (
+                step, result['requests_per_second'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['errors'], result['error_rate'] * 100))
@@ -0,0 +1,20 @@
+'''manage.py delete_pending_topics: finish deleting the topics whose deletion job gave up'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_workout_tracker.deletion import purge_pending
+
+
+class Command(BaseCommand):
+    help = ('Delete the entries and then the row of every topic still marked pending_delete, e.g. when '
+            'its background deletion job failed for good.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Entries deleted per transaction')
+        parser.add_argument('--pause', type=float, help='Seconds between two batches')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        deleted = purge_pending(options['batch_size'], options['pause'])
+        self.stdout.write('%d pending topics deleted' % deleted)
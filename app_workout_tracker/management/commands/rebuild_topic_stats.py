@@ -0,0 +1,21 @@
+'''manage.py rebuild_topic_stats: recount the TopicStats rows from the entry tables'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_workout_tracker.stats import rebuild_topic_stats
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-topic entry stats from the Goal, Progress and Mistake tables, repairing any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', type=int, action='append', dest='topics',
+                            help='Only rebuild this topic id, may be given several times')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Topics recounted per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows have drifted')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        repaired = rebuild_topic_stats(options['topics'], options['batch_size'], options['dry_run'])
+        self.stdout.write('%d topic stats %s' % (repaired, 'out of date' if options['dry_run'] else 'rebuilt'))
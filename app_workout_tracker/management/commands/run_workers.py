@@ -0,0 +1,53 @@
+'''manage.py run_workers: run the queued background jobs (see jobs.py)'''
+
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def worker_process(threads, burst, poll):
+    '''Main function of a spawned worker process, which sets the project up again'''
+    import django
+    django.setup()
+    from app_workout_tracker import jobs
+    jobs.run_process(threads, burst, poll)
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs queued in the database, in worker threads of one or more processes, '
+            'until interrupted. Every worker finishes its current job on SIGTERM or SIGINT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Worker processes (JOB_WORKER_PROCESSES)')
+        parser.add_argument('--threads', type=int, help='Worker threads per process (JOB_WORKER_THREADS)')
+        parser.add_argument('--poll', type=float, help='Seconds an idle worker waits before looking again')
+        parser.add_argument('--burst', action='store_true', help='Stop once no job is due')
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or settings.JOB_WORKER_PROCESSES
+        threads = options['threads'] or settings.JOB_WORKER_THREADS
+        if processes < 1 or threads < 1:
+            raise CommandError('--processes and --threads must be positive')
+        if processes == 1:
+            from app_workout_tracker import jobs
+            done = jobs.run_process(threads, options['burst'], options['poll'])
+            self.stdout.write('%d jobs run' % done)
+            return
+
+        # Spawned rather than forked, like the chart pool: a fork would share this process' connections
+        context = multiprocessing.get_context('spawn')
+        children = [context.Process(target=worker_process, args=(threads, options['burst'], options['poll']),
+                                    name='awt-jobs-%d' % number) for number in range(processes)]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for child in children:
+            child.join()
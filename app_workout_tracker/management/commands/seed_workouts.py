@@ -0,0 +1,209 @@
+'''manage.py seed_workouts: fill the database with synthetic users, topics and entries for load testing'''
+
+import contextlib
+import datetime
+import multiprocessing
+import random
+import re
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from app_workout_tracker.models import Topic, TopicStats, Goal, Progress, Mistake
+
+BODY_PARTS = ['Biceps', 'Triceps', 'Glutes', 'Hams', 'Quads', 'Calves', 'Chest', 'Back', 'Shoulders', 'Core']
+EXERCISES = ['bench press', 'squat', 'deadlift', 'curl', 'row', 'lunge', 'dip', 'pull up', 'plank', 'press']
+NOTES = ['felt strong', 'knee pain', 'bad form on the last set', 'new personal best', 'too little sleep',
+         'rushed the warm up', 'kept the tempo slow', 'lower back tight', 'great pump', 'skipped stretching']
+
+ENTRY_MODELS = [Goal, Progress, Mistake]
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*models):
+    '''Let bulk_create keep the date_added we assign instead of stamping every row with now()'''
+    fields = [model._meta.get_field('date_added') for model in models]
+    for field in fields:
+        field.auto_now = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now = True
+
+
+def seeded_users(prefix):
+    '''The users seed_workouts named prefix + a number, and not those of a longer prefix such as prefix2_'''
+    return User.objects.filter(username__regex=r'^%s[0-9]+$' % re.escape(prefix))
+
+
+def parse_mix(value):
+    '''Turn a "goal:progress:mistake" weight string such as "1:3:1" into a list of three weights'''
+    try:
+        weights = [float(part) for part in value.split(':')]
+    except ValueError:
+        raise CommandError('--mix must look like 1:3:1')
+    if len(weights) != 3 or min(weights) < 0 or sum(weights) == 0:
+        raise CommandError('--mix needs three non-negative weights for goal:progress:mistake')
+    return weights
+
+
+class Seeder:
+    '''Creates the users numbered [first, last) and everything they own.
+
+    Every user and every topic draws from its own random generator seeded with (seed, user number[,
+    topic number]), so the generated content does not depend on --batch-size or on how the work is
+    split over --workers.'''
+
+    def __init__(self, options, password):
+        self.options = options
+        self.password = password
+        self.batch_size = options['batch_size']
+        self.weights = parse_mix(options['mix'])
+        self.start = datetime.datetime.strptime(options['start'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        self.span = options['days'] * 86400
+
+    def __call__(self, user_range):
+        first, last = user_range
+        self.counts = {model: 0 for model in [User, Topic] + ENTRY_MODELS}
+        self.stats = []
+        self.topics = []
+        self.entries = {model: [] for model in ENTRY_MODELS}
+
+        names = ['%s%d' % (self.options['prefix'], n) for n in range(first, last)]
+        User.objects.bulk_create([User(username=name, password=self.password) for name in names])
+        self.counts[User] += len(names)
+        owner_ids = dict(User.objects.filter(username__in=names).values_list('username', 'id'))
+
+        for n, name in zip(range(first, last), names):
+            rng = random.Random('%d:%d' % (self.options['seed'], n))
+            for number in range(self.options['topics_per_user']):
+                # Entries draw from a generator of their own topic, so batching cannot reorder the draws
+                topic_rng = random.Random('%d:%d:%d' % (self.options['seed'], n, number))
+                self.topics.append((topic_rng, Topic(
+                    topic_name='%s %d' % (rng.choice(BODY_PARTS), number), owner_id=owner_ids[name],
+                    view_option=rng.random() < self.options['public_ratio'], date_added=self.timestamp(rng))))
+                if len(self.topics) >= self.batch_size:
+                    self.flush_topics()
+        self.flush_topics()
+        for model in ENTRY_MODELS:
+            self.flush(model)
+        self.flush_stats()
+        return {model._meta.verbose_name_plural: count for model, count in self.counts.items()}
+
+    def timestamp(self, rng):
+        return self.start + datetime.timedelta(seconds=rng.randrange(self.span))
+
+    def flush_topics(self):
+        '''Insert the pending topics, then generate their entries now that they have primary keys'''
+        if not self.topics:
+            return
+        topics = [topic for rng, topic in self.topics]
+        Topic.objects.bulk_create(topics)
+        self.counts[Topic] += len(topics)
+        # SQLite does not hand back the primary keys of bulk inserted rows, read back the newest ones
+        # (SQLite only allows one writer, so they are ours)
+        if topics[0].pk is None:
+            created = reversed(list(Topic.objects.order_by('-id').values_list('id', flat=True)[:len(topics)]))
+            for topic, pk in zip(topics, created):
+                topic.pk = pk
+
+        for rng, topic in self.topics:
+            # bulk_create() sends no signals, so the stats of the topic are counted here
+            stats = TopicStats(topic_id=topic.pk)
+            for n in range(self.options['entries_per_topic']):
+                model = rng.choices(ENTRY_MODELS, self.weights)[0]
+                exercise = rng.choice(EXERCISES)
+                entry = model(
+                    topic_id=topic.pk, owner_id=topic.owner_id, is_public=topic.view_option,
+                    date_added=self.timestamp(rng),
+                    summary='%s %dx%d' % (exercise.capitalize(), rng.randint(1, 5), rng.randint(3, 12)),
+                    text='%s at %dkg, %s.' % (exercise, rng.randint(5, 200), rng.choice(NOTES)))
+                self.entries[model].append(entry)
+                self.count_entry(stats, entry)
+                if len(self.entries[model]) >= self.batch_size:
+                    self.flush(model)
+            self.stats.append(stats)
+        self.topics = []
+        if len(self.stats) >= self.batch_size:
+            self.flush_stats()
+
+    @staticmethod
+    def count_entry(stats, entry):
+        field = '%s_count' % type(entry).__name__.lower()
+        setattr(stats, field, getattr(stats, field) + 1)
+        stats.text_length += len(entry.summary) + len(entry.text)
+        stats.last_entry_at = max(stats.last_entry_at or entry.date_added, entry.date_added)
+
+    def flush_stats(self):
+        if self.stats:
+            TopicStats.objects.bulk_create(self.stats)
+            self.stats = []
+
+    def flush(self, model):
+        if self.entries[model]:
+            model.objects.bulk_create(self.entries[model])
+            self.counts[model] += len(self.entries[model])
+            self.entries[model] = []
+
+
+class Command(BaseCommand):
+    help = 'Create N users with M topics each and a mix of Goal, Progress and Mistake entries, deterministically from --seed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create')
+        parser.add_argument('--topics-per-user', type=int, default=5, help='Topics created for every user')
+        parser.add_argument('--entries-per-topic', type=int, default=20, help='Goal, Progress and Mistake rows per topic')
+        parser.add_argument('--mix', default='1:3:1', help='Relative weights of goal:progress:mistake entries')
+        parser.add_argument('--public-ratio', type=float, default=0.5, help='Fraction of topics that are public')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create batch')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Parallel insert processes, keep 1 on SQLite which allows a single writer')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--prefix', default='seed', help='Username prefix of the generated users')
+        parser.add_argument('--start', default='2020-01-01', help='Date of the oldest generated row (YYYY-MM-DD)')
+        parser.add_argument('--days', type=int, default=365, help='Number of days the generated rows are spread over')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['public_ratio'] <= 1:
+            raise CommandError('--public-ratio must be between 0 and 1')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+        if seeded_users(options['prefix']).exists():
+            raise CommandError('Users named %s* already exist, pick another --prefix' % options['prefix'])
+
+        # Hashing is deliberately slow, so every seeded user shares one hash of the password 12345
+        seeder = Seeder(options, make_password('12345'))
+        # Users are handed out a chunk at a time so memory stays flat for any --users,
+        # with chunks small enough to keep every worker busy
+        chunk = min(options['batch_size'] // max(1, options['topics_per_user']),
+                    -(-options['users'] // (options['workers'] * 4)))
+        chunk = max(1, chunk)
+        user_ranges = [(first, min(first + chunk, options['users'])) for first in range(0, options['users'], chunk)]
+
+        started = time.monotonic()
+        totals = {}
+        with explicit_timestamps(Topic, *ENTRY_MODELS):
+            if options['workers'] == 1:
+                results = map(seeder, user_ranges)
+            else:
+                # Forked workers must not share the parent's database connection
+                connections.close_all()
+                pool = multiprocessing.get_context('fork').Pool(options['workers'])
+                results = pool.imap_unordered(seeder, user_ranges)
+            for counts in results:
+                for name, count in counts.items():
+                    totals[name] = totals.get(name, 0) + count
+            if options['workers'] > 1:
+                pool.close()
+                pool.join()
+
+        elapsed = time.monotonic() - started
+        rows = sum(totals.values())
+        self.stdout.write('Created %s in %.1fs (%d rows/s)' % (
+            ', '.join('%d %s' % (count, name) for name, count in totals.items()),
+            elapsed, rows / elapsed if elapsed else rows))
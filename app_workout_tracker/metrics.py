@@ -0,0 +1,187 @@
+'''Per-request performance metrics: SQL query count, database time, view time and template time.
+
+MetricsMiddleware times every request and, with SERVER_TIMING on, reports its numbers in a
+Server-Timing header that the browser's developer tools show. It also adds them to histograms per
+url name (e.g. awt:secure_subtopic_list), which metrics_view() serves in the Prometheus text format
+at /metrics.
+
+Queries are timed by an execute wrapper put on every database connection when it is opened (see
+signals.py), templates by the TimedDjangoTemplates backend. Both find the timings of the current
+request through a context variable, so the queries the async views run in other threads count too.
+
+The histograms live in the memory of each server process, so with several workers each scrape
+sees the requests of the worker that answered it. Prometheus adds those up over time.'''
+
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+
+## Upper bounds of the histogram buckets, +Inf is added to each
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+## Prometheus metric -> (help, buckets, attribute of RequestTimings)
+HISTOGRAMS = {
+    'awt_view_seconds': ('Time spent in the view, including its queries and templates', SECONDS_BUCKETS, 'view'),
+    'awt_db_seconds': ('Time spent running SQL queries', SECONDS_BUCKETS, 'db'),
+    'awt_db_queries': ('SQL queries run', QUERIES_BUCKETS, 'queries'),
+    'awt_template_seconds': ('Time spent rendering templates', SECONDS_BUCKETS, 'template'),
+}
+
+_current = contextvars.ContextVar('request_timings', default=None)
+_lock = threading.Lock()
+## (metric, url name) -> [count per bucket..., count, sum]
+_histograms = {}
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db', 'template', 'view')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.template = self.view = 0.0
+
+
+def time_query(execute, sql, params, many, context):
+    '''Execute wrapper adding every query to the timings of the request running it'''
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def watch_connection(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    '''The Django template backend, timing the templates rendered for a request'''
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def observe(name, timings):
+    with _lock:
+        for metric, (help_text, buckets, attribute) in HISTOGRAMS.items():
+            value = getattr(timings, attribute)
+            histogram = _histograms.get((metric, name))
+            if histogram is None:
+                histogram = _histograms[(metric, name)] = [0] * (len(buckets) + 3)
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def server_timing(timings):
+    return ('db;dur=%.1f;desc="%d queries", view;dur=%.1f, template;dur=%.1f'
+            % (timings.db * 1000, timings.queries, timings.view * 1000, timings.template * 1000))
+
+
+class MetricsMiddleware:
+    '''Time the view of every request, listed last in MIDDLEWARE so the other middleware is left out'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django call this one without a thread in between
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings.view = time.perf_counter() - started
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings.view = time.perf_counter() - started
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        match = request.resolver_match
+        observe(match.view_name if match else '<unresolved>', timings)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(timings)
+        return response
+
+
+def _labels(name):
+    return 'view="%s"' % name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def exposition():
+    '''All histograms in the Prometheus text exposition format'''
+    with _lock:
+        snapshot = {key: list(values) for key, values in _histograms.items()}
+    lines = []
+    for metric, (help_text, buckets, attribute) in HISTOGRAMS.items():
+        lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s histogram' % metric]
+        for (name_metric, name), values in sorted(snapshot.items()):
+            if name_metric != metric:
+                continue
+            labels = _labels(name)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], values):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+            lines.append('%s_count{%s} %d' % (metric, labels, values[-2]))
+            lines.append('%s_sum{%s} %r' % (metric, labels, values[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    '''Prometheus scrape endpoint, for a bearer METRICS_TOKEN, staff users, or anyone when DEBUG is on'''
+    token = settings.METRICS_TOKEN
+    authorized = (settings.DEBUG or request.user.is_staff
+                  or (token and request.META.get('HTTP_AUTHORIZATION') == 'Bearer %s' % token))
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,72 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app_workout_tracker', '0004_auto_20210104_1422'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='goal',
+            options={'ordering': ['-date_added', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='mistake',
+            options={'ordering': ['-date_added', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='progress',
+            options={'ordering': ['-date_added', '-id'], 'verbose_name_plural': 'Progress'},
+        ),
+        migrations.AlterModelOptions(
+            name='topic',
+            options={'ordering': ['-date_added', '-id']},
+        ),
+        migrations.AlterField(
+            model_name='goal',
+            name='topic',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app_workout_tracker.topic'),
+        ),
+        migrations.AlterField(
+            model_name='mistake',
+            name='topic',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app_workout_tracker.topic'),
+        ),
+        migrations.AlterField(
+            model_name='progress',
+            name='topic',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app_workout_tracker.topic'),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='goal',
+            index=models.Index(fields=['topic', '-date_added', '-id'], name='goal_topic_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mistake',
+            index=models.Index(fields=['topic', '-date_added', '-id'], name='mistake_topic_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progress',
+            index=models.Index(fields=['topic', '-date_added', '-id'], name='progress_topic_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['owner', '-date_added', '-id'], name='topic_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['view_option', '-date_added', '-id'], name='topic_public_recent_idx'),
+        ),
+    ]
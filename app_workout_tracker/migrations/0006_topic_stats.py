@@ -0,0 +1,60 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Length
+
+BATCH_SIZE = 1000
+
+
+def backfill_topic_stats(apps, schema_editor):
+    '''Count the entries of the existing topics, BATCH_SIZE topics at a time'''
+    Topic = apps.get_model('app_workout_tracker', 'Topic')
+    TopicStats = apps.get_model('app_workout_tracker', 'TopicStats')
+    entry_models = [(apps.get_model('app_workout_tracker', name), field) for name, field in
+                    (('Goal', 'goal_count'), ('Progress', 'progress_count'), ('Mistake', 'mistake_count'))]
+    db = schema_editor.connection.alias
+
+    last = 0
+    while True:
+        batch = list(Topic.objects.using(db).filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not batch:
+            return
+        last = batch[-1]
+        stats = {pk: TopicStats(topic_id=pk) for pk in batch}
+        for model, field in entry_models:
+            rows = (model.objects.using(db).filter(topic_id__in=batch).order_by().values('topic_id')
+                    .annotate(n=Count('id'), last=Max('date_added'), length=Sum(Length('summary') + Length('text'))))
+            for row in rows:
+                row_stats = stats[row['topic_id']]
+                setattr(row_stats, field, row['n'])
+                row_stats.text_length += row['length'] or 0
+                if row_stats.last_entry_at is None or row['last'] > row_stats.last_entry_at:
+                    row_stats.last_entry_at = row['last']
+        TopicStats.objects.using(db).bulk_create(stats.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_workout_tracker', '0005_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicStats',
+            fields=[
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='app_workout_tracker.topic')),
+                ('goal_count', models.IntegerField(default=0)),
+                ('progress_count', models.IntegerField(default=0)),
+                ('mistake_count', models.IntegerField(default=0)),
+                ('last_entry_at', models.DateTimeField(blank=True, null=True)),
+                ('text_length', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Topic stats',
+            },
+        ),
+        migrations.RunPython(backfill_topic_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# The SQL as of this migration, which must not change with search.py
+TABLES = ('app_workout_tracker_goal', 'app_workout_tracker_progress', 'app_workout_tracker_mistake')
+
+# Fills search_vector on PostgreSQL; a trigger rather than a generated column, which needs PostgreSQL 12
+VECTOR = "to_tsvector('english', coalesce(%(row)ssummary, '') || ' ' || coalesce(%(row)stext, ''))"
+VECTOR_FUNCTION = 'app_workout_tracker_entry_search_vector'
+
+
+def sqlite_triggers(table):
+    fts = table + '_fts'
+    insert = 'INSERT INTO %s(rowid, summary, text) VALUES (new.id, new.summary, new.text);' % fts
+    delete = ("INSERT INTO %s(%s, rowid, summary, text) VALUES ('delete', old.id, old.summary, old.text);"
+              % (fts, fts))
+    return [
+        'CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN %s END' % (fts, table, insert),
+        'CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN %s END' % (fts, table, delete),
+        'CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN %s %s END' % (fts, table, delete, insert),
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE FUNCTION %s() RETURNS trigger AS $$ BEGIN NEW.search_vector := %s; '
+                              'RETURN NEW; END $$ LANGUAGE plpgsql' % (VECTOR_FUNCTION, VECTOR % {'row': 'NEW.'}))
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute('ALTER TABLE %s ADD COLUMN search_vector tsvector' % table)
+            schema_editor.execute('UPDATE %s SET search_vector = %s' % (table, VECTOR % {'row': ''}))
+            # EXECUTE PROCEDURE, PostgreSQL 10 has no EXECUTE FUNCTION
+            schema_editor.execute('CREATE TRIGGER %s_search_vector BEFORE INSERT OR UPDATE OF summary, text ON %s '
+                                  'FOR EACH ROW EXECUTE PROCEDURE %s()' % (table, table, VECTOR_FUNCTION))
+            schema_editor.execute('CREATE INDEX %s_search_idx ON %s USING gin (search_vector)' % (table, table))
+        elif vendor == 'sqlite':
+            fts = table + '_fts'
+            schema_editor.execute("CREATE VIRTUAL TABLE %s USING fts5(summary, text, content='%s', content_rowid='id', "
+                                  "tokenize='porter unicode61')" % (fts, table))
+            schema_editor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+            for statement in sqlite_triggers(table):
+                schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            # IF EXISTS, as databases migrated before the trigger have a generated column instead
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_search_vector ON %s' % (table, table))
+            schema_editor.execute('DROP INDEX %s_search_idx' % table)
+            schema_editor.execute('ALTER TABLE %s DROP COLUMN search_vector' % table)
+        elif vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                schema_editor.execute('DROP TRIGGER %s_fts_%s' % (table, suffix))
+            schema_editor.execute('DROP TABLE %s_fts' % table)
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP FUNCTION IF EXISTS %s()' % VECTOR_FUNCTION)
+
+
+class Migration(migrations.Migration):
+    '''Full-text index of the entries, whose SQL depends on the database, see search.py'''
+
+    dependencies = [
+        ('app_workout_tracker', '0006_topic_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.3 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_workout_tracker', '0007_entry_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='pending_delete',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(condition=models.Q(pending_delete=True), fields=['id'], name='topic_pending_delete_idx'),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The SQLite search triggers of migration 0007, as of this migration
+TABLES = ('app_workout_tracker_goal', 'app_workout_tracker_progress', 'app_workout_tracker_mistake')
+
+
+def restore_search_triggers(apps, schema_editor):
+    '''SQLite remakes the entry tables to add change_seq, which drops their search triggers'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        fts = table + '_fts'
+        insert = 'INSERT INTO %s(rowid, summary, text) VALUES (new.id, new.summary, new.text);' % fts
+        delete = ("INSERT INTO %s(%s, rowid, summary, text) VALUES ('delete', old.id, old.summary, old.text);"
+                  % (fts, fts))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN %s END' % (fts, table, insert))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN %s END' % (fts, table, delete))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN %s %s END'
+                              % (fts, table, delete, insert))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app_workout_tracker', '0009_job'),
+    ]
+
+    operations = [
+        # For the way back, once the entry tables are remade without change_seq
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='auth.user')),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('change_seq', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='goal',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mistake',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='progress',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='goal',
+            index=models.Index(fields=['topic', 'change_seq', 'id'], name='goal_topic_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mistake',
+            index=models.Index(fields=['topic', 'change_seq', 'id'], name='mistake_topic_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progress',
+            index=models.Index(fields=['topic', 'change_seq', 'id'], name='progress_topic_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['owner', 'change_seq', 'id'], name='topic_owner_changes_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['owner', 'change_seq', 'id'], name='tombstone_owner_changes_idx'),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:18
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+import django.db.models.deletion
+
+# The SQLite search triggers of migration 0007, as of this migration
+TABLES = ('app_workout_tracker_goal', 'app_workout_tracker_progress', 'app_workout_tracker_mistake')
+
+## Entries updated per transaction by the backfill
+BATCH_SIZE = 10000
+
+
+def backfill_entries(apps, schema_editor):
+    '''Copy the owner and view_option of every entry's topic onto it, a range of ids at a time'''
+    using = schema_editor.connection.alias
+    Topic = apps.get_model('app_workout_tracker', 'Topic')
+    topic = Topic.objects.using(using).filter(pk=OuterRef('topic_id'))
+    for name in ('Goal', 'Progress', 'Mistake'):
+        entries = apps.get_model('app_workout_tracker', name).objects.using(using)
+        last = entries.aggregate(last=Max('id'))['last'] or 0
+        for start in range(0, last, BATCH_SIZE):
+            # Each batch commits on its own, the migration is not atomic
+            with transaction.atomic(using=using):
+                entries.filter(id__gt=start, id__lte=start + BATCH_SIZE).update(
+                    owner_id=Subquery(topic.values('owner_id')), is_public=Subquery(topic.values('view_option')))
+
+
+def restore_search_triggers(apps, schema_editor):
+    '''SQLite remakes the entry tables to add the columns, which drops their search triggers'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        fts = table + '_fts'
+        insert = 'INSERT INTO %s(rowid, summary, text) VALUES (new.id, new.summary, new.text);' % fts
+        delete = ("INSERT INTO %s(%s, rowid, summary, text) VALUES ('delete', old.id, old.summary, old.text);"
+                  % (fts, fts))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN %s END' % (fts, table, insert))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN %s END' % (fts, table, delete))
+        schema_editor.execute('CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN %s %s END'
+                              % (fts, table, delete, insert))
+
+
+class Migration(migrations.Migration):
+    '''Owner and visibility of the entries, copied from their topic (see AtomicEntry)'''
+
+    # So the backfill commits batch by batch rather than holding every row until the end
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app_workout_tracker', '0010_delta_sync'),
+    ]
+
+    operations = [
+        # For the way back, once the entry tables are remade without the columns
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='goal',
+            name='is_public',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='goal',
+            name='owner',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='mistake',
+            name='is_public',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='mistake',
+            name='owner',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='progress',
+            name='is_public',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='progress',
+            name='owner',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_entries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='goal',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='mistake',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='progress',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        # Built once the columns are filled in
+        migrations.RemoveIndex(
+            model_name='goal',
+            name='goal_topic_changes_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mistake',
+            name='mistake_topic_changes_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='progress',
+            name='progress_topic_changes_idx',
+        ),
+        migrations.AddIndex(
+            model_name='goal',
+            index=models.Index(fields=['owner', '-date_added', '-id'], name='goal_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goal',
+            index=models.Index(fields=['owner', 'change_seq', 'id'], name='goal_owner_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mistake',
+            index=models.Index(fields=['owner', '-date_added', '-id'], name='mistake_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mistake',
+            index=models.Index(fields=['owner', 'change_seq', 'id'], name='mistake_owner_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progress',
+            index=models.Index(fields=['owner', '-date_added', '-id'], name='progress_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progress',
+            index=models.Index(fields=['owner', 'change_seq', 'id'], name='progress_owner_changes_idx'),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
@@ -1,42 +1,206 @@
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 
 # Create your models here.
 from django.contrib.auth.models import User
 
-class Topic(models.Model):
+
+class LatestOf(Greatest):
+    '''GREATEST() that skips NULL arguments on every backend, as it does on PostgreSQL'''
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite's MAX() is NULL as soon as one argument is, so compare every argument's
+        # rotation through COALESCE(), whose results are exactly the non-NULL arguments.
+        expressions = self.get_source_expressions()
+        rotations = [Coalesce(*(expressions[n:] + expressions[:n])) for n in range(len(expressions))]
+        return compiler.compile(Greatest(*rotations, output_field=self.output_field))
+
+
+class TopicQuerySet(models.QuerySet):
+    def with_entry_stats(self):
+        '''Annotate every topic with goal_count, progress_count, mistake_count and last_entry_at.
+
+        Each is a correlated subquery on the (topic, -date_added, -id) index of its entry table, so
+        a page of topics with its counts is still one query however many topics there are.'''
+        annotations, latest = {}, []
+        for model, name in ((Goal, 'goal'), (Progress, 'progress'), (Mistake, 'mistake')):
+            entries = model.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+            annotations['%s_count' % name] = Coalesce(Subquery(entries.annotate(n=Count('id')).values('n')), 0)
+            latest.append(Subquery(entries.annotate(last=Max('date_added')).values('last')))
+        annotations['last_entry_at'] = LatestOf(*latest, output_field=models.DateTimeField())
+        return self.annotate(**annotations)
+
+    def with_stats(self):
+        '''The same annotations as with_entry_stats(), read from the TopicStats row of every topic.
+
+        Each is a primary key lookup of that one row instead of a count over the entry tables, so it
+        stays cheap however many entries the topics hold. Topics without a stats row count as empty.
+        Subqueries rather than a join, so they only run for the rows left after LIMIT.'''
+        stats = TopicStats.objects.filter(topic=OuterRef('pk'))
+        annotations = {name: Coalesce(Subquery(stats.values(name)), 0)
+                       for name in ('goal_count', 'progress_count', 'mistake_count')}
+        annotations['last_entry_at'] = Subquery(stats.values('last_entry_at'))
+        return self.annotate(**annotations)
+
+
+class TopicManager(models.Manager.from_queryset(TopicQuerySet)):
+    '''Topics that are not being deleted, see deletion.py'''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(pending_delete=False)
+
+
+class AtomicChange:
+    '''Saves and deletes a row in one transaction with the derived rows its signals write, and numbers
+    every change of it for the delta sync of its owner's offline clients (see sync.py)'''
+
+    def sync_owner_id(self):
+        return self.topic.owner_id
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        # No savepoint when already in a transaction, the caller's one is enough
+        with transaction.atomic(using=using, savepoint=False):
+            self.change_seq = SyncCounter.objects.next_seq(self.sync_owner_id(), using=using)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'change_seq'}
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            # Only deleting a row itself leaves a tombstone, what it cascades to does not
+            Tombstone.objects.record(self, using=using)
+            return super().delete(*args, **kwargs)
+
+
+class Topic(AtomicChange, models.Model):
     '''This model contains the main Topic, such as Muscle group: Biceps/Triceps/Glutes/Hams'''
     topic_name = models.CharField(max_length=100)
     date_added= models.DateTimeField(auto_now=True)
     ## Associating owner with each Topic
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Not indexed on its own, topic_owner_recent_idx below leads with owner
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     ## Make Topic Public or private
     view_option = models.BooleanField(default=True)
+    ## Hidden and having its entries deleted in the background (see deletion.py)
+    pending_delete = models.BooleanField(default=False)
+    ## Number of its last change among the changes of its owner's rows, see sync.py
+    change_seq = models.BigIntegerField(default=0)
+
+    # The default manager, the views and the admin never see a topic being deleted
+    objects = TopicManager()
+    all_objects = TopicQuerySet.as_manager()
 
     def __str__(self):
         '''returning a string representation of this class'''
         return self.topic_name
+
+    def sync_owner_id(self):
+        return self.owner_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        topic = super().from_db(db, field_names, values)
+        # As stored, for save() to tell whether the entries' copy of it has to change
+        topic._stored_view_option = topic.__dict__.get('view_option')
+        return topic
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        adding = self._state.adding
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            stored = getattr(self, '_stored_view_option', None)
+            if not adding and stored != self.view_option:
+                # The entries carry it as is_public, one UPDATE per entry table brings them along
+                for model in (Goal, Progress, Mistake):
+                    model.objects.using(using).filter(topic=self).exclude(is_public=self.view_option).update(
+                        is_public=self.view_option)
+            self._stored_view_option = self.view_option
     class Meta:
-        ordering = ['-date_added']
+        ordering = ['-date_added', '-id']
+        # Shaped after the list queries: filter on owner or view_option, newest first (see pagination.py)
+        indexes = [
+            models.Index(fields=['owner', '-date_added', '-id'], name='topic_owner_recent_idx'),
+            models.Index(fields=['view_option', '-date_added', '-id'], name='topic_public_recent_idx'),
+            # Only holds the few topics being deleted, for picking up the ones a restart interrupted
+            models.Index(fields=['id'], condition=models.Q(pending_delete=True), name='topic_pending_delete_idx'),
+            models.Index(fields=['owner', 'change_seq', 'id'], name='topic_owner_changes_idx'),
+        ]
+
+class EntryQuerySet(models.QuerySet):
+    '''Entries filtered on the owner and visibility they carry, without joining their topic'''
+
+    def visible(self):
+        '''Without the entries of the topics being deleted, read from the partial index of those few'''
+        return self.exclude(topic_id__in=Topic.all_objects.filter(pending_delete=True).values('pk'))
+
+    def public(self):
+        return self.filter(is_public=True).visible()
 
-class Goal(models.Model):
+    def owned_by(self, user):
+        return self.filter(owner=user).visible()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        '''Entries created without their copy of the topic's owner and visibility get it here'''
+        objs = list(objs)
+        for obj in objs:
+            if obj.owner_id is None:
+                obj.owner_id, obj.is_public = obj.topic.owner_id, obj.topic.view_option
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class AtomicEntry(AtomicChange):
+    '''AtomicChange of an entry, which also keeps the copy of its topic's owner and visibility
+    that the queries filter on. The topic passes a change of view_option on to its entries.'''
+
+    def save(self, *args, **kwargs):
+        self.owner_id = self.topic.owner_id
+        self.is_public = self.topic.view_option
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'owner', 'is_public'}
+        super().save(*args, **kwargs)
+
+
+class Goal(AtomicEntry, models.Model):
     '''This class will store the Goals linked to the Topic'''
-    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    # Not indexed on its own, the (topic, -date_added, -id) index below leads with topic
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, db_index=False)
     summary = models.CharField(max_length=100)
     text = models.TextField()
     date_added = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0)
+    ## Copies of the topic's owner and view_option, see AtomicEntry
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    is_public = models.BooleanField(default=False)
+
+    objects = EntryQuerySet.as_manager()
 
     def __str__(self):
         '''returning a string representation of this goal_text for this class'''
         return self.summary[:30]
 
     class Meta:
-        ordering = ['-date_added']
+        ordering = ['-date_added', '-id']
+        indexes = [
+            models.Index(fields=['topic', '-date_added', '-id'], name='goal_topic_recent_idx'),
+            models.Index(fields=['owner', '-date_added', '-id'], name='goal_owner_recent_idx'),
+            models.Index(fields=['owner', 'change_seq', 'id'], name='goal_owner_changes_idx'),
+        ]
 
-class Progress(models.Model):
-    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+class Progress(AtomicEntry, models.Model):
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, db_index=False)
     summary = models.CharField(max_length=100)
     text = models.TextField()
     date_added = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0)
+    ## Copies of the topic's owner and view_option, see AtomicEntry
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    is_public = models.BooleanField(default=False)
+
+    objects = EntryQuerySet.as_manager()
 
     def __str__(self):
         '''returning a string representation of this goal_text for this class'''
@@ -45,17 +209,147 @@ class Progress(models.Model):
     class Meta:
         '''This will avoid plurization of this Progress class'''
         verbose_name_plural = "Progress"
-        ordering=['-date_added']
+        ordering=['-date_added', '-id']
+        indexes = [
+            models.Index(fields=['topic', '-date_added', '-id'], name='progress_topic_recent_idx'),
+            models.Index(fields=['owner', '-date_added', '-id'], name='progress_owner_recent_idx'),
+            models.Index(fields=['owner', 'change_seq', 'id'], name='progress_owner_changes_idx'),
+        ]
 
-class Mistake(models.Model):
-    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+class Mistake(AtomicEntry, models.Model):
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, db_index=False)
     summary = models.CharField(max_length=100)
     text = models.TextField()
     date_added = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0)
+    ## Copies of the topic's owner and view_option, see AtomicEntry
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    is_public = models.BooleanField(default=False)
+
+    objects = EntryQuerySet.as_manager()
 
     def __str__(self):
         '''returning a string representation of this goal_text for this class'''
         return self.summary[:30]
 
     class Meta:
-        ordering = ['-date_added']
\ No newline at end of file
+        ordering = ['-date_added', '-id']
+        indexes = [
+            models.Index(fields=['topic', '-date_added', '-id'], name='mistake_topic_recent_idx'),
+            models.Index(fields=['owner', '-date_added', '-id'], name='mistake_owner_recent_idx'),
+            models.Index(fields=['owner', 'change_seq', 'id'], name='mistake_owner_changes_idx'),
+        ]
+
+
+class TopicStats(models.Model):
+    '''Running totals of the entries of one Topic, kept up to date by stats.py.
+
+    `manage.py rebuild_topic_stats` recounts them from the entry tables if they ever drift.'''
+    topic = models.OneToOneField(Topic, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    goal_count = models.IntegerField(default=0)
+    progress_count = models.IntegerField(default=0)
+    mistake_count = models.IntegerField(default=0)
+    last_entry_at = models.DateTimeField(null=True, blank=True)
+    ## Characters of summary and text over all the entries
+    text_length = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return 'Stats of topic %s' % self.topic_id
+
+    class Meta:
+        verbose_name_plural = "Topic stats"
+
+
+class SyncCounterManager(models.Manager):
+    def next_seq(self, owner_id, count=1, using=None):
+        '''Take the next count change numbers of owner_id and return the last of them.
+
+        The counter row stays locked until the transaction commits, so the changes of one owner
+        commit in the order of their numbers and a client never sees a number after a higher one.'''
+        using = using or router.db_for_write(self.model)
+        connection = connections[using]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = ('INSERT INTO %s (owner_id, last_seq) VALUES (%%s, %%s) ON CONFLICT (owner_id) '
+               'DO UPDATE SET last_seq = %s.last_seq + excluded.last_seq' % (table, table))
+        # SQLite has RETURNING from 3.35, which Django does not know of yet
+        returning = connection.features.can_return_columns_from_insert or (
+            connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35))
+        with connection.cursor() as cursor:
+            if returning:
+                cursor.execute(sql + ' RETURNING last_seq', [owner_id, count])
+            else:
+                cursor.execute(sql, [owner_id, count])
+                cursor.execute('SELECT last_seq FROM %s WHERE owner_id = %%s' % table, [owner_id])
+            return cursor.fetchone()[0]
+
+
+class SyncCounter(models.Model):
+    '''Number of the last change to the topics and entries of one user, see sync.py'''
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    last_seq = models.BigIntegerField(default=0)
+
+    objects = SyncCounterManager()
+
+    def __str__(self):
+        return 'Sync counter of user %s' % self.owner_id
+
+
+class TombstoneManager(models.Manager):
+    def record(self, instance, using=None):
+        '''Leave a tombstone of the topic or entry instance, deleted in the current transaction'''
+        using = using or router.db_for_write(self.model)
+        owner_id = instance.sync_owner_id()
+        return self.using(using).create(owner_id=owner_id, kind=instance._meta.model_name, object_id=instance.pk,
+                                        change_seq=SyncCounter.objects.next_seq(owner_id, using=using))
+
+
+class Tombstone(models.Model):
+    '''A deleted topic or entry, for the delta sync to tell the offline clients (see sync.py)'''
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    ## Model name of the deleted row: topic, goal, progress or mistake
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    change_seq = models.BigIntegerField()
+
+    objects = TombstoneManager()
+
+    def __str__(self):
+        return 'Deleted %s %s' % (self.kind, self.object_id)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'change_seq', 'id'], name='tombstone_owner_changes_idx')]
+
+
+class Job(models.Model):
+    '''A unit of work run outside the request by `manage.py run_workers`, see jobs.py'''
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    ## Name of the task in jobs.TASKS, called with the keyword arguments in args
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    ## User the job was queued for, who may poll its status
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    ## Not claimed before then, pushed back after a failed attempt
+    run_at = models.DateTimeField()
+    ## Worker running the job and since when, to requeue the jobs of a worker that died
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Job %s: %s (%s)' % (self.id, self.task, self.status)
+
+    class Meta:
+        indexes = [
+            # Only holds the jobs waiting for a worker, which claims the oldest due one
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='job_running_idx'),
+            models.Index(fields=['owner', '-created_at'], name='job_owner_recent_idx'),
+        ]
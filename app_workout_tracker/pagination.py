@@ -0,0 +1,103 @@
+'''Keyset (cursor) pagination for the topic and entry list views.
+
+Every list in the app is ordered newest first, so pages are keyed on the
+(date_added, id) of the last row shown instead of on a page number. Fetching
+page N is then a bounded index range scan, the same cost as page 1: there is
+no OFFSET to skip over and no COUNT(*) to work out the number of pages.'''
+
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(*values):
+    '''Pack the sort key of a row into an opaque, url-safe cursor string'''
+    payload = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def raw_datetime(connection, value):
+    '''A datetime column of a raw SQL row as the ORM returns it, SQLite gives back the text it stores'''
+    if connection.vendor == 'sqlite':
+        return connection.ops.convert_datetimefield_value(value, None, connection)
+    return value
+
+
+def decode_cursor(cursor):
+    '''Unpack a cursor made by encode_cursor(), raising Http404 if it was tampered with'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise Http404('Invalid page cursor')
+    if not isinstance(values, list):
+        raise Http404('Invalid page cursor')
+    return values
+
+
+class KeysetPage:
+    '''One page of rows plus the cursor of the page that follows it.
+
+    Iterating or indexing the page works like the list of rows, so templates written
+    against a queryset keep working.'''
+
+    def __init__(self, object_list, cursor=None, next_cursor=None):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return '<KeysetPage of %d rows>' % len(self.object_list)
+
+
+def after_cursor(queryset, cursor):
+    '''Restrict queryset to the rows sorted after cursor in (-date_added, -id) order'''
+    values = decode_cursor(cursor)
+    try:
+        date_added, pk = parse_datetime(values[0]), int(values[1])
+    except (IndexError, TypeError, ValueError):
+        raise Http404('Invalid page cursor')
+    if date_added is None:
+        raise Http404('Invalid page cursor')
+    # The first filter is a plain range the (..., date_added, id) indexes can seek on,
+    # the second only drops the rows tied on date_added that were already shown.
+    return queryset.filter(date_added__lte=date_added).filter(Q(date_added__lt=date_added) | Q(id__lt=pk))
+
+
+def paginate_keyset(queryset, cursor=None, per_page=None):
+    '''Return the KeysetPage of queryset that follows cursor, newest first'''
+    per_page = per_page or settings.LIST_PAGE_SIZE
+    queryset = queryset.order_by('-date_added', '-id')
+    if cursor:
+        queryset = after_cursor(queryset, cursor)
+
+    # Fetch one extra row to find out whether there is a next page without counting.
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].date_added, rows[-1].id)
+    return KeysetPage(rows, cursor=cursor, next_cursor=next_cursor)
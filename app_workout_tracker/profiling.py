@@ -0,0 +1,175 @@
+'''Opt-in profiling of requests, to find out afterwards why one of them was slow.
+
+ProfilingMiddleware is only installed when PROFILE_REQUESTS or PROFILE_SLOW_SECONDS is set (see
+settings.py), and then:
+
+* PROFILE_REQUESTS of the requests, picked at random, run under cProfile, and every one of them
+  is written out as <name>.prof (open it with pstats or snakeviz).
+* All the other requests are watched by a sampling profiler, which looks at the stack of the
+  request's thread every PROFILE_SAMPLE_INTERVAL seconds. Only the requests slower than
+  PROFILE_SLOW_SECONDS are written out, as <name>.folded collapsed stacks (flamegraph.pl,
+  speedscope). The sampler costs the request next to nothing, so it can watch every one.
+
+Both come with <name>.sql, the request's queries with their durations (without their parameters,
+which may hold form data). <name> is made of the time, url name, user id and duration, e.g.
+20201215-101502.123456-awt.edit_subtopic-u42-2315ms. PROFILE_DIR keeps the newest PROFILE_KEEP
+profiles, older ones are deleted as new ones come in.
+
+Only the thread that serves the request is profiled; under ASGI, the work the async views hand to
+the thread pool is not in the stacks, but their queries are in the .sql file.'''
+
+import collections
+import contextvars
+import cProfile
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+_current = contextvars.ContextVar('profiled_queries', default=None)
+
+
+def capture_query(execute, sql, params, many, context):
+    '''Execute wrapper recording the queries of a profiled request'''
+    queries = _current.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((time.perf_counter() - started, sql))
+
+
+def watch_connection(connection):
+    if capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture_query)
+
+
+class StackSampler(threading.Thread):
+    '''Background thread counting the stacks of the threads that are serving a watched request'''
+
+    def __init__(self, interval):
+        super().__init__(name='awt-stack-sampler', daemon=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watched = {}
+
+    def watch(self, ident):
+        counts = collections.Counter()
+        with self.lock:
+            self.watched[ident] = counts
+        return counts
+
+    def unwatch(self, ident):
+        with self.lock:
+            self.watched.pop(ident, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched.items())
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for ident, counts in watched:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                    frame = frame.f_back
+                if stack:
+                    counts[';'.join(reversed(stack))] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+            _sampler.start()
+    return _sampler
+
+
+def profile_name(request, elapsed):
+    match = request.resolver_match
+    user = getattr(request, 'user', None)
+    user_id = user.pk if user is not None and user.is_authenticated else 'anon'
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S.%f')
+    url_name = (match.view_name if match else 'unresolved').replace(':', '.')
+    return '%s-%s-u%s-%dms' % (stamp, url_name, user_id, elapsed * 1000)
+
+
+def write_sql(path, request, elapsed, queries):
+    with open(path, 'w') as out:
+        out.write('-- %s %s in %.1f ms, %d queries in %.1f ms\n' % (
+            request.method, request.get_full_path(), elapsed * 1000, len(queries),
+            sum(duration for duration, sql in queries) * 1000))
+        for duration, sql in queries:
+            out.write('-- %.3f ms\n%s;\n' % (duration * 1000, sql))
+
+
+def rotate(directory, keep):
+    '''Delete all but the newest keep profiles from directory, with their .sql files'''
+    names = sorted({os.path.splitext(name)[0] for name in os.listdir(directory)}, reverse=True)
+    for name in names[keep:]:
+        for extension in ('.prof', '.folded', '.sql'):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    '''Profile some or the slow requests, installed first in MIDDLEWARE so the others are profiled too'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+        token = _current.set(queries)
+        profiler = sampler = counts = None
+        if random.random() < settings.PROFILE_REQUESTS:
+            profiler = cProfile.Profile()
+        elif settings.PROFILE_SLOW_SECONDS:
+            sampler = get_sampler()
+            counts = sampler.watch(threading.get_ident())
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            if sampler is not None:
+                sampler.unwatch(threading.get_ident())
+
+        if profiler is not None or (counts is not None and elapsed >= settings.PROFILE_SLOW_SECONDS):
+            self.write(request, elapsed, queries, profiler, counts)
+        return response
+
+    def write(self, request, elapsed, queries, profiler, counts):
+        directory = settings.PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile_name(request, elapsed))
+        if profiler is not None:
+            profiler.dump_stats(path + '.prof')
+        else:
+            with open(path + '.folded', 'w') as out:
+                for stack, count in counts.most_common():
+                    out.write('%s %d\n' % (stack, count))
+        write_sql(path + '.sql', request, elapsed, queries)
+        rotate(directory, settings.PROFILE_KEEP)
@@ -0,0 +1,18 @@
+'''SVG to PNG conversion run in the chart process pool (see charts.py).
+
+Kept free of Django imports, so the pool's freshly spawned processes can load it without
+setting up the project.'''
+
+
+def svg_to_png(svg):
+    import cairosvg
+    return cairosvg.svg2png(bytestring=svg)
+
+
+def available():
+    '''Whether CairoSVG and the cairo library it needs are installed'''
+    try:
+        svg_to_png(b'<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"/>')
+    except (ImportError, OSError):
+        return False
+    return True
@@ -0,0 +1,81 @@
+'''Read replica routing.
+
+Reads of this app's models go to one of the DATABASE_REPLICAS only inside read_from_replica()
+views, everything else (writes, auth and sessions, the views that write) stays on the primary.
+A write request sets the READ_YOUR_WRITES_COOKIE for READ_YOUR_WRITES_SECONDS, and while it is
+there that browser reads from the primary too, so it never misses its own change on a replica
+that is lagging behind.
+
+The replica scope is a context variable, so it follows the async views into the threads that
+run their queries (see views.db_to_async).'''
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA_APPS = {'app_workout_tracker'}
+READ_YOUR_WRITES_COOKIE = 'awt_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    '''Let the reads inside go to a replica, or with enabled=False keep them on the primary'''
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_reads():
+    return replica_reads(False)
+
+
+def read_from_replica(view):
+    '''Serve a read-only view from a replica, unless the client wrote something a moment ago'''
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with replica_reads(READ_YOUR_WRITES_COOKIE not in request.COOKIES):
+                return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with replica_reads(READ_YOUR_WRITES_COOKIE not in request.COOKIES):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    '''Send the replica scoped reads of REPLICA_APPS to a random replica'''
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if replicas and _replica_reads.get() and model._meta.app_label in REPLICA_APPS:
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same rows
+        return True
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    '''Mark the client of a write request, so its next reads come from the primary'''
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 500 and settings.DATABASE_REPLICAS:
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, '1', max_age=settings.READ_YOUR_WRITES_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,103 @@
+'''Ranked full-text search over the summary and text of Goal, Progress and Mistake entries.
+
+The index lives outside the models, created by migration 0007 with raw SQL:
+
+* PostgreSQL (10 or later): every entry table gets a tsvector column, search_vector, kept up
+  to date by a trigger on every write of the summary or text, with a GIN index on it.
+* SQLite: every entry table gets an external content FTS5 table, <table>_fts, kept up to
+  date by insert, update and delete triggers. SQLite drops those whenever a migration remakes an
+  entry table, e.g. to add a column, so such a migration creates them again (see 0010).
+
+search_entries() matches through those indexes only, ranks with ts_rank_cd() or bm25(), and
+pages the hits on (rank, kind, id) with an opaque cursor, like pagination.py does for lists.'''
+
+import collections
+import re
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, router
+from django.http import Http404
+
+from .kinds import KINDS as ENTRY_KINDS
+from .models import Goal
+from .pagination import KeysetPage, decode_cursor, encode_cursor, raw_datetime
+
+## Searched models, in the order their hits are listed at equal rank, with their subtopic name
+KINDS = [(kind.model, kind.subtopic_name) for kind in ENTRY_KINDS.values()]
+
+SearchHit = collections.namedtuple('SearchHit', 'kind id rank summary date_added topic_id topic_name')
+
+## Text search configuration migration 0007 built the PostgreSQL index with, the queries must use the same one
+TS_CONFIG = 'english'
+
+
+def fts5_query(terms):
+    '''FTS5 MATCH expression requiring every word of terms, with the query syntax quoted away'''
+    words = re.findall(r'\w+', terms)
+    return ' '.join('"%s"' % word for word in words)
+
+
+def _branch(vendor, number, model):
+    table = model._meta.db_table
+    if vendor == 'postgresql':
+        # float8, a real would not survive the trip through the cursor unchanged
+        return ('SELECT %d AS kind, e.id, ts_rank_cd(e.search_vector, q.query)::float8 AS rank, e.summary, '
+                'e.date_added, t.id AS topic_id, t.topic_name FROM %s e JOIN app_workout_tracker_topic t '
+                'ON t.id = e.topic_id, q WHERE e.search_vector @@ q.query AND {scope}' % (number, table))
+    return ('SELECT %d AS kind, e.id, -bm25(%s_fts) AS rank, e.summary, e.date_added, t.id AS topic_id, '
+            't.topic_name FROM %s_fts JOIN %s e ON e.id = %s_fts.rowid JOIN app_workout_tracker_topic t '
+            'ON t.id = e.topic_id WHERE %s_fts MATCH %%s AND {scope}' % (number, table, table, table, table, table))
+
+
+def search_entries(terms, owner=None, cursor=None, per_page=None):
+    '''KeysetPage of the SearchHits of terms, best first: in the topics of owner, or in the
+    public topics when owner is None'''
+    per_page = per_page or settings.LIST_PAGE_SIZE
+    # Raw SQL skips the router, ask it where the entry tables are read from
+    connection = connections[router.db_for_read(Goal)]
+    vendor = connection.vendor
+    if vendor not in ('postgresql', 'sqlite'):
+        raise NotSupportedError('Entry search needs PostgreSQL or SQLite')
+
+    # On the owner and visibility the entries carry, topics being deleted left out (see deletion.py)
+    if owner is not None:
+        scope, scope_params = 'e.owner_id = %s AND NOT t.pending_delete', [owner.pk]
+    else:
+        scope, scope_params = 'e.is_public AND NOT t.pending_delete', []
+    if vendor == 'postgresql':
+        match = terms
+        # Every word required, punctuation ignored: plainto_tsquery() cannot fail on what users type
+        prefix, prefix_params = 'WITH q AS (SELECT plainto_tsquery(%s, %s) AS query) ', [TS_CONFIG, terms]
+        branch_params = scope_params
+    else:
+        match = fts5_query(terms)
+        prefix, prefix_params = '', []
+        branch_params = [match] + scope_params
+    if not match.strip():
+        return KeysetPage([], cursor=cursor)
+
+    hits = ' UNION ALL '.join(_branch(vendor, number, model).format(scope=scope)
+                              for number, (model, kind) in enumerate(KINDS))
+    sql = prefix + 'SELECT * FROM (%s) hits' % hits
+    params = prefix_params + branch_params * len(KINDS)
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            rank, number, pk = float(values[0]), int(values[1]), int(values[2])
+        except (IndexError, TypeError, ValueError):
+            raise Http404('Invalid page cursor')
+        sql += ' WHERE rank < %s OR (rank = %s AND (kind > %s OR (kind = %s AND id > %s)))'
+        params += [rank, rank, number, number, pk]
+    sql += ' ORDER BY rank DESC, kind, id LIMIT %s'
+    params.append(per_page + 1)
+
+    with connection.cursor() as db:
+        db.execute(sql, params)
+        rows = db.fetchall()
+    hits = [SearchHit(KINDS[row[0]][1], *row[1:4], raw_datetime(connection, row[4]), *row[5:])
+            for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor(last[2], last[0], last[1])
+    return KeysetPage(hits, cursor=cursor, next_cursor=next_cursor)
@@ -0,0 +1,72 @@
+'''Signal receivers keeping derived data in step with the models, connected in apps.py'''
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import metrics, profiling, stats
+from .caching import invalidate_public_topics
+from .models import Topic, TopicStats, Goal, Progress, Mistake
+
+
+@receiver(post_save, sender=Topic, dispatch_uid='awt_topic_saved')
+@receiver(post_delete, sender=Topic, dispatch_uid='awt_topic_deleted')
+def topic_changed(sender, instance, **kwargs):
+    '''Any saved topic may have joined, left or changed the public list, e.g. when view_option flips'''
+    invalidate_public_topics()
+    # Again once the write is visible, in case a reader cached the old rows in between
+    transaction.on_commit(invalidate_public_topics)
+
+
+@receiver(post_save, sender=Topic, dispatch_uid='awt_topic_stats_created')
+def topic_created(sender, instance, created, raw=False, **kwargs):
+    '''Start every new topic with an empty stats row for its entries to update'''
+    if created and not raw:
+        TopicStats.objects.create(topic=instance)
+
+
+@receiver(pre_save, sender=Goal, dispatch_uid='awt_goal_stats_before')
+@receiver(pre_save, sender=Progress, dispatch_uid='awt_progress_stats_before')
+@receiver(pre_save, sender=Mistake, dispatch_uid='awt_mistake_stats_before')
+def entry_saving(sender, instance, raw=False, **kwargs):
+    '''Remember what an edited entry held, the stats only get the difference'''
+    if not raw:
+        instance._stats_before = stats.stored_entry(instance)
+
+
+@receiver(post_save, sender=Goal, dispatch_uid='awt_goal_stats_saved')
+@receiver(post_save, sender=Progress, dispatch_uid='awt_progress_stats_saved')
+@receiver(post_save, sender=Mistake, dispatch_uid='awt_mistake_stats_saved')
+def entry_stats_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.entry_saved(instance, getattr(instance, '_stats_before', None))
+
+
+@receiver(post_delete, sender=Goal, dispatch_uid='awt_goal_stats_deleted')
+@receiver(post_delete, sender=Progress, dispatch_uid='awt_progress_stats_deleted')
+@receiver(post_delete, sender=Mistake, dispatch_uid='awt_mistake_stats_deleted')
+def entry_stats_deleted(sender, instance, **kwargs):
+    stats.entry_removed(sender, instance.topic_id, stats.entry_length(instance), instance.date_added)
+
+
+@receiver(post_save, sender=Goal, dispatch_uid='awt_goal_saved')
+@receiver(post_save, sender=Progress, dispatch_uid='awt_progress_saved')
+@receiver(post_save, sender=Mistake, dispatch_uid='awt_mistake_saved')
+@receiver(post_delete, sender=Goal, dispatch_uid='awt_goal_deleted')
+@receiver(post_delete, sender=Progress, dispatch_uid='awt_progress_deleted')
+@receiver(post_delete, sender=Mistake, dispatch_uid='awt_mistake_deleted')
+def entry_changed(sender, instance, **kwargs):
+    '''The public list shows entry counts, so entries of public topics invalidate it too'''
+    # The entry carries its topic's visibility, the topic may be gone when deleted by cascade
+    if not instance.is_public:
+        return
+    invalidate_public_topics()
+    transaction.on_commit(invalidate_public_topics)
+
+
+@receiver(connection_created, dispatch_uid='awt_time_queries')
+def connection_opened(sender, connection, **kwargs):
+    '''Time the queries of every database connection for the request metrics and profiles'''
+    metrics.watch_connection(connection)
+    profiling.watch_connection(connection)
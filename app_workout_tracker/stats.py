@@ -0,0 +1,111 @@
+'''Incremental maintenance of the TopicStats summary rows.
+
+Every Goal, Progress or Mistake write adjusts the stats row of its topic with one UPDATE of
+F() expressions (connected in signals.py), so the lists read counts by primary key lookups
+instead of aggregating the entry tables (see TopicQuerySet.with_stats). The entry models save
+and delete inside a transaction, so the entry and its stats change together.
+
+rebuild_topic_stats() recounts from the entry tables, for topics created with bulk_create()
+or rows changed with update(), which send no signals.'''
+
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Length
+
+from .models import LatestOf, Topic, TopicStats, Goal, Progress, Mistake
+
+COUNT_FIELDS = {Goal: 'goal_count', Progress: 'progress_count', Mistake: 'mistake_count'}
+STATS_FIELDS = ['goal_count', 'progress_count', 'mistake_count', 'last_entry_at', 'text_length']
+
+
+def entry_length(entry):
+    '''Characters an entry adds to TopicStats.text_length'''
+    return len(entry.summary) + len(entry.text)
+
+
+def stored_entry(entry):
+    '''(topic_id, length, date_added) of entry as currently stored, None if it is not saved yet'''
+    if entry.pk is None:
+        return None
+    return (type(entry).objects.filter(pk=entry.pk).order_by()
+            .annotate(length=Length('summary') + Length('text'))
+            .values_list('topic_id', 'length', 'date_added').first())
+
+
+def entry_added(model, topic_id, length, date_added, count=1):
+    '''Count a new entry, or with count=0 an edited one, in the stats of topic_id'''
+    field = COUNT_FIELDS[model]
+    updated = TopicStats.objects.filter(topic_id=topic_id).update(**{
+        field: F(field) + count,
+        'text_length': F('text_length') + length,
+        'last_entry_at': LatestOf(F('last_entry_at'), Value(date_added, output_field=models.DateTimeField())),
+    })
+    if not updated:
+        # A topic from before the stats table or from bulk_create(), count it from scratch
+        rebuild_topic_stats([topic_id])
+
+
+def entry_removed(model, topic_id, length, date_added):
+    '''Take a deleted entry out of the stats of topic_id'''
+    field = COUNT_FIELDS[model]
+    stats = TopicStats.objects.filter(topic_id=topic_id)
+    # Nothing to update when the whole topic is being deleted, the stats row goes first
+    if not stats.update(**{field: F(field) - 1, 'text_length': F('text_length') - length}):
+        return
+    # last_entry_at only moves back when the newest entry was the one deleted
+    latest = Topic.objects.filter(pk=OuterRef('topic_id')).with_entry_stats().values('last_entry_at')
+    stats.filter(last_entry_at__lte=date_added).update(last_entry_at=Subquery(latest))
+
+
+def entry_saved(entry, before):
+    '''Apply a saved entry to the stats, before being what stored_entry() returned ahead of the save'''
+    model = type(entry)
+    if before is not None and before[0] != entry.topic_id:
+        # Moved to another topic: leaves the old one and is new to this one
+        entry_removed(model, *before)
+        before = None
+    if before is None:
+        entry_added(model, entry.topic_id, entry_length(entry), entry.date_added)
+    else:
+        entry_added(model, entry.topic_id, entry_length(entry) - before[1], entry.date_added, count=0)
+
+
+def _text_length(model):
+    entries = model.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    total = entries.annotate(n=Sum(Length('summary') + Length('text'))).values('n')
+    return Coalesce(Subquery(total, output_field=models.BigIntegerField()), 0)
+
+
+def rebuild_topic_stats(topic_ids=None, batch_size=1000, dry_run=False):
+    '''Recount the stats of topic_ids (every topic when None) from the entry tables.
+
+    Works through the topics batch_size at a time in primary key order and returns the number of
+    stats rows that were missing or wrong. With dry_run they are only counted, not written.'''
+    topics = Topic.objects.order_by('pk').values_list('pk', flat=True)
+    if topic_ids is not None:
+        topics = topics.filter(pk__in=topic_ids)
+
+    repaired, last = 0, 0
+    while True:
+        batch = list(topics.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            return repaired
+        last = batch[-1]
+
+        counted = (Topic.objects.filter(pk__in=batch).order_by().with_entry_stats()
+                   .annotate(text_length=_text_length(Goal) + _text_length(Progress) + _text_length(Mistake))
+                   .values_list('pk', *STATS_FIELDS))
+        with transaction.atomic():
+            stored = {row[0]: row[1:] for row in
+                      TopicStats.objects.filter(pk__in=batch).select_for_update().values_list('pk', *STATS_FIELDS)}
+            stale, missing = [], []
+            for pk, *values in counted:
+                if stored.get(pk) == tuple(values):
+                    continue
+                stats = TopicStats(topic_id=pk, **dict(zip(STATS_FIELDS, values)))
+                (stale if pk in stored else missing).append(stats)
+            repaired += len(stale) + len(missing)
+            if not dry_run:
+                TopicStats.objects.bulk_update(stale, STATS_FIELDS)
+                # Conflicts are rows a concurrent write created meanwhile, already counted by it
+                TopicStats.objects.bulk_create(missing, ignore_conflicts=True)
@@ -0,0 +1,175 @@
+'''Delta sync for the offline clients: what changed in a user's topics and entries after a cursor,
+and a batch of the client's creates and edits saved in one request.
+
+Every save of a Topic, Goal, Progress or Mistake numbers it with the next change_seq of its
+owner's SyncCounter, and every delete leaves a Tombstone numbered the same way (see
+AtomicChange in models.py). The counter row stays locked until the write commits, so one user's
+changes become visible in the order of their numbers. changes() reads only the rows numbered
+after the client's cursor, from the (owner, change_seq, id) index of every table: a sync
+costs as much as there are changes to send, however long the history.
+
+Rows from before the numbering, and the ones bulk created without it, have change_seq 0, so the
+cursor is the (change_seq, kind, id) of the last change sent, like the timeline's one. A
+tombstoned topic stands for its entries as well, which its background deletion removes without
+leaving tombstones (see deletion.py).'''
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.forms.models import model_to_dict
+from django.http import Http404
+
+from .forms import TopicForm
+from .kinds import KINDS
+from .models import Tombstone, Topic
+from .pagination import decode_cursor, encode_cursor
+
+## Kind of a change -> form validating the client's version of it, also used for Tombstone.kind
+FORMS = {'topic': TopicForm}
+FORMS.update((kind.model._meta.model_name, kind.form) for kind in KINDS.values())
+
+
+class PushRejected(Exception):
+    '''A pushed batch with errors, none of it was saved'''
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def rows_of(kind, owner):
+    '''Topics or entries of kind belonging to owner, without the topics being deleted'''
+    model = FORMS[kind]._meta.model
+    if model is Topic:
+        return Topic.objects.filter(owner=owner)
+    return model.objects.owned_by(owner)
+
+
+def change_json(kind, row):
+    if isinstance(row, Tombstone):
+        return {'kind': row.kind, 'id': row.object_id, 'change_seq': row.change_seq, 'deleted': True}
+    data = {'kind': kind, 'id': row.id, 'change_seq': row.change_seq, 'date_added': row.date_added}
+    if kind == 'topic':
+        data.update(name=row.topic_name, public=row.view_option)
+    else:
+        data.update(topic_id=row.topic_id, summary=row.summary, text=row.text)
+    return data
+
+
+def _after(number, cursor_key):
+    '''Changes of source number that come after the cursor'''
+    change_seq, kind, pk = cursor_key
+    if number < kind:
+        return Q(change_seq__gt=change_seq)
+    if number > kind:
+        return Q(change_seq__gte=change_seq)
+    return Q(change_seq__gt=change_seq) | Q(change_seq=change_seq, id__gt=pk)
+
+
+def _cursor_key(cursor):
+    values = decode_cursor(cursor)
+    try:
+        return int(values[0]), int(values[1]), int(values[2])
+    except (IndexError, TypeError, ValueError):
+        raise Http404('Invalid sync cursor')
+
+
+def changes(owner, cursor=None, limit=None):
+    '''(changes, cursor, more): the JSON of up to limit changes of owner's rows after cursor, oldest
+    first, the cursor to ask for the next ones with, and whether there are more already'''
+    limit = limit or settings.SYNC_PAGE_SIZE
+    cursor_key = _cursor_key(cursor) if cursor else None
+    # Tombstones last, after the rows at equal change_seq
+    sources = [(kind, rows_of(kind, owner)) for kind in FORMS] + [(None, Tombstone.objects.filter(owner=owner))]
+    found = []
+    for number, (kind, rows) in enumerate(sources):
+        if cursor_key is not None:
+            rows = rows.filter(_after(number, cursor_key))
+        # No more than a page from each, the merged page cannot hold more of them
+        found += [(row.change_seq, number, row.id, kind, row) for row in rows.order_by('change_seq', 'id')[:limit + 1]]
+    found.sort(key=lambda change: change[:3])
+    page = found[:limit]
+    if page:
+        cursor = encode_cursor(*page[-1][:3])
+    return [change_json(kind, row) for *key, kind, row in page], cursor, len(found) > limit
+
+
+def _topic(owner, change, topics):
+    '''Topic of a pushed entry: a topic created earlier in the batch (topic_ref) or an existing one'''
+    if change.get('topic_ref') is not None:
+        topic = topics.get(('ref', change['topic_ref']))
+        if topic is None:
+            raise ValidationError('topic_ref %r is not a topic of this batch' % change['topic_ref'])
+        return topic
+    key = ('id', change.get('topic_id'))
+    if key not in topics:
+        topics[key] = Topic.objects.filter(owner=owner, pk=change.get('topic_id')).first()
+        if topics[key] is None:
+            raise ValidationError('Topic %r not found' % change.get('topic_id'))
+    return topics[key]
+
+
+def _apply(owner, change, topics):
+    if not isinstance(change, dict):
+        raise ValidationError('A change must be an object')
+    kind = change.get('kind')
+    form_class = FORMS.get(kind)
+    if form_class is None:
+        raise ValidationError('Unknown kind %r' % kind)
+    for key in ('id', 'base_seq', 'topic_id'):
+        if change.get(key) is not None and not isinstance(change[key], int):
+            raise ValidationError('%s must be a number' % key)
+    fields = form_class._meta.fields
+    data = {field: change[field] for field in fields if field in change}
+
+    instance = None
+    if change.get('id') is not None:
+        # Locked, so no other write slips in between the conflict check and the save
+        instance = rows_of(kind, owner).select_for_update(of=('self',)).filter(pk=change['id']).first()
+        if instance is None:
+            raise ValidationError('%s %r not found' % (kind, change['id']))
+        if change.get('base_seq') is not None and instance.change_seq > change['base_seq']:
+            raise ValidationError('Conflict: %s %s changed on the server after change_seq %s'
+                                  % (kind, instance.pk, change['base_seq']))
+        # Fields the client left out keep their value
+        data = dict(model_to_dict(instance, fields), **data)
+
+    form = form_class(data, instance=instance)
+    if not form.is_valid():
+        raise ValidationError(['%s: %s' % (field, ' '.join(messages)) for field, messages in form.errors.items()])
+    row = form.save(commit=False)
+    if instance is None:
+        if kind == 'topic':
+            row.owner = owner
+        else:
+            row.topic = _topic(owner, change, topics)
+    row.save()
+    if kind == 'topic' and change.get('ref') is not None:
+        topics[('ref', change['ref'])] = row
+    return row
+
+
+def push(owner, batch):
+    '''Save the creates and edits of batch for owner in one transaction, all of them or none.
+
+    batch is a list of {"kind", fields...}: with an "id" an edit, which fails if the row changed
+    after its "base_seq" when given; without one a create, and an entry then names its topic with
+    "topic_id" or with the "ref" of a topic created earlier in the batch as its "topic_ref".
+    Returns {"ref", "kind", "id", "change_seq"} for every change, raises PushRejected otherwise.'''
+    if not isinstance(batch, list) or not 0 < len(batch) <= settings.SYNC_PUSH_LIMIT:
+        raise PushRejected([{'index': None, 'error': 'Send a list of 1 to %d changes' % settings.SYNC_PUSH_LIMIT}])
+    results, errors, topics = [], [], {}
+    with transaction.atomic():
+        for index, change in enumerate(batch):
+            try:
+                row = _apply(owner, change, topics)
+            except ValidationError as error:
+                errors.append({'index': index, 'error': '; '.join(error.messages)})
+                continue
+            results.append({'ref': change.get('ref'), 'kind': change['kind'], 'id': row.pk,
+                            'change_seq': row.change_seq})
+        if errors:
+            # Rolls the ones that were saved back
+            raise PushRejected(errors)
+    return results
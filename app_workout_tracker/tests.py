@@ -1,8 +1,32 @@
-from django.db import models
-from django.test import TestCase
+import asyncio
+import concurrent.futures
+import csv
+import datetime
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from django.db import models, connection, connections, router
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import AsyncClient, Client, LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 # Create your tests here.
-from .models import Topic, Goal, Progress, Mistake
+from . import benchmark, caching, charts, deletion, jobs, kinds, metrics, routers, search, stats, timeline
+from .management.commands import bench_sessions
+from .management.commands.seed_workouts import explicit_timestamps, seeded_users
+from .models import Job, Topic, TopicStats, Goal, Progress, Mistake
 from django.utils import timezone
 from django.contrib.auth.models import User, AnonymousUser
 from django.urls import reverse
@@ -23,14 +47,14 @@ class ModelTest(TestCase):
 
     def test_1_add_objects_as_owner(self):
         topic = Topic.objects.create(topic_name="test", owner=self.user2)
-        Goal.objects.create(topic=topic, summary="test test", text="test test test")
-        Progress.objects.create(topic=topic, summary="test1 test1", text="test1 test1 test1")
-        Mistake.objects.create(topic=topic, summary="test2 test2", text="test2 test2 test2")
+        goal = Goal.objects.create(topic=topic, summary="test test", text="test test test")
+        progress = Progress.objects.create(topic=topic, summary="test1 test1", text="test1 test1 test1")
+        mistake = Mistake.objects.create(topic=topic, summary="test2 test2", text="test2 test2 test2")
 
         self.assertEqual(Topic.objects.get(id=topic.id).topic_name, "test")
-        self.assertEqual(Goal.objects.get(id=topic.id).summary, "test test")
-        self.assertEqual(Progress.objects.get(id=topic.id).summary, "test1 test1")
-        self.assertEqual(Mistake.objects.get(id=topic.id).summary, "test2 test2")
+        self.assertEqual(Goal.objects.get(id=goal.id).summary, "test test")
+        self.assertEqual(Progress.objects.get(id=progress.id).summary, "test1 test1")
+        self.assertEqual(Mistake.objects.get(id=mistake.id).summary, "test2 test2")
 
     def test_2_del_objects_as_owner(self):
         '''Checking if the topics could be deleted along with subtopics'''
@@ -59,6 +83,7 @@ class ViewsTest(TestCase):
     #################### Setup and Preparation before view test ###############
     def setUp(self):
         '''setUp function to create user before any test is created'''
+        cache.clear()
         self.user1 = User.objects.create_user(username='test', email='test@test.com')
         self.user1.set_password('12345')
         self.user1.save()
@@ -126,6 +151,11 @@ class ViewsTest(TestCase):
         # Delete topic
         self.client.get(reverse('awt:delete_topic', args=[self.topic_id]))
 
+        # Hidden at once, its entries are deleted in the background once the request commits
+        response1 = self.client.get(reverse('awt:secure_topics_list'))
+        self.assertContains(response1, "being deleted")
+        deletion.purge_topic(self.topic_id)
+
         # Check if deleted
         response2 = self.client.get(reverse('awt:secure_topics_list'))
         self.assertContains(response2, "No new topic found")
@@ -168,10 +198,10 @@ class ViewsTest(TestCase):
                                 kwargs={'topic_id':self.topic_id, 'subtopic_name':'goals_list',
                                         'subtopic_id':Goal.objects.get(summary="Goals_SUMMARY_TEST").id})))
         responses.append(self.client.get(reverse('awt:secure_subtopic_detail',
-                                kwargs={'topic_id': self.topic_id, 'subtopic_name': 'goals_list',
+                                kwargs={'topic_id': self.topic_id, 'subtopic_name': 'progress_list',
                                         'subtopic_id': Progress.objects.get(summary="Progress_SUMMARY_TEST").id})))
         responses.append(self.client.get(reverse('awt:secure_subtopic_detail',
-                                kwargs={'topic_id': self.topic_id, 'subtopic_name': 'goals_list',
+                                kwargs={'topic_id': self.topic_id, 'subtopic_name': 'mistakes_list',
                                         'subtopic_id': Mistake.objects.get(summary="Mistakes_SUMMARY_TEST").id})))
         for response in responses:
             self.assertContains(response, 'TEXT_DETAIL')
@@ -481,3 +511,1292 @@ class ViewsTest(TestCase):
 
 
 
+class PaginationTest(TestCase):
+    '''Class to check the keyset pagination of the list views'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='paged', owner=self.user1)
+        Topic.objects.bulk_create([Topic(topic_name='topic%d' % n, owner=self.user1) for n in range(30)])
+        Goal.objects.bulk_create([Goal(topic=self.topic, summary='goal%d' % n, text='text') for n in range(30)])
+        # Identical timestamps force the id tie-breaker to do the work
+        Topic.objects.update(date_added=timezone.now())
+
+    def walk(self, url, context_name):
+        '''Follow the Older links from the first page, returning the rows of every page'''
+        pages = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            page = response.context[context_name]
+            if context_name == 'called_submodel' and isinstance(page, list):
+                page = page[1]
+            pages.append(list(page))
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_22_public_topics_pages(self):
+        pages = self.walk(reverse('awt:public_topics_list'), 'public_topics')
+        self.assertEqual([len(page) for page in pages], [25, 6])
+        ids = [topic.id for page in pages for topic in page]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(set(ids)), Topic.objects.count())
+
+    def test_23_secure_entry_pages(self):
+        self.client.login(username='test', password='12345')
+        url = reverse('awt:secure_subtopic_list', kwargs={'topic_id': self.topic.id, 'topic_name': 'paged',
+                                                          'subtopic_name': 'goals_list'})
+        pages = self.walk(url, 'called_submodel')
+        self.assertEqual([len(page) for page in pages], [25, 5])
+        self.assertEqual(len({goal.id for page in pages for goal in page}), 30)
+
+    def test_24_later_pages_cost_the_same(self):
+        url = reverse('awt:public_topics_list')
+        with self.assertNumQueries(1):
+            first = self.client.get(url)
+        with self.assertNumQueries(1):
+            self.client.get(url, {'cursor': first.context['public_topics'].next_cursor})
+
+    def test_25_invalid_cursor(self):
+        response = self.client.get(reverse('awt:public_topics_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTest(TestCase):
+    '''Class to check that every view in urls.py is served from an index on a large dataset'''
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_workouts', users=200, topics_per_user=20, entries_per_topic=15, stdout=io.StringIO())
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='plans', owner=cls.user1)
+        for model in (Goal, Progress, Mistake):
+            model.objects.create(topic=cls.topic, summary='plan', text='plan')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user1)
+
+    def assertIndexedPlans(self, url):
+        '''Request url and EXPLAIN every query it ran against the app tables'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'app_workout_tracker_' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            # A sort over a handful of index matched rows is fine, a sequential scan feeding it is not
+            self.assertNotIn('Seq Scan on app_workout_tracker_', plan, '%s\n%s' % (sql, plan))
+
+    def test_26_list_view_plans(self):
+        self.assertIndexedPlans(reverse('awt:public_topics_list'))
+        self.assertIndexedPlans(reverse('awt:secure_topics_list'))
+        for subtopic in ['goals_list', 'progress_list', 'mistakes_list']:
+            self.assertIndexedPlans(reverse('awt:public_subtopic_list',
+                                            kwargs={'topic_id': self.topic.id, 'subtopic_name': subtopic}))
+            self.assertIndexedPlans(reverse('awt:secure_subtopic_list',
+                                            kwargs={'topic_id': self.topic.id, 'topic_name': 'plans',
+                                                    'subtopic_name': subtopic}))
+            self.assertIndexedPlans(reverse('awt:add_subtopic', kwargs={'topic_id': self.topic.id,
+                                                                        'subtopic': subtopic}))
+
+    def test_27_detail_view_plans(self):
+        for subtopic, model in [('goals_list', Goal), ('progress_list', Progress), ('mistakes_list', Mistake)]:
+            entry_id = model.objects.get(topic=self.topic).id
+            self.assertIndexedPlans(reverse('awt:public_subtopic_detail',
+                                            kwargs={'subtopic_id': entry_id, 'subtopic_name': subtopic}))
+            self.assertIndexedPlans(reverse('awt:secure_subtopic_detail',
+                                            kwargs={'topic_id': self.topic.id, 'subtopic_id': entry_id,
+                                                    'subtopic_name': subtopic}))
+            self.assertIndexedPlans(reverse('awt:edit_subtopic',
+                                            kwargs={'subtopic_id': entry_id, 'subtopic_name': subtopic}))
+
+    def test_28_later_page_plans(self):
+        first = self.client.get(reverse('awt:public_topics_list'))
+        self.assertIndexedPlans(reverse('awt:public_topics_list') + '?cursor=' + first.context['public_topics'].next_cursor)
+
+    def test_57_search_plans(self):
+        self.assertIndexedPlans(reverse('awt:public_search') + '?q=plan')
+        self.assertIndexedPlans(reverse('awt:secure_search') + '?q=plan')
+
+    def test_61_timeline_plans(self):
+        self.assertIndexedPlans(reverse('awt:secure_timeline'))
+        self.assertIndexedPlans(reverse('awt:secure_topic_timeline', kwargs={'topic_id': self.topic.id}))
+        self.assertIndexedPlans(reverse('awt:public_topic_timeline', kwargs={'topic_id': self.topic.id}))
+
+
+class SeedCommandTest(TestCase):
+    '''Class to check the seed_workouts management command'''
+
+    def seed(self, **options):
+        call_command('seed_workouts', stdout=io.StringIO(), **options)
+
+    def test_29_seed_counts(self):
+        self.seed(users=3, topics_per_user=4, entries_per_topic=10, public_ratio=1, batch_size=7)
+        self.assertEqual(User.objects.filter(username__startswith='seed').count(), 3)
+        self.assertEqual(Topic.objects.filter(view_option=True).count(), 12)
+        self.assertEqual(Goal.objects.count() + Progress.objects.count() + Mistake.objects.count(), 120)
+        self.assertTrue(self.client.login(username='seed0', password='12345'))
+
+    def test_30_seed_is_deterministic(self):
+        self.seed(users=2, entries_per_topic=30, mix='1:1:0', prefix='a', seed=7)
+        self.seed(users=2, entries_per_topic=30, mix='1:1:0', prefix='b', seed=7, batch_size=3)
+        self.assertEqual(Mistake.objects.count(), 0)
+        for model, fields in [(Topic, ['topic_name', 'view_option']), (Goal, ['summary', 'text']),
+                              (Progress, ['summary', 'text'])]:
+            owner = 'owner__username__startswith' if model is Topic else 'topic__owner__username__startswith'
+            runs = [list(model.objects.filter(**{owner: prefix}).order_by('id').values_list('date_added', *fields))
+                    for prefix in 'ab']
+            self.assertEqual(runs[0], runs[1])
+
+    def test_31_seed_rejects_existing_prefix(self):
+        self.seed(users=1)
+        self.assertRaises(CommandError, self.seed, users=1)
+        # Only the users of that very prefix count, seed_1 and seed2_0 are not seed's
+        self.seed(users=1, prefix='seed2_')
+        User.objects.create_user('seed_1')
+        self.assertEqual(list(seeded_users('seed').values_list('username', flat=True)), ['seed0'])
+
+
+class BenchmarkTest(TestCase):
+    '''Class to check the bench_endpoints harness'''
+
+    def bench(self, *args, **options):
+        options.update(in_place=True, users=3, topics_per_user=4, entries_per_topic=10, iterations=2, warmup=0)
+        call_command('bench_endpoints', *args, stdout=io.StringIO(), **options)
+
+    def test_32_every_route_is_benchmarked(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            self.bench(output=output.name)
+            report = json.load(output)
+        self.assertEqual(set(report['endpoints']), benchmark.route_names())
+        self.assertEqual(report['budget_failures'], [])
+        for result in report['endpoints'].values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_33_budget_violation_fails_the_run(self):
+        with self.assertRaisesMessage(CommandError, 'awt:secure_topics_list: queries 3 exceeds budget 2'):
+            self.bench('--budget', 'awt:secure_topics_list=queries:2', endpoint=['awt:secure_topics_list'])
+
+
+class PublicCacheTest(TestCase):
+    '''Class to check the cache in front of the public topic list'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='cached', owner=self.user1)
+
+    def public_topics(self):
+        return [topic.topic_name for topic in self.client.get(reverse('awt:public_topics_list')).context['public_topics']]
+
+    def test_34_repeat_hits_skip_the_database(self):
+        self.public_topics()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.public_topics(), ['cached'])
+
+    def test_35_writes_invalidate(self):
+        self.assertEqual(self.public_topics(), ['cached'])
+        self.topic.view_option = False
+        self.topic.save()
+        self.assertEqual(self.public_topics(), [])
+        self.topic.view_option = True
+        self.topic.save()
+        Topic.objects.create(topic_name='new', owner=self.user1)
+        self.assertEqual(self.public_topics(), ['new', 'cached'])
+        self.topic.delete()
+        self.assertEqual(self.public_topics(), ['new'])
+
+    def test_36_stale_copy_served_during_rebuild(self):
+        cache.add('key:lock', 1)
+        cache.set('stale', 'old')
+        self.assertEqual(caching.get_or_build('key', 'stale', lambda: self.fail('rebuilt twice'), 60), 'old')
+
+    def test_37_single_flight_rebuild(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return 'fresh'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(caching.get_or_build('flight', 'flight:stale', build, 60)))
+                   for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['fresh'] * 5)
+        self.assertEqual(len(builds), 1)
+
+
+class EntryStatsTest(TestCase):
+    '''Class to check the entry counts shown on the topic lists'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='counted', owner=self.user1)
+        self.client.login(username='test', password='12345')
+
+    def test_38_counts_and_last_entry(self):
+        Goal.objects.create(topic=self.topic, summary='g', text='g')
+        Progress.objects.create(topic=self.topic, summary='p1', text='p')
+        last = Progress.objects.create(topic=self.topic, summary='p2', text='p')
+        empty = Topic.objects.create(topic_name='empty', owner=self.user1)
+
+        topics = {topic.id: topic for topic in Topic.objects.with_entry_stats()}
+        self.assertEqual((topics[self.topic.id].goal_count, topics[self.topic.id].progress_count,
+                          topics[self.topic.id].mistake_count), (1, 2, 0))
+        self.assertEqual(topics[self.topic.id].last_entry_at, last.date_added)
+        self.assertEqual((topics[empty.id].goal_count, topics[empty.id].last_entry_at), (0, None))
+
+    def test_39_topic_list_query_count_is_constant(self):
+        with self.assertNumQueries(3):
+            self.client.get(reverse('awt:secure_topics_list'))
+        for n in range(10):
+            topic = Topic.objects.create(topic_name='more%d' % n, owner=self.user1)
+            Mistake.objects.create(topic=topic, summary='m', text='m')
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('awt:secure_topics_list'))
+        self.assertContains(response, '<span class="badge bg-danger">1</span>', count=10)
+
+    def test_40_public_counts_follow_entry_writes(self):
+        self.client.get(reverse('awt:public_topics_list'))
+        goal = Goal.objects.create(topic=self.topic, summary='g', text='g')
+        response = self.client.get(reverse('awt:public_topics_list'))
+        self.assertEqual(response.context['public_topics'][0].goal_count, 1)
+        goal.delete()
+        response = self.client.get(reverse('awt:public_topics_list'))
+        self.assertEqual(response.context['public_topics'][0].goal_count, 0)
+
+
+class TopicStatsTest(TestCase):
+    '''Class to check the incrementally maintained TopicStats rows'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='counted', owner=self.user1)
+        self.client.login(username='test', password='12345')
+
+    def assertStatsMatchRecount(self, topic):
+        '''The incremental stats of topic equal a recount from the entry tables'''
+        fields = ['goal_count', 'progress_count', 'mistake_count', 'last_entry_at']
+        stored = Topic.objects.filter(pk=topic.pk).with_stats().values(*fields).get()
+        counted = Topic.objects.filter(pk=topic.pk).with_entry_stats().values(*fields).get()
+        self.assertEqual(stored, counted)
+
+    def test_41_views_keep_stats_up_to_date(self):
+        self.client.post(reverse('awt:add_subtopic', kwargs={'topic_id': self.topic.id, 'subtopic': 'goals_list'}),
+                         {'summary': 'squat', 'text': '100kg'})
+        self.client.post(reverse('awt:add_subtopic', kwargs={'topic_id': self.topic.id, 'subtopic': 'mistakes_list'}),
+                         {'summary': 'form', 'text': 'bad'})
+        goal = Goal.objects.get(topic=self.topic)
+        self.client.post(reverse('awt:edit_subtopic', kwargs={'subtopic_id': goal.id, 'subtopic_name': 'goals_list'}),
+                         {'summary': 'squat', 'text': '120kg!'})
+        row = TopicStats.objects.get(topic=self.topic)
+        self.assertEqual((row.goal_count, row.mistake_count, row.text_length), (1, 1, 5 + 6 + 4 + 3))
+        self.assertStatsMatchRecount(self.topic)
+
+        mistake = Mistake.objects.get(topic=self.topic)
+        self.client.get(reverse('awt:delete_subtopic', kwargs={'subtopic_id': mistake.id, 'subtopic_name': 'mistakes_list'}))
+        row.refresh_from_db()
+        self.assertEqual((row.goal_count, row.mistake_count, row.text_length), (1, 0, 11))
+        self.assertStatsMatchRecount(self.topic)
+
+    def test_42_deleting_the_newest_entry(self):
+        first = Progress.objects.create(topic=self.topic, summary='p1', text='p')
+        newest = Progress.objects.create(topic=self.topic, summary='p2', text='p')
+        newest.delete()
+        self.assertEqual(TopicStats.objects.get(topic=self.topic).last_entry_at, first.date_added)
+        # Moving an entry counts it on its new topic only
+        other = Topic.objects.create(topic_name='other', owner=self.user1)
+        first.topic = other
+        first.save()
+        self.assertStatsMatchRecount(self.topic)
+        self.assertStatsMatchRecount(other)
+        other.delete()
+        self.assertFalse(TopicStats.objects.filter(topic_id=other.id).exists())
+
+    def test_43_rebuild_repairs_drift(self):
+        Goal.objects.create(topic=self.topic, summary='g', text='g')
+        # update() and bulk_create() bypass the signals
+        TopicStats.objects.filter(topic=self.topic).update(goal_count=7)
+        Topic.objects.bulk_create([Topic(topic_name='legacy', owner=self.user1)])
+        legacy = Topic.objects.get(topic_name='legacy')
+        Mistake.objects.bulk_create([Mistake(topic=legacy, summary='m', text='m')])
+
+        out = io.StringIO()
+        call_command('rebuild_topic_stats', '--dry-run', stdout=out)
+        self.assertIn('2 topic stats out of date', out.getvalue())
+        call_command('rebuild_topic_stats', stdout=io.StringIO())
+        self.assertStatsMatchRecount(self.topic)
+        self.assertStatsMatchRecount(legacy)
+        self.assertEqual(TopicStats.objects.get(topic=legacy).text_length, 2)
+        out = io.StringIO()
+        call_command('rebuild_topic_stats', '--dry-run', stdout=out)
+        self.assertIn('0 topic stats out of date', out.getvalue())
+
+    def test_44_seeded_stats_match_recount(self):
+        call_command('seed_workouts', users=2, topics_per_user=3, entries_per_topic=7, prefix='st', stdout=io.StringIO())
+        self.assertEqual(TopicStats.objects.filter(topic__owner__username__startswith='st').count(), 6)
+        self.assertEqual(stats.rebuild_topic_stats(dry_run=True), 0)
+
+
+class ExportTest(TestCase):
+    '''Class to check the streaming history export'''
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='mine', owner=self.user1, view_option=False)
+        Goal.objects.create(topic=self.topic, summary='goal, with comma', text='line one\nline two')
+        Progress.objects.create(topic=self.topic, summary='p', text='p')
+        other = Topic.objects.create(topic_name='theirs', owner=self.user2)
+        Mistake.objects.create(topic=other, summary='not mine', text='m')
+        self.client.login(username='test', password='12345')
+
+    def test_45_csv_export_streams_own_rows_only(self):
+        response = self.client.get(reverse('awt:export_history', args=['csv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['record', 'id', 'topic_id', 'topic_name', 'view_option', 'summary', 'text', 'date_added'])
+        self.assertEqual([row[0] for row in rows[1:]], ['topic', 'goal', 'progress'])
+        self.assertEqual(rows[2][5:7], ['goal, with comma', 'line one\nline two'])
+
+    def test_46_ndjson_export(self):
+        response = self.client.get(reverse('awt:export_history', args=['ndjson']))
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(record['record'], record['topic_name']) for record in records],
+                         [('topic', 'mine'), ('goal', 'mine'), ('progress', 'mine')])
+        self.assertIs(records[0]['view_option'], False)
+        self.assertEqual(self.client.get(reverse('awt:export_history', args=['xml'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('awt:export_history', args=['csv'])).status_code, 302)
+
+
+class ImportTest(TestCase):
+    '''Class to check the bulk entry import'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='imported', owner=self.user1)
+        self.client.login(username='test', password='12345')
+
+    def upload(self, name, content, subtopic='progress_list', topic=None):
+        url = reverse('awt:import_entries', kwargs={'topic_id': (topic or self.topic).id, 'subtopic': subtopic})
+        return self.client.post(url, {'file': SimpleUploadedFile(name, content)})
+
+    def test_47_csv_import_in_batches(self):
+        rows = ''.join('set %d,"%d reps,\nfelt good"\n' % (n, n) for n in range(25))
+        with self.settings(IMPORT_BATCH_SIZE=10), CaptureQueriesContext(connection) as queries:
+            response = self.upload('history.csv', ('summary,text\n' + rows).encode())
+        self.assertEqual(response.context['result'].total, 25)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "app_workout_tracker_progress"')]), 3)
+        self.assertEqual(Progress.objects.filter(topic=self.topic).count(), 25)
+        self.assertEqual(Progress.objects.get(summary='set 3').text, '3 reps,\nfelt good')
+        self.assertEqual(TopicStats.objects.get(topic=self.topic).progress_count, 25)
+
+    def test_48_export_round_trip(self):
+        Goal.objects.create(topic=self.topic, summary='g', text='g')
+        Mistake.objects.create(topic=self.topic, summary='m', text='m')
+        exported = b''.join(self.client.get(reverse('awt:export_history', args=['ndjson'])).streaming_content)
+        other = Topic.objects.create(topic_name='copy', owner=self.user1)
+        response = self.upload('history.ndjson', exported, topic=other)
+        self.assertEqual(response.context['result'].total, 2)
+        self.assertEqual((Goal.objects.filter(topic=other).count(), Mistake.objects.filter(topic=other).count()), (1, 1))
+
+    def test_49_bad_rows_import_nothing(self):
+        content = 'summary,text\nok,fine\n%s,too long\n,no summary\n' % ('x' * 101)
+        response = self.upload('history.csv', content.encode(), subtopic='goals_list')
+        result = response.context['result']
+        self.assertEqual((result.total, result.error_count), (0, 2))
+        self.assertEqual([line for line, message in result.errors], [3, 4])
+        self.assertContains(response, 'Nothing was imported')
+        self.assertFalse(Goal.objects.filter(topic=self.topic).exists())
+        self.assertEqual(self.upload('history.ndjson', b'{"summary": "a"}\n[1]\n').context['result'].error_count, 2)
+        self.assertFalse(self.upload('history.txt', b'summary,text\n').context['form'].is_valid())
+
+    def test_50_import_as_non_owner(self):
+        theirs = Topic.objects.create(topic_name='theirs', owner=self.user2)
+        self.assertEqual(self.upload('history.csv', b'summary,text\na,b\n', topic=theirs).status_code, 404)
+        self.assertFalse(Progress.objects.filter(topic=theirs).exists())
+
+
+class ApiTest(TestCase):
+    '''Class to check the read-only JSON API'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='public', owner=self.user1)
+        self.private = Topic.objects.create(topic_name='private', owner=self.user1, view_option=False)
+        self.goal = Goal.objects.create(topic=self.topic, summary='g', text='goal text')
+        self.secret = Goal.objects.create(topic=self.private, summary='s', text='secret')
+
+    def test_51_public_api(self):
+        response = self.client.get(reverse('awt:api_public_topics'))
+        self.assertEqual(response.json(), {'results': [{
+            'id': self.topic.id, 'name': 'public', 'public': True, 'date_added': response.json()['results'][0]['date_added'],
+            'goals': 1, 'progress': 0, 'mistakes': 0, 'last_entry_at': response.json()['results'][0]['last_entry_at']}],
+            'next': None})
+        response = self.client.get(reverse('awt:api_public_entries', kwargs={'topic_id': self.topic.id, 'kind': 'goals'}))
+        self.assertEqual([entry['summary'] for entry in response.json()['results']], ['g'])
+        self.assertNotIn('text', response.json()['results'][0])
+        response = self.client.get(reverse('awt:api_public_entry', kwargs={'kind': 'goals', 'entry_id': self.goal.id}))
+        self.assertEqual(response.json()['text'], 'goal text')
+        for url in [reverse('awt:api_public_entries', kwargs={'topic_id': self.private.id, 'kind': 'goals'}),
+                    reverse('awt:api_public_entry', kwargs={'kind': 'goals', 'entry_id': self.secret.id}),
+                    reverse('awt:api_public_entry', kwargs={'kind': 'nope', 'entry_id': self.goal.id}),
+                    reverse('awt:api_public_topics') + '?cursor=garbage']:
+            response = self.client.get(url)
+            self.assertEqual((response.status_code, response.json()), (404, {'error': 'not found'}))
+        self.assertEqual(self.client.post(reverse('awt:api_public_topics')).status_code, 405)
+
+    def test_52_conditional_get(self):
+        url = reverse('awt:api_public_entry', kwargs={'kind': 'goals', 'entry_id': self.goal.id})
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        list_url = reverse('awt:api_public_entries', kwargs={'topic_id': self.topic.id, 'kind': 'goals'})
+        list_etag = self.client.get(list_url)['ETag']
+        topics_etag = self.client.get(reverse('awt:api_public_topics'))['ETag']
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('awt:api_public_topics'), HTTP_IF_NONE_MATCH=topics_etag).status_code, 304)
+
+        self.goal.text = 'edited'
+        self.goal.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+        # The entry count shown on the topic list changes with a new entry
+        Goal.objects.create(topic=self.topic, summary='g2', text='g2')
+        self.assertEqual(self.client.get(reverse('awt:api_public_topics'), HTTP_IF_NONE_MATCH=topics_etag).status_code, 200)
+
+    def test_53_secure_api(self):
+        url = reverse('awt:api_secure_topics')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.login(username='test', password='12345')
+        response = self.client.get(url)
+        self.assertEqual([topic['name'] for topic in response.json()['results']], ['private', 'public'])
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(reverse('awt:api_secure_entry', kwargs={'kind': 'goals', 'entry_id': self.secret.id}))
+        self.assertEqual(response.json()['text'], 'secret')
+        self.client.login(username='gary', password='12345')
+        self.assertEqual(self.client.get(reverse('awt:api_secure_entries', kwargs={
+            'topic_id': self.private.id, 'kind': 'goals'})).status_code, 404)
+        self.assertEqual(self.client.get(url).json(), {'results': [], 'next': None})
+
+
+class SearchTest(TestCase):
+    '''Class to check the full-text entry search'''
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.public = Topic.objects.create(topic_name='legs', owner=self.user1)
+        self.private = Topic.objects.create(topic_name='secret', owner=self.user1, view_option=False)
+        self.mistake = Mistake.objects.create(topic=self.public, summary='Squat', text='Knee pain on the last set')
+        self.progress = Progress.objects.create(topic=self.public, summary='Knee pain again', text='knee pain, knee pain')
+        Progress.objects.create(topic=self.private, summary='Lunge', text='knee pain')
+        Goal.objects.create(topic=self.public, summary='Deadlift', text='no pain at all')
+
+    def test_54_public_search_is_ranked(self):
+        response = self.client.get(reverse('awt:public_search'), {'q': 'knee pain'})
+        hits = list(response.context['hits'])
+        self.assertEqual([(hit.kind, hit.id) for hit in hits],
+                         [('progress_list', self.progress.id), ('mistakes_list', self.mistake.id)])
+        self.assertTrue(all(timezone.is_aware(hit.date_added) for hit in hits))
+        self.assertContains(response, reverse('awt:public_subtopic_detail', kwargs={
+            'subtopic_id': self.mistake.id, 'subtopic_name': 'mistakes_list'}))
+        # Stemmed, and query syntax is not an error
+        self.assertEqual(len(self.client.get(reverse('awt:public_search'), {'q': 'knees'}).context['hits']), 2)
+        self.assertEqual(len(self.client.get(reverse('awt:public_search'), {'q': '"knee (*:'}).context['hits']), 2)
+        self.assertIsNone(self.client.get(reverse('awt:public_search')).context['hits'])
+
+    def test_55_secure_search_pages(self):
+        for n in range(5):
+            Goal.objects.create(topic=self.private, summary='Row %d' % n, text='knee pain')
+        self.assertEqual(self.client.get(reverse('awt:secure_search'), {'q': 'knee'}).status_code, 302)
+        self.client.login(username='test', password='12345')
+        seen, cursor = [], None
+        while True:
+            page = search.search_entries('knee pain', owner=self.user1, cursor=cursor, per_page=3)
+            seen += [(hit.kind, hit.id) for hit in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+        response = self.client.get(reverse('awt:secure_search'), {'q': 'knee pain'})
+        self.assertEqual(len(response.context['hits']), 8)
+        self.client.login(username='gary', password='12345')
+        self.assertEqual(len(self.client.get(reverse('awt:secure_search'), {'q': 'knee pain'}).context['hits']), 0)
+
+    def test_56_index_follows_writes(self):
+        self.mistake.text = 'sore shoulder'
+        self.mistake.summary = 'Press'
+        self.mistake.save()
+        self.progress.delete()
+        Goal.objects.bulk_create([Goal(topic=self.public, summary='Shoulder', text='shoulder mobility')])
+        hits = self.client.get(reverse('awt:public_search'), {'q': 'shoulder'}).context['hits']
+        self.assertEqual(sorted(hit.kind for hit in hits), ['goals_list', 'mistakes_list'])
+        self.assertEqual(len(self.client.get(reverse('awt:public_search'), {'q': 'knee'}).context['hits']), 0)
+
+
+class TimelineTest(TestCase):
+    '''Class to check the cross-kind activity timeline'''
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='legs', owner=self.user1)
+        self.other = Topic.objects.create(topic_name='arms', owner=self.user1, view_option=False)
+        # Entries interleaved over time, with ties on date_added across and within kinds
+        start = timezone.now()
+        self.expected = []
+        with explicit_timestamps(Goal, Progress, Mistake):
+            for n in range(12):
+                model = [Goal, Progress, Mistake][n % 3]
+                topic = self.topic if n % 2 else self.other
+                entry = model.objects.create(topic=topic, summary='e%d' % n, text='t',
+                                             date_added=start - datetime.timedelta(minutes=n // 4))
+                self.expected.append(entry)
+        Goal.objects.create(topic=Topic.objects.create(topic_name='theirs', owner=self.user2), summary='x', text='x')
+
+    def pages(self, **kwargs):
+        seen, cursor = [], None
+        while True:
+            page = timeline.timeline(cursor=cursor, per_page=5, **kwargs)
+            seen += [(entry.kind, entry.id) for entry in page]
+            # A datetime on every database, as the ORM would return it
+            self.assertTrue(all(timezone.is_aware(entry.date_added) for entry in page))
+            cursor = page.next_cursor
+            if cursor is None:
+                return seen
+
+    def ordered(self, entries):
+        kinds = {Goal: (0, 'goals_list'), Progress: (1, 'progress_list'), Mistake: (2, 'mistakes_list')}
+        entries = sorted(entries, key=lambda e: (e.date_added, kinds[type(e)][0], e.id), reverse=True)
+        return [(kinds[type(e)][1], e.id) for e in entries]
+
+    def test_58_user_timeline_interleaves_kinds(self):
+        self.assertEqual(self.pages(owner=self.user1), self.ordered(self.expected))
+        self.assertEqual(self.pages(topic=self.topic), self.ordered([e for e in self.expected if e.topic_id == self.topic.id]))
+
+    def test_59_timeline_views(self):
+        url = reverse('awt:secure_timeline')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='test', password='12345')
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['entries']), 12)
+        self.assertContains(response, reverse('awt:secure_subtopic_detail', kwargs={
+            'topic_id': self.other.id, 'subtopic_name': 'goals_list', 'subtopic_id': self.expected[0].id}))
+        self.assertEqual(self.client.get(reverse('awt:secure_topic_timeline', kwargs={'topic_id': self.topic.id})).status_code, 200)
+        self.client.login(username='gary', password='12345')
+        self.assertEqual(self.client.get(reverse('awt:secure_topic_timeline', kwargs={'topic_id': self.topic.id})).status_code, 404)
+        self.assertEqual(len(self.client.get(url).context['entries']), 1)
+
+    def test_60_public_topic_timeline(self):
+        response = self.client.get(reverse('awt:public_topic_timeline', kwargs={'topic_id': self.topic.id}))
+        self.assertEqual(len(response.context['entries']), 6)
+        self.assertEqual(self.client.get(reverse('awt:public_topic_timeline', kwargs={'topic_id': self.other.id})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('awt:public_topic_timeline', kwargs={'topic_id': self.topic.id}),
+                                         {'cursor': 'WzFd'}).status_code, 404)
+
+
+class ChartTest(TestCase):
+    '''Class to check the topic charts and their render cache'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.user2 = User.objects.create_user(username='gary', email='gary@gary.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='legs', owner=self.user1)
+        self.private = Topic.objects.create(topic_name='arms', owner=self.user1, view_option=False)
+        Goal.objects.create(topic=self.topic, summary='g', text='g')
+        Progress.objects.create(topic=self.topic, summary='p', text='p')
+
+    def chart_url(self, topic, chart='weekly', fmt='svg'):
+        return reverse('awt:topic_chart', kwargs={'topic_id': topic.id, 'chart': chart, 'fmt': fmt})
+
+    def test_62_svg_charts_are_cached_until_data_changes(self):
+        for chart in charts.CHARTS:
+            response = self.client.get(self.chart_url(self.topic, chart))
+            self.assertEqual(response['Content-Type'], 'image/svg+xml')
+            self.assertIn(b'<svg', response.content)
+        # Topic and stats lookups only, the rendering comes from the cache
+        with self.assertNumQueries(2):
+            cached = self.client.get(self.chart_url(self.topic)).content
+        Mistake.objects.create(topic=self.topic, summary='m', text='m')
+        with CaptureQueriesContext(connection) as queries:
+            redrawn = self.client.get(self.chart_url(self.topic)).content
+        self.assertGreater(len(queries), 2)
+        self.assertNotEqual(cached, redrawn)
+        self.assertIn(b'Mistakes', redrawn)
+
+    def test_63_chart_access(self):
+        self.assertEqual(self.client.get(self.chart_url(self.private)).status_code, 404)
+        self.assertEqual(self.client.get(self.chart_url(self.topic, 'nope')).status_code, 404)
+        self.assertEqual(self.client.get(self.chart_url(self.topic, fmt='gif')).status_code, 404)
+        self.client.login(username='test', password='12345')
+        self.assertEqual(self.client.get(self.chart_url(self.private)).status_code, 200)
+        self.client.login(username='gary', password='12345')
+        self.assertEqual(self.client.get(self.chart_url(self.private)).status_code, 404)
+
+    @unittest.skipUnless(charts.png_available(), 'CairoSVG needs the cairo library')
+    def test_64_png_is_rasterized_in_the_background(self):
+        url = self.chart_url(self.topic, fmt='png')
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Retry-After']), (202, '1'))
+        deadline = time.monotonic() + 30
+        while response.status_code == 202 and time.monotonic() < deadline:
+            time.sleep(0.1)
+            response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+    def test_85_failed_png_falls_back_to_svg(self):
+        url = self.chart_url(self.topic, fmt='png')
+        future = concurrent.futures.Future()
+        future.set_exception(OSError('no cairo'))
+        with unittest.mock.patch.object(charts, 'png_available', return_value=True):
+            with self.assertLogs('app_workout_tracker.charts', 'ERROR'):
+                charts._store_png(charts.chart_key(self.topic, 'weekly', 'png'), future)
+            response = self.client.get(url)
+            self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/svg+xml'))
+            self.assertContains(response, '<svg')
+            # New data is a new key, rasterized again
+            Goal.objects.create(topic=self.topic, summary='g2', text='g2')
+            with unittest.mock.patch.object(charts, '_get_pool') as pool:
+                self.assertEqual(self.client.get(url).status_code, 202)
+            self.assertTrue(pool.return_value.submit.called)
+            charts._pending.clear()
+
+
+@override_settings(ASYNC_DB_THREAD_SENSITIVE=False)
+class AsyncViewsTest(TransactionTestCase):
+    '''Class to test the async public views the way ASGI serves them, their queries running in the thread pool'''
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='async', owner=self.user1, view_option=True)
+        self.goal = Goal.objects.create(topic=self.topic, summary='async goal', text='async text')
+
+    async def test_65_concurrent_public_requests(self):
+        client = AsyncClient()
+        responses = await asyncio.gather(
+            client.get(reverse('awt:public_topics_list')),
+            client.get(reverse('awt:public_subtopic_list', kwargs={'topic_id': self.topic.id, 'subtopic_name': 'goals_list'})),
+            client.get(reverse('awt:public_subtopic_detail', kwargs={'subtopic_id': self.goal.id, 'subtopic_name': 'goals_list'})),
+            client.get(reverse('awt:public_subtopic_detail', kwargs={'subtopic_id': self.goal.id + 1, 'subtopic_name': 'goals_list'})),
+        )
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 404])
+        self.assertContains(responses[0], 'Async')
+        self.assertContains(responses[1], 'async goal')
+        self.assertContains(responses[2], 'async text')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_test'])
+class ReplicaRouterTest(TransactionTestCase):
+    '''Class to test the read replica routing, against a second connection to the test database'''
+
+    def setUp(self):
+        cache.clear()
+        connections.databases['replica_test'] = dict(connections.databases['default'])
+        self.addCleanup(self.drop_replica)
+        self.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        self.topic = Topic.objects.create(topic_name='replicated', owner=self.user1, view_option=True)
+        Goal.objects.create(topic=self.topic, summary='replicated goal', text='replicated text')
+
+    def drop_replica(self):
+        connections['replica_test'].close()
+        del connections['replica_test']
+        del connections.databases['replica_test']
+
+    def test_66_reads_follow_the_replica_scope(self):
+        self.assertEqual(router.db_for_read(Topic), 'default')
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Topic), 'replica_test')
+            self.assertEqual(router.db_for_read(User), 'default')
+            self.assertEqual(router.db_for_write(Topic), 'default')
+            with routers.primary_reads():
+                self.assertEqual(router.db_for_read(Topic), 'default')
+        self.assertEqual(router.db_for_read(Topic), 'default')
+
+    def test_67_list_views_read_from_the_replica_until_a_write(self):
+        self.client.login(username='test', password='12345')
+        urls = [reverse('awt:public_subtopic_list', kwargs={'topic_id': self.topic.id, 'subtopic_name': 'goals_list'}),
+                reverse('awt:public_topic_timeline', kwargs={'topic_id': self.topic.id}),
+                reverse('awt:secure_topics_list'), reverse('awt:secure_search') + '?q=replicated']
+        for url in urls:
+            with CaptureQueriesContext(connections['replica_test']) as replica:
+                self.assertContains(self.client.get(url), 'replicated')
+            self.assertTrue(replica.captured_queries, url)
+
+        response = self.client.post(reverse('awt:add_topic'), {'topic_name': 'just written'})
+        self.assertIn(routers.READ_YOUR_WRITES_COOKIE, response.cookies)
+        for url in urls:
+            with CaptureQueriesContext(connections['replica_test']) as replica:
+                response = self.client.get(url)
+            self.assertEqual(replica.captured_queries, [], url)
+        self.assertContains(response, 'replicated')
+        self.assertContains(self.client.get(reverse('awt:secure_topics_list')), 'Just Written')
+
+
+class MetricsTest(TestCase):
+    '''Class to test the Server-Timing headers and the Prometheus metrics of the requests'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='timed', owner=cls.user1)
+        Goal.objects.create(topic=cls.topic, summary='timed goal', text='timed text')
+
+    def setUp(self):
+        metrics.reset()
+        self.client.login(username='test', password='12345')
+        self.url = reverse('awt:secure_subtopic_list', kwargs={'topic_id': self.topic.id, 'topic_name': 'timed',
+                                                               'subtopic_name': 'goals_list'})
+
+    @override_settings(SERVER_TIMING=True)
+    def test_68_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'view', 'template'})
+        self.assertIn('desc="%d queries"' % len(queries), timing['db'])
+        with override_settings(SERVER_TIMING=False):
+            self.assertFalse(self.client.get(self.url).has_header('Server-Timing'))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_69_metrics_endpoint(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE awt_view_seconds histogram', lines)
+        self.assertIn('awt_view_seconds_count{view="awt:secure_subtopic_list"} 2', lines)
+        self.assertIn('awt_view_seconds_bucket{view="awt:secure_subtopic_list",le="+Inf"} 2', lines)
+        self.assertTrue(any(line.startswith('awt_db_queries_sum{view="awt:secure_subtopic_list"} ') for line in lines))
+
+
+class ProfilingTest(TestCase):
+    '''Class to test the opt-in profiles of sampled and slow requests'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='profiled', owner=cls.user1)
+        cls.goal = Goal.objects.create(topic=cls.topic, summary='profiled goal', text='profiled text')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.client.login(username='test', password='12345')
+        self.url = reverse('awt:edit_subtopic', kwargs={'subtopic_id': self.goal.id, 'subtopic_name': 'goals_list'})
+
+    def profiled(self, **options):
+        middleware = ['app_workout_tracker.profiling.ProfilingMiddleware'] + list(settings.MIDDLEWARE)
+        options.setdefault('PROFILE_REQUESTS', 0)
+        options.setdefault('PROFILE_SLOW_SECONDS', 0)
+        return override_settings(MIDDLEWARE=middleware, PROFILE_DIR=self.directory, **options)
+
+    def test_70_sampled_requests_are_profiled_with_their_sql(self):
+        with self.profiled(PROFILE_REQUESTS=1):
+            self.client.post(self.url, {'summary': 'edited', 'text': 'edited'})
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual([os.path.splitext(name)[1] for name in names], ['.prof', '.sql'])
+        self.assertIn('-awt.edit_subtopic-u%d-' % self.user1.id, names[0])
+        pstats.Stats(os.path.join(self.directory, names[0]))
+        with open(os.path.join(self.directory, names[1])) as sql:
+            dump = sql.read()
+        self.assertTrue(dump.startswith('-- POST %s in ' % self.url))
+        self.assertIn('UPDATE "app_workout_tracker_goal"', dump)
+        self.assertNotIn('edited', dump)
+
+    def test_71_only_slow_requests_keep_their_stacks(self):
+        with self.profiled(PROFILE_SLOW_SECONDS=60):
+            self.client.get(self.url)
+        self.assertEqual(os.listdir(self.directory), [])
+        with self.profiled(PROFILE_SLOW_SECONDS=1e-9, PROFILE_KEEP=2):
+            for n in range(3):
+                self.client.get(self.url)
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual([os.path.splitext(name)[1] for name in names], ['.folded', '.sql', '.folded', '.sql'])
+
+
+class ListRenderingTest(TestCase):
+    '''Class to test the cached rows and the icon sprite of the list templates'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='rendered', owner=cls.user1, view_option=True)
+        cls.goal = Goal.objects.create(topic=cls.topic, summary='first summary', text='text')
+
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+        self.client.login(username='test', password='12345')
+
+    def test_72_cached_rows_follow_the_data(self):
+        urls = [reverse('awt:public_subtopic_list', kwargs={'topic_id': self.topic.id, 'subtopic_name': 'goals_list'}),
+                reverse('awt:secure_subtopic_list', kwargs={'topic_id': self.topic.id, 'topic_name': 'rendered',
+                                                            'subtopic_name': 'goals_list'})]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertContains(response, 'first summary')
+            self.assertContains(response, '<use href="#icon-entry"/>', count=1)
+            self.assertContains(response, '<symbol id="icon-entry"', count=1)
+        self.client.post(reverse('awt:edit_subtopic', kwargs={'subtopic_id': self.goal.id, 'subtopic_name': 'goals_list'}),
+                         {'summary': 'second summary', 'text': 'text'})
+        for url in urls:
+            response = self.client.get(url)
+            self.assertContains(response, 'second summary')
+            self.assertNotContains(response, 'first summary')
+
+        self.assertContains(self.client.get(reverse('awt:secure_topics_list')), '<span class="badge bg-success">1</span>')
+        Goal.objects.create(topic=self.topic, summary='another', text='text')
+        self.assertContains(self.client.get(reverse('awt:secure_topics_list')), '<span class="badge bg-success">2</span>')
+
+
+class StaticFilesTest(TestCase):
+    '''Class to test the hashed, compressed static files collectstatic builds and the headers they are served with'''
+
+    def setUp(self):
+        cache.clear()
+
+    def test_73_collected_files_are_compressed_and_immutable(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(
+                STATIC_ROOT=root, STATICFILES_STORAGE='whitenoise.storage.CompressedManifestStaticFilesStorage'):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            head, body = self.client.get(reverse('awt:public_topics_list')).content.decode().split('</head>')
+            self.assertNotIn('https://', head)
+            scripts = re.findall(r'(?:href|src)="(/static/vendor/[^"]+)"', head)
+            self.assertEqual(len(scripts), 4)
+            for url in scripts:
+                self.assertRegex(url, r'\.[0-9a-f]{12}\.(css|js)$')
+                for encoding in ('br', 'gzip'):
+                    response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                    self.assertEqual(response['Content-Encoding'], encoding)
+                    self.assertEqual(response['Cache-Control'], 'max-age=315360000, public, immutable')
+                    response.close()
+            # Under ASGI, the same file without going through a thread
+            response = asyncio.run(AsyncClient().get(scripts[0], headers=[(b'host', b'testserver'),
+                                                                          (b'accept-encoding', b'gzip, br')]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'br')
+            response.close()
+            # The files without a hash in their names are not kept
+            self.assertFalse(os.path.exists(os.path.join(root, 'vendor', 'jquery-3.3.1', 'jquery.min.js')))
+
+
+class EntryKindTest(TestCase):
+    '''Class to test that the entry views fetch an entry, its topic and their owner check in one query'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.user2 = User.objects.create_user(username='other', email='other@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='kinds', owner=cls.user1, view_option=True)
+
+    def requests(self, subtopic_name, entry):
+        kwargs = {'subtopic_id': entry.id, 'subtopic_name': subtopic_name}
+        return [
+            ('get', reverse('awt:public_subtopic_detail', kwargs=kwargs)),
+            ('get', reverse('awt:secure_subtopic_detail', kwargs=dict(kwargs, topic_id=self.topic.id))),
+            ('get', reverse('awt:edit_subtopic', kwargs=kwargs)),
+            ('post', reverse('awt:edit_subtopic', kwargs=kwargs)),
+            ('get', reverse('awt:delete_subtopic', kwargs=kwargs)),
+        ]
+
+    def fetch(self, model, method, url):
+        '''Response of the request, the queries reading the entry with its topic and owner, and the other
+        queries reading a topic or a user besides the logged in one'''
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, {'summary': 'edited', 'text': 'edited'})
+        # lazy starts below zero for the logged in user, which the auth middleware reads
+        fetches, lazy = 0, -1
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            if 'FROM "%s"' % model._meta.db_table in sql:
+                # Without the join, it is the TopicStats update of a write reading the entry (see stats.py)
+                fetches += 'JOIN "%s"' % Topic._meta.db_table in sql
+            else:
+                lazy += 'FROM "%s"' % Topic._meta.db_table in sql or 'FROM "auth_user"' in sql
+        return response, fetches, lazy
+
+    def test_74_one_query_per_entry_fetch(self):
+        for subtopic_name, kind in kinds.KINDS.items():
+            entry = kind.model.objects.create(topic=self.topic, summary='kind summary', text='kind text')
+            self.client.login(username='test', password='12345')
+            for method, url in self.requests(subtopic_name, entry):
+                response, fetches, lazy = self.fetch(kind.model, method, url)
+                self.assertIn(response.status_code, (200, 302), url)
+                self.assertEqual((fetches, lazy), (1, 0), url)
+            self.assertFalse(kind.model.objects.filter(id=entry.id).exists())
+
+            # Other users' entries are a 404, from the same single query
+            entry = kind.model.objects.create(topic=self.topic, summary='kind summary', text='kind text')
+            self.client.login(username='other', password='12345')
+            for method, url in self.requests(subtopic_name, entry)[1:]:
+                response, fetches, lazy = self.fetch(kind.model, method, url)
+                self.assertEqual(response.status_code, 404, url)
+                self.assertEqual((fetches, lazy), (1, 0), url)
+            self.assertTrue(kind.model.objects.filter(id=entry.id).exists())
+        self.assertEqual(self.client.get(reverse('awt:public_subtopic_detail', kwargs={
+            'subtopic_id': entry.id, 'subtopic_name': 'notes_list'})).status_code, 404)
+
+
+class TopicDeletionTest(TestCase):
+    '''Class to test that a deleted topic is hidden at once and its entries deleted in batches'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='doomed', owner=cls.user1, view_option=True)
+        cls.goals = [Goal.objects.create(topic=cls.topic, summary='goal %d' % n, text='text') for n in range(5)]
+        for n in range(3):
+            Progress.objects.create(topic=cls.topic, summary='progress %d' % n, text='text')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='test', password='12345')
+
+    def test_75_deleted_topic_is_hidden_then_purged_in_batches(self):
+        self.assertEqual(self.client.get(reverse('awt:delete_topic', args=[self.topic.id])).status_code, 302)
+        self.assertNotContains(self.client.get(reverse('awt:public_topics_list')), 'Doomed')
+        self.assertEqual(self.client.get(reverse('awt:public_subtopic_detail', kwargs={
+            'subtopic_id': self.goals[0].id, 'subtopic_name': 'goals_list'})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('awt:api_secure_entry', kwargs={
+            'kind': 'goals', 'entry_id': self.goals[0].id})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('awt:delete_topic', args=[self.topic.id])).status_code, 404)
+        self.assertContains(self.client.get(reverse('awt:secure_topics_list')), 'being deleted, 8 entries left')
+
+        # Every batch updates the counts, which show how far the deletion is
+        self.assertEqual(deletion.delete_batch(Goal, self.topic.id, 2), 2)
+        self.assertContains(self.client.get(reverse('awt:secure_topics_list')), 'being deleted, 6 entries left')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(deletion.purge_topic(self.topic.id, batch_size=2, pause=0), 6)
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        # Goals 2 + 1, progress 2 + 1, no mistakes, then the stats row and the topic
+        self.assertEqual(len(deletes), 7)
+        self.assertTrue(all('LIMIT 2' in sql for sql in deletes[:5]))
+        self.assertFalse(Topic.all_objects.filter(id=self.topic.id).exists())
+        self.assertFalse(TopicStats.objects.filter(topic_id=self.topic.id).exists())
+
+        # The ones a restart left pending are finished by the command
+        topic = Topic.objects.create(topic_name='interrupted', owner=self.user1)
+        Mistake.objects.create(topic=topic, summary='mistake', text='text')
+        deletion.delete_topic(topic)
+        call_command('delete_pending_topics', stdout=io.StringIO())
+        self.assertFalse(Topic.all_objects.filter(id=topic.id).exists())
+        self.assertFalse(Mistake.objects.filter(topic_id=topic.id).exists())
+
+
+def add_task(a, b):
+    if a < 0:
+        raise ValueError('negative')
+    return a + b
+
+
+class JobQueueTest(TestCase):
+    '''Class to test claiming, retrying and polling the background jobs'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.user2 = User.objects.create_user(username='other', email='other@test.com', password='12345')
+
+    def setUp(self):
+        jobs.TASKS['add'] = add_task
+        self.addCleanup(jobs.TASKS.pop, 'add')
+
+    def poll(self, job):
+        return self.client.get(reverse('awt:api_secure_job', args=[job.id]))
+
+    def test_76_jobs_are_claimed_once_retried_then_failed(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nonexistent')
+        later = jobs.enqueue('add', {'a': 1, 'b': 1}, delay=60)
+        job = jobs.enqueue('add', {'a': 2, 'b': 3}, owner_id=self.user1.id)
+
+        claimed = jobs.claim('worker-1')
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, Job.RUNNING, 1))
+        # Neither the running job nor the one not due yet
+        self.assertIsNone(jobs.claim('worker-2'))
+        jobs.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.locked_by), (Job.DONE, 5, ''))
+
+        self.client.login(username='test', password='12345')
+        data = self.poll(job).json()
+        self.assertEqual((data['status'], data['result'], data['error']), ('done', 5, None))
+        self.assertEqual(self.poll(later).status_code, 404)
+        self.client.login(username='other', password='12345')
+        self.assertEqual(self.poll(job).status_code, 404)
+
+        failing = jobs.enqueue('add', {'a': -1, 'b': 0}, max_attempts=2)
+        jobs.run(jobs.claim('worker-1'))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Job.QUEUED, 1))
+        self.assertEqual(failing.error, 'ValueError: negative')
+        self.assertGreater(failing.run_at, timezone.now() + datetime.timedelta(seconds=settings.JOB_RETRY_DELAY - 5))
+        Job.objects.filter(id=failing.id).update(run_at=timezone.now())
+        jobs.run(jobs.claim('worker-1'))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(failing.finished_at)
+
+        # The job of a worker that died is queued again
+        Job.objects.filter(id=later.id).update(status=Job.RUNNING, locked_by='dead', attempts=1,
+                                               locked_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        later.refresh_from_db()
+        self.assertEqual((later.status, later.locked_by), (Job.QUEUED, ''))
+
+    def test_77_deleted_topic_is_purged_by_its_job(self):
+        topic = Topic.objects.create(topic_name='queued', owner=self.user1)
+        Goal.objects.create(topic=topic, summary='goal', text='text')
+        self.client.login(username='test', password='12345')
+        self.client.get(reverse('awt:delete_topic', args=[topic.id]))
+        job = Job.objects.get(task='purge_topic', owner=self.user1)
+        self.assertEqual(job.args, {'topic_id': topic.id})
+        self.assertEqual(self.poll(job).json()['status'], 'queued')
+        jobs.run(jobs.claim('worker-1'))
+        self.assertEqual(self.poll(job).json()['result'], 1)
+        self.assertFalse(Topic.all_objects.filter(id=topic.id).exists())
+
+
+class JobWorkersTest(TransactionTestCase):
+    '''Class to test that concurrent worker threads run every job exactly once'''
+
+    def setUp(self):
+        self.runs = []
+        jobs.TASKS['record'] = lambda number: self.runs.append(number)
+        self.addCleanup(jobs.TASKS.pop, 'record')
+
+    def test_78_concurrent_workers(self):
+        for number in range(40):
+            jobs.enqueue('record', {'number': number})
+        self.assertEqual(jobs.run_process(threads=4, burst=True, poll=0), 40)
+        self.assertEqual(sorted(self.runs), list(range(40)))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 40)
+
+
+
+class DeltaSyncTest(TestCase):
+    '''Class to test the changes since a cursor and the pushed batches of the offline clients'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.user2 = User.objects.create_user(username='other', email='other@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='synced', owner=cls.user1)
+        cls.goal = Goal.objects.create(topic=cls.topic, summary='goal', text='text')
+        Topic.objects.create(topic_name='not mine', owner=cls.user2)
+        # Bulk created like the seeded data, without a change number
+        Progress.objects.bulk_create([Progress(topic=cls.topic, summary='old %d' % n, text='text') for n in range(3)])
+
+    def setUp(self):
+        self.client.login(username='test', password='12345')
+
+    def pull(self, cursor=None):
+        data = self.client.get(reverse('awt:api_secure_sync'), {'cursor': cursor} if cursor else {}).json()
+        return [(change['kind'], change['id'], change.get('deleted', False)) for change in data['changes']], data
+
+    def push(self, batch):
+        return self.client.post(reverse('awt:api_secure_sync'), json.dumps(batch), content_type='application/json')
+
+    def test_79_changes_since_cursor(self):
+        with override_settings(SYNC_PAGE_SIZE=2):
+            seen, cursor = [], None
+            while True:
+                changes, data = self.pull(cursor)
+                seen += changes
+                cursor = data['cursor']
+                if not data['more']:
+                    break
+        # The unnumbered rows first, then in the order of their changes
+        progress = sorted(Progress.objects.filter(topic=self.topic).values_list('id', flat=True))
+        self.assertEqual(seen, [('progress', pk, False) for pk in progress]
+                         + [('topic', self.topic.id, False), ('goal', self.goal.id, False)])
+        self.assertEqual(self.pull(cursor)[0], [])
+
+        self.goal.summary = 'edited'
+        self.goal.save()
+        self.client.get(reverse('awt:delete_subtopic', kwargs={'subtopic_id': progress[0], 'subtopic_name': 'progress_list'}))
+        # Only the changes are read, whatever the size of the history
+        with self.assertNumQueries(7):
+            changes, data = self.pull(cursor)
+        self.assertEqual(changes, [('goal', self.goal.id, False), ('progress', progress[0], True)])
+        self.assertEqual(data['changes'][0]['summary'], 'edited')
+
+        # A topic being deleted is gone at once, its entries with it
+        self.client.get(reverse('awt:delete_topic', args=[self.topic.id]))
+        self.goal.refresh_from_db()
+        self.goal.save()
+        self.assertEqual(self.pull(data['cursor'])[0], [('topic', self.topic.id, True)])
+        self.assertEqual(self.client.get(reverse('awt:api_secure_sync'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_80_pushed_batch_is_saved_whole_or_not_at_all(self):
+        response = self.push([
+            {'kind': 'topic', 'ref': 't1', 'topic_name': 'offline', 'view_option': False},
+            {'kind': 'goal', 'ref': 'g1', 'topic_ref': 't1', 'summary': 'new goal', 'text': 'text'},
+            {'kind': 'goal', 'id': self.goal.id, 'base_seq': self.goal.change_seq, 'summary': 'edited offline'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([(result['ref'], result['kind']) for result in results], [('t1', 'topic'), ('g1', 'goal'), (None, 'goal')])
+        topic = Topic.objects.get(id=results[0]['id'])
+        self.assertEqual((topic.owner, topic.view_option), (self.user1, False))
+        self.assertEqual(Goal.objects.get(id=results[1]['id']).topic, topic)
+        self.goal.refresh_from_db()
+        self.assertEqual((self.goal.summary, self.goal.text, self.goal.change_seq), ('edited offline', 'text', results[2]['change_seq']))
+        self.assertEqual(TopicStats.objects.get(topic=topic).goal_count, 1)
+
+        other = Topic.objects.get(topic_name='not mine')
+        response = self.push([
+            {'kind': 'mistake', 'topic_id': self.topic.id, 'summary': 'saved?', 'text': 'text'},
+            {'kind': 'goal', 'id': self.goal.id, 'base_seq': self.goal.change_seq - 1, 'summary': 'stale'},
+            {'kind': 'progress', 'topic_id': other.id, 'summary': 'theirs', 'text': 'text'},
+            {'kind': 'goal', 'topic_id': self.topic.id, 'summary': ''},
+            {'kind': 'workout'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2, 3, 4])
+        self.assertIn('Conflict', response.json()['errors'][0]['error'])
+        self.assertFalse(Mistake.objects.filter(summary='saved?').exists())
+        self.assertEqual(self.push({'kind': 'topic'}).status_code, 400)
+        self.assertEqual(self.client.put(reverse('awt:api_secure_sync')).status_code, 405)
+
+    def test_84_push_needs_the_csrf_token_of_a_pull(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='test', password='12345')
+        url = reverse('awt:api_secure_sync')
+        batch = json.dumps([{'kind': 'goal', 'topic_id': self.topic.id, 'summary': 'from the app', 'text': 'text'}])
+        response = client.post(url, batch, content_type='application/json')
+        self.assertEqual((response.status_code, response['Content-Type']), (403, 'application/json'))
+        self.assertIn('CSRF', response.json()['error'])
+
+        # A pull hands out the token, which the push sends back in a header
+        self.assertEqual(client.get(url).status_code, 200)
+        token = client.cookies[settings.CSRF_COOKIE_NAME].value
+        response = client.post(url, batch, content_type='application/json', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Goal.objects.filter(summary='from the app', topic=self.topic).exists())
+        self.assertEqual(client.post(url, batch, content_type='application/json', HTTP_X_CSRFTOKEN='wrong').status_code, 403)
+
+
+class EntryDenormalizationTest(TestCase):
+    '''Class to test that entries carry their topic's owner and visibility, and are read on them alone'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='test', email='test@test.com', password='12345')
+        cls.user2 = User.objects.create_user(username='other', email='other@test.com', password='12345')
+        cls.topic = Topic.objects.create(topic_name='shared', owner=cls.user1, view_option=True)
+        cls.goal = Goal.objects.create(topic=cls.topic, summary='goal', text='text')
+        Progress.objects.bulk_create([Progress(topic=cls.topic, summary='progress', text='text')])
+        cls.progress = Progress.objects.get(summary='progress')
+
+    def entry_queries(self, url):
+        '''Status of the response and the queries reading the goal table'''
+        with CaptureQueriesContext(connection) as queries:
+            status = self.client.get(url).status_code
+        return status, [query['sql'] for query in queries.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "%s"' % Goal._meta.db_table in query['sql']]
+
+    def test_81_entries_follow_their_topic_without_joining_it(self):
+        for entry in (self.goal, self.progress):
+            entry.refresh_from_db()
+            self.assertEqual((entry.owner, entry.is_public), (self.user1, True))
+
+        public_url = reverse('awt:api_public_entry', args=['goals', self.goal.id])
+        secure_url = reverse('awt:api_secure_entry', args=['goals', self.goal.id])
+        self.client.login(username='test', password='12345')
+        for url in (public_url, secure_url):
+            status, queries = self.entry_queries(url)
+            self.assertEqual((status, len(queries)), (200, 1), url)
+            self.assertNotIn('JOIN "%s"' % Topic._meta.db_table, queries[0])
+
+        # Making the topic private hides its entries at once, from one update per entry table
+        self.topic.view_option = False
+        with CaptureQueriesContext(connection) as queries:
+            self.topic.save()
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "%s"' % Goal._meta.db_table) for query in queries), 1)
+        self.assertFalse(Goal.objects.public().exists())
+        self.assertFalse(Progress.objects.get(id=self.progress.id).is_public)
+        self.assertEqual(self.client.get(public_url).status_code, 404)
+        self.assertEqual(self.client.get(secure_url).status_code, 200)
+        self.client.login(username='other', password='12345')
+        self.assertEqual(self.client.get(secure_url).status_code, 404)
+
+        # Entries of a topic being deleted are gone for their owner too
+        self.client.login(username='test', password='12345')
+        deletion.delete_topic(self.topic)
+        self.assertFalse(Goal.objects.owned_by(self.user1).exists())
+        self.assertEqual(self.client.get(secure_url).status_code, 404)
+
+
+class SessionLoadTest(LiveServerTestCase):
+    '''Class to check the bench_sessions load generator'''
+
+    def test_82_session_steps_answer_as_expected(self):
+        steps = bench_sessions.session_steps('load_', 0, entries=4)
+        seen, response = [], None
+        try:
+            while True:
+                step, method, path, data, expected = steps.send(response)
+                answer = self.client.get(path) if method == 'GET' else self.client.post(path, data)
+                self.assertEqual(answer.status_code, expected, '%s %s' % (method, path))
+                response = bench_sessions.Response(answer.status_code, list(answer.items()), answer.content)
+                seen.append(step)
+        except StopIteration:
+            pass
+        self.assertEqual(seen.count('awt:add_subtopic'), 8)
+        self.assertIn('awt:edit_subtopic', seen)
+        topic = Topic.objects.get(owner__username='load_0')
+        self.assertEqual((topic.view_option, topic.stats.goal_count + topic.stats.progress_count + topic.stats.mistake_count), (True, 4))
+        self.assertEqual(Goal.objects.filter(topic=topic, summary='edited').count(), 1)
+
+    def test_83_load_against_a_live_server(self):
+        for driver in bench_sessions.DRIVERS:
+            with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+                call_command('bench_sessions', url=self.live_server_url, driver=driver, levels=[1], duration=2,
+                             prefix='load_%s_' % driver, output=output.name, stdout=io.StringIO())
+                report = json.load(output)
+            run, = report['servers'][0]['runs']
+            self.assertGreater(run['requests'], 0, driver)
+            self.assertEqual(run['errors'], 0, driver)
+            self.assertEqual(report['servers'][0]['knee_users'], 1)
+            self.assertEqual(run['steps']['users:register']['errors'], 0)
+            # The simulated users are removed afterwards
+            self.assertFalse(User.objects.filter(username__startswith='load_%s_' % driver).exists())
@@ -0,0 +1,97 @@
+'''Activity timeline: the Goal, Progress and Mistake entries of a topic or of a user, interleaved
+newest first, in one UNION ALL query.
+
+Every branch of the union reads at most one page (plus one row) of its own entry table, starting
+after the cursor, and the outer query merges them: a topic timeline from the (topic, -date_added,
+-id) index, a user timeline from the (owner, -date_added, -id) one on the owner every entry
+carries. A page therefore costs the same wherever it is in the history, and however many topics
+the user has.'''
+
+import collections
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, router
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+from .kinds import KINDS as ENTRY_KINDS
+from .models import Goal
+from .pagination import KeysetPage, decode_cursor, encode_cursor, raw_datetime
+
+## Entry models with their subtopic name; at equal date_added the later kind is listed first
+KINDS = [(kind.model, kind.subtopic_name) for kind in ENTRY_KINDS.values()]
+
+TimelineEntry = collections.namedtuple('TimelineEntry', 'kind id summary date_added topic_id topic_name')
+
+
+def _after(connection, number, cursor_key):
+    '''Keyset condition of one branch, which only holds entries of kind number'''
+    if cursor_key is None:
+        return '', []
+    date_added, kind, pk = cursor_key
+    # Raw SQL misses the ORM's conversion, SQLite stores naive UTC text
+    date_added = connection.ops.adapt_datetimefield_value(date_added)
+    if number < kind:
+        # Listed after every entry of the cursor's kind with the same date_added
+        return ' AND e.date_added <= %s', [date_added]
+    if number > kind:
+        return ' AND e.date_added < %s', [date_added]
+    # The plain range the index can seek on, then the ties already shown
+    return ' AND e.date_added <= %s AND (e.date_added < %s OR e.id < %s)', [date_added, date_added, pk]
+
+
+def _branch(connection, number, model, scope, cursor_key, limit):
+    table = model._meta.db_table
+    after, params = _after(connection, number, cursor_key)
+    sql = ('SELECT %d AS kind, e.id, e.summary, e.date_added, e.topic_id, t.topic_name '
+           'FROM %s e JOIN app_workout_tracker_topic t ON t.id = e.topic_id WHERE %s%s '
+           'ORDER BY e.date_added DESC, e.id DESC LIMIT %%s' % (number, table, scope[0], after))
+    return sql, scope[1] + params + [limit]
+
+
+def _cursor_key(cursor):
+    values = decode_cursor(cursor)
+    try:
+        date_added, kind, pk = parse_datetime(values[0]), int(values[1]), int(values[2])
+    except (IndexError, TypeError, ValueError):
+        raise Http404('Invalid page cursor')
+    if date_added is None:
+        raise Http404('Invalid page cursor')
+    return date_added, kind, pk
+
+
+def timeline(topic=None, owner=None, cursor=None, per_page=None):
+    '''KeysetPage of the TimelineEntries of topic, or of every topic of owner, newest first'''
+    per_page = per_page or settings.LIST_PAGE_SIZE
+    # Raw SQL skips the router, ask it where the entry tables are read from
+    connection = connections[router.db_for_read(Goal)]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        raise NotSupportedError('The timeline needs PostgreSQL or SQLite')
+    if topic is not None:
+        scope = ('e.topic_id = %s', [topic.pk])
+    elif owner is not None:
+        # Topics being deleted are left out (see deletion.py), checked on the row joined for its name
+        scope = ('e.owner_id = %s AND NOT t.pending_delete', [owner.pk])
+    else:
+        raise ValueError('timeline() needs a topic or an owner')
+
+    cursor_key = _cursor_key(cursor) if cursor else None
+    branches, params = [], []
+    for number, (model, kind) in enumerate(KINDS):
+        sql, branch_params = _branch(connection, number, model, scope, cursor_key, per_page + 1)
+        # Wrapped, as a member of a UNION could not have an ORDER BY and LIMIT of its own
+        branches.append('SELECT * FROM (%s) b%d' % (sql, number))
+        params += branch_params
+    sql = ('SELECT * FROM (%s) entries ORDER BY date_added DESC, kind DESC, id DESC LIMIT %%s'
+           % ' UNION ALL '.join(branches))
+    params.append(per_page + 1)
+
+    with connection.cursor() as db:
+        db.execute(sql, params)
+        rows = [row[:3] + (raw_datetime(connection, row[3]),) + row[4:] for row in db.fetchall()]
+    entries = [TimelineEntry(KINDS[row[0]][1], *row[1:]) for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor(last[3], last[0], last[1])
+    return KeysetPage(entries, cursor=cursor, next_cursor=next_cursor)
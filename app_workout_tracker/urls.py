@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path
-from . import views
+from . import api, views
 
 
 app_name= 'awt'
@@ -12,6 +12,12 @@ urlpatterns =[
     path('public_list/<int:topic_id>/subtopic_list/<str:subtopic_name>', views.public_subtopic_list, name='public_subtopic_list'),
     # Public sub_topic detail
     path('public_list/<int:subtopic_id>/<str:subtopic_name>', views.public_subtopic_detail, name='public_subtopic_detail'),
+    # Public topic timeline of all entry kinds
+    path('public_list/<int:topic_id>/timeline/', views.public_topic_timeline, name='public_topic_timeline'),
+    # Topic charts, of public topics or the user's own ones (svg or png)
+    path('charts/<int:topic_id>/<str:chart>.<str:fmt>', views.topic_chart, name='topic_chart'),
+    # Public entry search
+    path('search/', views.public_search, name='public_search'),
     ## ************SECURE VIEW************ ##
     # Secure topic list
     path('secure_list/', views.secure_topics_list.as_view(), name='secure_topics_list'),
@@ -20,6 +26,11 @@ urlpatterns =[
     # Secure sub_topic detail
     path('secure_list/<str:topic_id>/<str:subtopic_name>/<int:subtopic_id>/',views.secure_subtopic_detail, name='secure_subtopic_detail'),
             ##(The DetailView generic view expects the primary key value captured from the URL to be called "pk")##
+    # Secure timeline of all entry kinds, of every topic or of one
+    path('secure_timeline/', views.secure_timeline, name='secure_timeline'),
+    path('secure_timeline/<int:topic_id>/', views.secure_timeline, name='secure_topic_timeline'),
+    # Secure entry search
+    path('secure_search/', views.secure_search, name='secure_search'),
     # Secure topic add
     path('add_topic/', views.add_topic, name='add_topic'),
     # Secure topic delete
@@ -29,6 +40,20 @@ urlpatterns =[
     # Secure subtopic edit
     path('edit_subtopic/<int:subtopic_id>/<str:subtopic_name>', views.edit_subtopic, name='edit_subtopic'),
     # Secure subtopic delete
-    path('delete_entry/<str:subtopic_name>/<int:subtopic_id>', views.delete_subtopic, name='delete_subtopic')
+    path('delete_entry/<str:subtopic_name>/<int:subtopic_id>', views.delete_subtopic, name='delete_subtopic'),
+    # Secure subtopic import from a file
+    path('import_entries/<int:topic_id>/<str:subtopic>', views.import_entries, name='import_entries'),
+    # Secure history export (csv or ndjson)
+    path('export/<str:fmt>/', views.export_history, name='export_history'),
+
+    ## ************JSON API************ ##
+    path('api/topics/', api.public_topics, name='api_public_topics'),
+    path('api/topics/<int:topic_id>/<str:kind>/', api.public_entries, name='api_public_entries'),
+    path('api/entries/<str:kind>/<int:entry_id>/', api.public_entry, name='api_public_entry'),
+    path('api/secure/topics/', api.secure_topics, name='api_secure_topics'),
+    path('api/secure/topics/<int:topic_id>/<str:kind>/', api.secure_entries, name='api_secure_entries'),
+    path('api/secure/entries/<str:kind>/<int:entry_id>/', api.secure_entry, name='api_secure_entry'),
+    path('api/secure/jobs/<int:job_id>/', api.secure_job, name='api_secure_job'),
+    path('api/secure/sync/', api.secure_sync, name='api_secure_sync'),
 
 ]
\ No newline at end of file
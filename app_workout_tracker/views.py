@@ -1,64 +1,96 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
 from django.shortcuts import render
-from .models import Topic, Progress, Goal, Mistake
+from .models import Topic
 from django.shortcuts import get_object_or_404, redirect
 from django.views import generic
-from .forms import TopicForm, GoalForm, MistakeForm, ProgressForm
+from .forms import TopicForm, ImportForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404
+from django.utils.decorators import method_decorator
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from .pagination import paginate_keyset
+from .caching import cached_public_topics
+from . import charts, deletion, export, importer
+from .search import search_entries
+from .timeline import timeline
+from .routers import read_from_replica
+from .kinds import get_kind, get_entry
 
 # Create your views here.
 
 ## Public Views ###
-def public_topics_list(request):
+## The read-only public views are async, so that under ASGI (see gunicorn.conf.py) a worker keeps serving
+## other connections while they wait on the database
+def db_to_async(function):
+    '''sync_to_async for the ORM and template work of the async views.
+
+    Django 3.1 runs every thread sensitive call of a process in one shared thread, so this uses the thread
+    pool instead unless ASYNC_DB_THREAD_SENSITIVE is set. The pool threads never see the request_started and
+    request_finished signals, hence the close_old_connections() calls that honour CONN_MAX_AGE for them.'''
+    if settings.ASYNC_DB_THREAD_SENSITIVE:
+        return sync_to_async(function, thread_sensitive=True)
+
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+@read_from_replica
+async def public_topics_list(request):
     '''List view of all public topics'''
-    public_topics = Topic.objects.filter(view_option=True)
-    # .order_by('-date_added') is not neeeded here as we already set the default ordering in Models
+    # Served from the cache, which is refreshed whenever a topic changes (see caching.py)
+    public_topics = await db_to_async(cached_public_topics)(request.GET.get('cursor'))
     context = {'public_topics':public_topics}
-    return render(request, 'workout_tracker/home.html', context)
+    return await db_to_async(render)(request, 'workout_tracker/home.html', context)
 
-def public_subtopic_list(request, topic_id, subtopic_name):
+@read_from_replica
+async def public_subtopic_list(request, topic_id, subtopic_name):
     '''Goal list of one of the public topics with topic_id
     This function takes topic_id and subtopic_name as arguments and render the appropriate subtopic accordingly'''
 
-    public_topic = get_object_or_404(Topic.objects.filter(view_option=True), id=topic_id)
-
-## More coding but efficient way to save queries:
-    if subtopic_name=='goals_list':
-        context = {'called_submodel': public_topic.goal_set.all(), 'subtopic_name': subtopic_name}
-
-    elif subtopic_name=='progress_list':
-        context = {'called_submodel': public_topic.progress_set.all(), 'subtopic_name': subtopic_name}
+    kind = get_kind(subtopic_name)
+    public_topic = await db_to_async(get_object_or_404)(Topic.objects.filter(view_option=True), id=topic_id)
+    entries = kind.entries(public_topic)
+    context = {'called_submodel': await db_to_async(paginate_keyset)(entries, request.GET.get('cursor')),
+               'subtopic_name': subtopic_name}
+    return await db_to_async(render)(request,'workout_tracker/entry_list.html', context)
 
-    elif subtopic_name=='mistakes_list':
-        context= {'called_submodel': public_topic.mistake_set.all(), 'subtopic_name' :subtopic_name}
 
+@read_from_replica
+def public_search(request):
+    '''Full-text search of the entries of all public topics'''
+    query = request.GET.get('q', '').strip()
+    hits = search_entries(query, cursor=request.GET.get('cursor')) if query else None
+    context = {'query': query, 'hits': hits}
+    return render(request, 'workout_tracker/search.html', context)
 
-    return render(request,'workout_tracker/entry_list.html', context)
 
+@read_from_replica
+def public_topic_timeline(request, topic_id):
+    '''Goals, progress and mistakes of one of the public topics, interleaved newest first'''
+    public_topic = get_object_or_404(Topic.objects.filter(view_option=True), id=topic_id)
+    context = {'entries': timeline(topic=public_topic, cursor=request.GET.get('cursor')), 'topic': public_topic}
+    return render(request, 'workout_tracker/timeline.html', context)
 
-def public_subtopic_detail(request, subtopic_id, subtopic_name):
-    public_goal_list = Goal.objects.filter(topic__view_option=True)
-    public_mistake_list = Mistake.objects.filter(topic__view_option=True)
-    public_progress_list = Progress.objects.filter(topic__view_option=True)
-
-    #churning_subtopic_name i.e from goals_list to goals
-    churned_subtopic_name = subtopic_name.split(subtopic_name[-5:])[0]
-
-    if churned_subtopic_name== 'goals':
-        detail = get_object_or_404(public_goal_list, id=subtopic_id)
-    elif churned_subtopic_name == 'mistakes':
-        detail = get_object_or_404(public_mistake_list, id=subtopic_id)
-    elif churned_subtopic_name== 'progress':
-       detail = get_object_or_404(public_progress_list, id=subtopic_id)
 
+@read_from_replica
+async def public_subtopic_detail(request, subtopic_id, subtopic_name):
+    '''Detail of an entry of one of the public topics'''
+    detail = await db_to_async(get_entry)(subtopic_name, subtopic_id)
     context = {'detail':detail, 'subtopic_name':subtopic_name}
-    return render(request, 'workout_tracker/entry_detail.html', context)
+    return await db_to_async(render)(request, 'workout_tracker/entry_detail.html', context)
 
 #
 ## Secure Views ###
 ## We are going to use Django's generic view heere instead of the legthy programming we did above for public view
 
+@method_decorator(read_from_replica, name='dispatch')
 class secure_topics_list(LoginRequiredMixin, generic.ListView):
     '''This is a list view class restricted to registered user, returns the topic list created by the user'''
 
@@ -66,10 +98,13 @@ class secure_topics_list(LoginRequiredMixin, generic.ListView):
     context_object_name = 'user_topics'
 
     def get_queryset(self):
-        user_topics = Topic.objects.filter(owner=self.request.user).order_by('-date_added')
-        return user_topics
+        # Entry counts come along in the same query, see TopicQuerySet.with_stats
+        # With the topics being deleted, whose counts show the entries they have left (see deletion.py)
+        user_topics = Topic.all_objects.filter(owner=self.request.user).with_stats()
+        return paginate_keyset(user_topics, self.request.GET.get('cursor'))
 
 
+@method_decorator(read_from_replica, name='dispatch')
 class secure_subtopic_list(LoginRequiredMixin, generic.ListView):
     '''This is a list view class restricted to registered user, returns the user's subtopic list based
     on the subtopic_name and topic_id passed from the home page'''
@@ -82,17 +117,10 @@ class secure_subtopic_list(LoginRequiredMixin, generic.ListView):
         topic_id = self.kwargs.get('topic_id')
         #Passing topic_name for display purpose on the template only
         topic_name=self.kwargs.get('topic_name')
+        kind = get_kind(subtopic_name)
         secure_topic = get_object_or_404(Topic.objects.filter(owner=self.request.user), id=topic_id)
-
-        if subtopic_name=='goals_list':
-            called_submodel= [subtopic_name, secure_topic.goal_set.all(), topic_name, topic_id]
-
-        elif subtopic_name=='progress_list':
-            called_submodel= [subtopic_name, secure_topic.progress_set.all(), topic_name, topic_id]
-
-        elif subtopic_name=='mistakes_list':
-            called_submodel= [subtopic_name, secure_topic.mistake_set.all(), topic_name, topic_id]
-
+        entries = kind.entries(secure_topic)
+        called_submodel = [subtopic_name, paginate_keyset(entries, self.request.GET.get('cursor')), topic_name, topic_id]
         return called_submodel
 
 @login_required
@@ -103,22 +131,33 @@ def secure_subtopic_detail(request, **kwargs):
     subtopic_name=kwargs.get('subtopic_name')
     topic_id=kwargs.get('topic_id')
 
-    if subtopic_name=='goals_list':
-        filtered_submodel = Goal.objects.filter(topic__owner=request.user)
-        detail = get_object_or_404(filtered_submodel, id=subtopic_id)
-
-    if subtopic_name=='progress_list':
-        filtered_submodel = Progress.objects.filter(topic__owner=request.user)
-        detail = get_object_or_404(filtered_submodel, id=subtopic_id)
-
-    if subtopic_name=='mistakes_list':
-        filtered_submodel = Mistake.objects.filter(topic__owner=request.user)
-        detail = get_object_or_404(filtered_submodel, id=subtopic_id)
-
+    detail = get_entry(subtopic_name, subtopic_id, owner=request.user)
     context = {'detail': detail, 'subtopic_name':subtopic_name, 'topic_id':topic_id}
 
     return render(request, 'workout_tracker/secure_entry_detail.html', context)
 
+@login_required
+@read_from_replica
+def secure_search(request):
+    '''Full-text search of the entries of the user's own topics'''
+    query = request.GET.get('q', '').strip()
+    hits = search_entries(query, owner=request.user, cursor=request.GET.get('cursor')) if query else None
+    context = {'query': query, 'hits': hits, 'secure': True}
+    return render(request, 'workout_tracker/search.html', context)
+
+@login_required
+@read_from_replica
+def secure_timeline(request, topic_id=None):
+    '''Goals, progress and mistakes of one of the user's topics, or of all of them, interleaved newest first'''
+    cursor = request.GET.get('cursor')
+    if topic_id is None:
+        context = {'entries': timeline(owner=request.user, cursor=cursor)}
+    else:
+        secure_topic = get_object_or_404(Topic.objects.filter(owner=request.user), id=topic_id)
+        context = {'entries': timeline(topic=secure_topic, cursor=cursor), 'topic': secure_topic}
+    context['secure'] = True
+    return render(request, 'workout_tracker/timeline.html', context)
+
 @login_required
 def add_topic(request):
     '''Adding Topic entry'''
@@ -138,119 +177,122 @@ def add_topic(request):
 
 @login_required
 def delete_topic(request, topic_id):
-    '''Deleting topic entry'''
-    topic = Topic.objects.get(id=topic_id)
-    if topic.owner == request.user:
-        topic.delete()
-        return redirect('awt:secure_topics_list')
-    else:
-        raise Http404
+    '''Deleting topic entry: hidden at once, its entries are deleted in the background'''
+    topic = get_object_or_404(Topic, id=topic_id, owner=request.user)
+    deletion.delete_topic(topic)
+    return redirect('awt:secure_topics_list')
 
 
 @login_required
 def add_subtopic(request, topic_id, subtopic):
     '''Editing topic entry and redirecting to subtopic_list page'''
+    kind = get_kind(subtopic)
+    # Other users' topics are a 404
+    topic = get_object_or_404(Topic, id=topic_id, owner=request.user)
 
-    topic = Topic.objects.get(id=topic_id)
-    if topic.owner == request.user:
-
-        if request.method != 'POST':
-            # No data, create a blank form Check the subtopic_name, and generate the relevant form##
-            if subtopic == 'goals_list':
-                subtopic_form = GoalForm()
-            elif subtopic == 'progress_list':
-                subtopic_form = ProgressForm()
-            elif subtopic == 'mistakes_list':
-                subtopic_form = MistakeForm()
-
-        else:
-            # Post data submitted, process the form on the relevant form
-            if subtopic == 'goals_list':
-                subtopic_form = GoalForm(request.POST)
-            elif subtopic == 'progress_list':
-                subtopic_form = ProgressForm(request.POST)
-            elif subtopic == 'mistakes_list':
-                subtopic_form = MistakeForm(request.POST)
-
-            if subtopic_form.is_valid():
-                new_subtopic_form = subtopic_form.save(commit=False)
-                new_subtopic_form.topic = topic
-                new_subtopic_form.save()
-
-                return redirect('awt:secure_subtopic_list', topic_name=topic, topic_id=topic_id, subtopic_name=subtopic)
-
-        context = {'subtopic_form': subtopic_form, 'topic': topic, 'subtopic': subtopic}
-        # Passing topic:topic here to generate topic.id required for submitting the form.
-        return render(request, 'workout_tracker/add_subtopic.html', context)
-
+    if request.method != 'POST':
+        # No data, create a blank form of the subtopic's kind
+        subtopic_form = kind.form()
     else:
-        # User is not authorised
-        raise Http404
+        # Post data submitted, process the form of the subtopic's kind
+        subtopic_form = kind.form(request.POST)
+        if subtopic_form.is_valid():
+            new_subtopic_form = subtopic_form.save(commit=False)
+            new_subtopic_form.topic = topic
+            new_subtopic_form.save()
+
+            return redirect('awt:secure_subtopic_list', topic_name=topic, topic_id=topic_id, subtopic_name=subtopic)
+
+    context = {'subtopic_form': subtopic_form, 'topic': topic, 'subtopic': subtopic}
+    # Passing topic:topic here to generate topic.id required for submitting the form.
+    return render(request, 'workout_tracker/add_subtopic.html', context)
 
 @login_required
 def edit_subtopic(request, subtopic_id, subtopic_name):
     '''Editing topic entry and redirecting to subtopic_detail page: which needs subtopic_id, subtopic_name, topic_id kwarg'''
+    # Entries of other users' topics are a 404
+    subtopic = get_entry(subtopic_name, subtopic_id, owner=request.user)
+    form_class = get_kind(subtopic_name).form
     if request.method != 'POST':
-        if subtopic_name == 'goals_list':
-            subtopic = Goal.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = GoalForm(instance=subtopic)
-
-        elif subtopic_name == 'progress_list':
-            subtopic = Progress.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = ProgressForm(instance=subtopic)
-
-        elif subtopic_name == 'mistakes_list':
-            subtopic = Mistake.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = MistakeForm(instance=subtopic)
+        subtopic_form = form_class(instance=subtopic)
     else:
-        if subtopic_name == 'goals_list':
-            subtopic = Goal.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = GoalForm(instance=subtopic, data=request.POST)
-
-        elif subtopic_name == 'progress_list':
-            subtopic = Progress.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = ProgressForm(instance=subtopic, data=request.POST)
-
-        elif subtopic_name == 'mistakes_list':
-            subtopic = Mistake.objects.get(id=subtopic_id)
-            if subtopic.topic.owner == request.user:
-                subtopic_form = MistakeForm(instance=subtopic, data=request.POST)
-        try:
-            if subtopic_form.is_valid():
-                subtopic_form.save()
+        subtopic_form = form_class(instance=subtopic, data=request.POST)
+        if subtopic_form.is_valid():
+            subtopic_form.save()
+        return redirect('awt:secure_subtopic_detail', topic_id=subtopic.topic_id, subtopic_name=subtopic_name, subtopic_id=subtopic_id)
 
-            return redirect('awt:secure_subtopic_detail', topic_id=subtopic.topic.id, subtopic_name=subtopic_name,subtopic_id=subtopic_id)
-        except UnboundLocalError:
-            #This will be raised cos subtopic_form will be unbound variable which is called before being reference, if the user is not authorised.
-            raise Http404
-
-    try:
-        context = {'subtopic_form':subtopic_form, 'subtopic_name':subtopic_name, 'subtopic_id':subtopic_id}
-        return render(request, 'workout_tracker/edit_subtopic.html', context)
-    except UnboundLocalError:
-        # This will be raised cos subtopic_form will be unbound variable which is called before being reference, if the user is not authorised.
-        raise Http404
+    context = {'subtopic_form':subtopic_form, 'subtopic_name':subtopic_name, 'subtopic_id':subtopic_id}
+    return render(request, 'workout_tracker/edit_subtopic.html', context)
 
 @login_required
 def delete_subtopic(request, subtopic_id, subtopic_name):
     '''Deleting subtopic entry'''
-    if subtopic_name=='goals_list':
-        subtopic = Goal.objects.get(id=subtopic_id)
-    elif subtopic_name=='progress_list':
-        subtopic = Progress.objects.get(id=subtopic_id)
-    elif subtopic_name=='mistakes_list':
-        subtopic = Mistake.objects.get(id=subtopic_id)
-
-    if subtopic.topic.owner == request.user:
-        subtopic.delete()
-        return redirect('awt:secure_subtopic_list', topic_name=subtopic.topic, topic_id=subtopic.topic.id, subtopic_name=subtopic_name)
+    # Entries of other users' topics are a 404
+    subtopic = get_entry(subtopic_name, subtopic_id, owner=request.user)
+    topic = subtopic.topic
+    subtopic.delete()
+    return redirect('awt:secure_subtopic_list', topic_name=topic, topic_id=topic.id, subtopic_name=subtopic_name)
+
+
+@login_required
+def import_entries(request, topic_id, subtopic):
+    '''Importing a CSV or NDJSON file of entries into a topic in one go'''
+    get_kind(subtopic)
+    # Other users' topics are a 404
+    topic = get_object_or_404(Topic, id=topic_id, owner=request.user)
+
+    result = None
+    if request.method != 'POST':
+        form = ImportForm()
     else:
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = importer.file_format(upload.name)
+            if fmt is None:
+                form.add_error('file', 'Upload a .csv, .ndjson or .jsonl file.')
+            else:
+                result = importer.import_entries(topic, upload, fmt, subtopic)
+
+    context = {'form': form, 'topic': topic, 'subtopic': subtopic, 'result': result}
+    return render(request, 'workout_tracker/import_entries.html', context)
+
+
+@login_required
+def export_history(request, fmt):
+    '''Download every topic and entry of the user as csv or ndjson, streamed as it is read'''
+    if fmt not in export.FORMATS:
         raise Http404
+    response = StreamingHttpResponse(export.export_history(request.user, fmt), content_type=export.FORMATS[fmt])
+    response['Content-Disposition'] = 'attachment; filename="workout_history_%s.%s"' % (request.user.username, fmt)
+    return response
 
 
+@read_from_replica
+def topic_chart(request, topic_id, chart, fmt):
+    '''Chart of a public topic or of one of the user's own topics, as svg or png'''
+    if chart not in charts.CHARTS or fmt not in ('svg', 'png'):
+        raise Http404
+    topic = get_object_or_404(Topic, id=topic_id)
+    if not topic.view_option and topic.owner_id != request.user.id:
+        raise Http404
 
+    if fmt == 'svg':
+        return HttpResponse(charts.chart_svg(topic, chart), content_type='image/svg+xml')
+    if not charts.png_available():
+        raise Http404('PNG charts are not available on this server')
+    try:
+        png = charts.chart_png(topic, chart)
+    except OverflowError:
+        response = HttpResponse('Too many charts are being drawn, try again shortly.', status=503)
+        response['Retry-After'] = '5'
+        return response
+    except charts.RasterizeFailed:
+        # Logged when it failed, the SVG shows the same chart
+        return HttpResponse(charts.chart_svg(topic, chart), content_type='image/svg+xml')
+    if png is None:
+        # Being rasterized in the background, the client asks again
+        response = HttpResponse('The chart is being drawn, try again shortly.', status=202)
+        response['Retry-After'] = '1'
+        return response
+    return HttpResponse(png, content_type='image/png')
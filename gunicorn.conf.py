@@ -0,0 +1,15 @@
+'''gunicorn settings, read from the working directory whichever application the Procfile serves.
+
+SERVER_MODE=wsgi (the default) serves My_workout_tracker.wsgi with sync workers, each busy with
+one connection until its response is sent. SERVER_MODE=asgi serves My_workout_tracker.asgi with
+uvicorn workers, which keep many connections open at once and serve the async public views while
+others wait on slow clients. Compare the two with `manage.py bench_servers`.'''
+
+import os
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+if SERVER_MODE not in ('wsgi', 'asgi'):
+    raise RuntimeError('SERVER_MODE must be wsgi or asgi, not %r' % SERVER_MODE)
+
+if SERVER_MODE == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'